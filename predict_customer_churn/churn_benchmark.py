@@ -0,0 +1,365 @@
+"""
+Benchmarks of the churn library.
+
+Usage:
+    python churn_benchmark.py loading --workers 16
+    python churn_benchmark.py stages --sizes 10000 100000 1000000
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import json
+import time
+import argparse
+import logging
+import shutil
+import resource
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import joblib
+
+from churn_model_store import load_forest
+from churn_scoring import engineer_features
+from churn_library import ChurnLibrarySolution
+from churn_profile import StageProfiler
+from churn_eda import add_churn
+from churn_synthetic import write_synthetic
+
+# Stages of the library, in the order they run
+STAGES = ['import_data', 'perform_eda', 'perform_feature_engineering',
+          'train_models']
+
+logger = logging.getLogger()
+
+# Barrier of the loading benchmark, set by _init_loading_worker
+_BARRIER = None
+
+
+def memory_usage():
+    """
+    Returns the memory of the current process in MB.
+
+    Output:
+        - Dictionary with the resident set size (rss), the proportional
+          set size (pss, shared pages divided among the processes
+          mapping them) and the private memory of the process. Only rss
+          (peak) is available outside Linux.
+    """
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    usage[name] = int(rest.split()[0]) / 1024
+        return {'rss': usage['Rss'],
+                'pss': usage['Pss'],
+                'private': usage['Private_Clean'] + usage['Private_Dirty']}
+    except FileNotFoundError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': peak / 1024}
+
+
+def _loading_worker(task):
+    """
+    Loads a model in a fresh worker process and scores a sample.
+
+    Input:
+        - task: Tuple (loader, path, sample), loader being 'joblib',
+          'joblib_mmap' or 'mapped_forest'
+    Output:
+        - Dictionary with the load time and the memory of the worker
+    """
+    loader, path, sample = task
+    before = memory_usage()
+
+    tic = time.perf_counter()
+    if loader == 'joblib':
+        model = joblib.load(path)
+    elif loader == 'joblib_mmap':
+        model = joblib.load(path, mmap_mode='r')
+    else:
+        model = load_forest(path)
+    load_seconds = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    model.predict_proba(sample)
+    predict_seconds = time.perf_counter() - tic
+
+    # Keep the worker alive until all workers have loaded the model,
+    # so that the shared pages are accounted among all of them
+    _BARRIER.wait()
+    after = memory_usage()
+
+    result = {'loader': loader,
+              'load_seconds': load_seconds,
+              'predict_seconds': predict_seconds}
+    for name, value in after.items():
+        result[f'{name}_mb'] = value - before.get(name, 0)
+    return result
+
+
+def _init_loading_worker(barrier):
+    """
+    Shares the barrier of the loading benchmark with a worker process.
+
+    Input:
+        - barrier: multiprocessing Barrier for all the workers
+    """
+    global _BARRIER  # pylint: disable=global-statement
+    _BARRIER = barrier
+
+
+def benchmark_loading(args):
+    """
+    Measures load time and memory per worker of each model loader.
+
+    args.workers processes are started for each loader and all of them
+    keep the model loaded while their memory is measured.
+
+    Input:
+        - args: Parsed command line arguments
+    Output:
+        - results: List of dictionaries, one per worker and loader
+    """
+    encoder = joblib.load(args.encoder)
+    sample = engineer_features(pd.read_csv(args.data, index_col=0,
+                                           nrows=args.rows), encoder)
+
+    loaders = {'joblib': args.model,
+               'joblib_mmap': args.model,
+               'mapped_forest': args.forest}
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for loader, path in loaders.items():
+        barrier = context.Barrier(args.workers)
+        with context.Pool(args.workers,
+                          initializer=_init_loading_worker,
+                          initargs=(barrier,)) as pool:
+            tasks = [(loader, path, sample)] * args.workers
+            worker_results = pool.map(_loading_worker, tasks, chunksize=1)
+        results.extend(worker_results)
+
+        summary = pd.DataFrame(worker_results).mean(numeric_only=True)
+        logger.info("%s: load %.2fs, rss %.0f MB, pss %.0f MB per worker",
+                    loader, summary['load_seconds'], summary['rss_mb'],
+                    summary.get('pss_mb', float('nan')))
+    return results
+
+
+def _stages_worker(task):
+    """
+    Runs the library stages on one synthetic file in a fresh process.
+
+    Input:
+        - task: Tuple (path, folder, stages, search, shap_rows,
+          as_matrix)
+    Output:
+        - stages: List of the top-level stage records of StageProfiler
+    """
+    path, folder, stages, search, shap_rows, as_matrix = task
+
+    # Start empty, so that no figure or cached result is reused
+    shutil.rmtree(folder, ignore_errors=True)
+    profiler = StageProfiler()
+    cls = ChurnLibrarySolution(img_folder=folder / 'images',
+                               model_folder=folder / 'models',
+                               cache_folder=folder / 'cache',
+                               shap_max_rows=shap_rows,
+                               profiler=profiler)
+
+    df = cls.import_data(path)
+    if 'perform_eda' in stages:
+        cls.perform_eda(df)
+    else:
+        add_churn(df)
+    if 'perform_feature_engineering' in stages:
+        training_split = cls.perform_feature_engineering(
+            df, as_matrix=as_matrix)
+        if as_matrix:
+            training_split = training_split.split()
+        if 'train_models' in stages:
+            cls.train_models(*training_split, search=search)
+    return profiler.stages
+
+
+def _git_commit():
+    """
+    Returns the commit of the working tree, or None outside git.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_stages(args):
+    """
+    Measures throughput and peak memory of the library stages on
+    synthetic data of growing size.
+
+    The synthetic files are generated once into args.data_folder, and
+    each size runs in a fresh process so that memory measurements do
+    not leak between sizes.
+
+    Input:
+        - args: Parsed command line arguments
+    Output:
+        - report: Dictionary with the commit, the per stage and size
+          results and the scaling exponent of each stage (slope of
+          log time against log rows, 1 for linear scaling)
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n_rows in args.sizes:
+        path = Path(args.data_folder) / f'bank_data_{n_rows}.csv'
+        if not path.exists():
+            logger.info("Generating %s synthetic customers", n_rows)
+            write_synthetic(path, n_rows, source=args.source)
+
+        task = (path, Path(args.work_folder) / str(n_rows), args.stages,
+                args.search, args.shap_rows, args.feature_matrix)
+        with context.Pool(1) as pool:
+            records = pool.apply(_stages_worker, (task,))
+
+        for record in records:
+            if record['name'] not in args.stages:
+                continue
+            result = {'stage': record['name'],
+                      'rows': n_rows,
+                      'wall_seconds': record['wall_seconds'],
+                      'cpu_seconds': record['cpu_seconds'],
+                      'children_cpu_seconds':
+                          record['children_cpu_seconds'],
+                      'peak_rss_mb': record['peak_rss_mb'],
+                      'rows_per_second': n_rows / record['wall_seconds']}
+            results.append(result)
+            logger.info("%s, %s rows: %.2fs, %.0f rows/s, peak %.0f MB",
+                        result['stage'], n_rows, result['wall_seconds'],
+                        result['rows_per_second'], result['peak_rss_mb'])
+
+    frame = pd.DataFrame(results)
+    scaling = {}
+    for stage, group in frame.groupby('stage'):
+        if len(group) > 1:
+            scaling[stage] = float(np.polyfit(np.log(group['rows']),
+                                              np.log(group['wall_seconds']),
+                                              1)[0])
+
+    return {'commit': _git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'search': args.search,
+            'feature_matrix': args.feature_matrix,
+            'results': results,
+            'scaling': scaling}
+
+
+def compare_stages(report, baseline):
+    """
+    Logs the speedup of each stage and size against a baseline report.
+
+    Input:
+        - report: Dictionary returned by benchmark_stages
+        - baseline: Report of a previous run, e.g. of another commit
+    """
+    previous = {(result['stage'], result['rows']): result
+                for result in baseline['results']}
+    for result in report['results']:
+        before = previous.get((result['stage'], result['rows']))
+        if before is not None:
+            logger.info("%s, %s rows: %.2fx faster, %+.0f MB peak vs %s",
+                        result['stage'], result['rows'],
+                        before['wall_seconds'] / result['wall_seconds'],
+                        result['peak_rss_mb'] - before['peak_rss_mb'],
+                        (baseline['commit'] or 'baseline')[:8])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the churn library",
+        fromfile_prefix_chars="@",
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    loading = subparsers.add_parser(
+        "loading", help="Load time and memory of the model loaders")
+    loading.add_argument(
+        "--model", type=str, default="./models/rfc_model.pkl",
+        help="Path to the pickled random forest")
+    loading.add_argument(
+        "--forest", type=str, default="./models/rfc_model",
+        help="Folder of the forest exported by export_forest")
+    loading.add_argument(
+        "--encoder", type=str, default="./models/target_encoder.pkl",
+        help="Path to the pickled target encoder")
+    loading.add_argument(
+        "--data", type=str, default="./data/bank_data.csv",
+        help="CSV file with the customers scored by each worker")
+    loading.add_argument(
+        "--rows", type=int, default=1000,
+        help="Number of customers scored by each worker")
+    loading.add_argument(
+        "--workers", type=int, default=16,
+        help="Number of worker processes per loader")
+    loading.add_argument(
+        "--output", type=str, default="./logs/benchmark_loading.json",
+        help="JSON file for the results")
+
+    stages = subparsers.add_parser(
+        "stages", help="Throughput and memory of the library stages")
+    stages.add_argument(
+        "--sizes", type=int, nargs="+",
+        default=[10000, 100000, 1000000, 10000000],
+        help="Numbers of synthetic customers")
+    stages.add_argument(
+        "--stages", type=str, nargs="+", choices=STAGES, default=STAGES,
+        help="Stages to run")
+    stages.add_argument(
+        "--search", type=str, default="halving",
+        help="Hyperparameter search of train_models")
+    stages.add_argument(
+        "--feature_matrix", action="store_true",
+        help="Build the features as one float32 matrix")
+    stages.add_argument(
+        "--shap_rows", type=int, default=1000,
+        help="Maximum number of rows explained by SHAP")
+    stages.add_argument(
+        "--source", type=str, default="./data/bank_data.csv",
+        help="Real CSV file the synthetic data is modelled on")
+    stages.add_argument(
+        "--data_folder", type=str, default="./data/synthetic",
+        help="Folder of the generated synthetic files")
+    stages.add_argument(
+        "--work_folder", type=str, default="./logs/benchmark_stages",
+        help="Folder of the images and models written by the stages")
+    stages.add_argument(
+        "--baseline", type=str, default=None,
+        help="Results file of a previous run to compare with")
+    stages.add_argument(
+        "--output", type=str, default="./logs/benchmark_stages.json",
+        help="JSON file for the results")
+
+    ARGS = parser.parse_args()
+    if ARGS.benchmark == "loading":
+        RESULTS = benchmark_loading(ARGS)
+    else:
+        RESULTS = benchmark_stages(ARGS)
+        if ARGS.baseline:
+            with open(ARGS.baseline) as fp:
+                compare_stages(RESULTS, json.load(fp))
+
+    Path(ARGS.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(ARGS.output, 'w') as fp:
+        json.dump(RESULTS, fp, indent=2)
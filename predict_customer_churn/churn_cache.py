@@ -0,0 +1,148 @@
+"""
+On-disk cache used by the churn library to reuse expensive results
+(cross-validation scores, fitted models, ...) across runs.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import json
+import hashlib
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import joblib
+
+
+def fingerprint(*parts):
+    """
+    Returns a stable hex digest of the given objects.
+
+    Pandas objects are hashed row by row together with their column
+    names and dtypes, NumPy arrays through their raw bytes, and any
+    other object through its JSON (or repr) representation.
+
+    Input:
+        - parts: Objects to hash
+    Output:
+        - digest: Hexadecimal string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            dtypes = part.dtypes if isinstance(part, pd.DataFrame) \
+                else part.dtype
+            digest.update(repr(dtypes).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=True)
+                          .to_numpy().tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(f"{part.dtype}{part.shape}".encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True,
+                                     default=repr).encode())
+        # Separator, so that ('ab', 'c') and ('a', 'bc') differ
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Returns the blake2b digest of the content of a file, read in
+    blocks.
+
+    Input:
+        - path: Path to the file
+        - block_size: Number of bytes read at once
+    Output:
+        - digest: Hexadecimal string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Key/value store of joblib files in a folder, bounded in size.
+
+    Every read refreshes the modification time of the entry, and when
+    the folder grows over max_bytes the least recently used entries are
+    deleted first.
+    """
+
+    def __init__(self, folder, max_bytes=2 * 1024 ** 3):
+        """
+        Input:
+            - folder: Path to the folder holding the cached entries
+            - max_bytes: Maximum total size of the cached entries
+        """
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.folder / f"{key}.joblib"
+
+    def __contains__(self, key):
+        return self._path(key).exists()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for key, or default if it is missing.
+
+        Input:
+            - key: Entry key, e.g. computed with fingerprint
+            - default: Value returned when key is not cached
+        Output:
+            - value: Cached value or default
+        """
+        path = self._path(key)
+        try:
+            value = joblib.load(path)
+        except FileNotFoundError:
+            return default
+        # Mark the entry as recently used
+        os.utime(path)
+        return value
+
+    def set(self, key, value):
+        """
+        Stores value under key and evicts old entries if needed.
+
+        Input:
+            - key: Entry key, e.g. computed with fingerprint
+            - value: Picklable object to store
+        """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+
+        # Write next to the target and rename, so that a reader never
+        # sees a partially written entry
+        tmp_path = path.with_suffix('.tmp')
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+
+        self._evict()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache fits in
+        max_bytes.
+        """
+        entries = []
+        for path in self.folder.glob('*.joblib'):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # The most recent entry is always kept
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda e: e[0])[:-1]:
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= size
@@ -0,0 +1,539 @@
+"""
+One-pass, mergeable statistics for the EDA of the churn data.
+
+Each accumulator is updated chunk by chunk and two accumulators of
+disjoint chunks merge into the accumulator of their union, so the
+statistics of a file larger than memory can be computed by workers in
+parallel. The EDA plots are rendered from the merged summaries only.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+
+class MomentMatrix:
+    """
+    Pairwise co-moments of the numeric columns, from which the Pearson
+    correlation matrix is derived.
+
+    As in DataFrame.corr, every pair of columns only uses the rows where
+    both values are present. The sums are accumulated around a shift
+    (the means of the first chunk) to limit the cancellation of large
+    values.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.shift = None
+        self.n = None
+        self.sum = None
+        self.sum_sq = None
+        self.cross = None
+
+    def update(self, frame):
+        """
+        Adds the rows of frame.
+
+        Input:
+            - frame: Pandas dataframe, only its numeric columns are used
+        """
+        numeric = frame.select_dtypes('number')
+        if self.columns is None:
+            self.columns = list(numeric.columns)
+            self.shift = np.nan_to_num(numeric.mean().to_numpy())
+            size = len(self.columns)
+            self.n = np.zeros((size, size))
+            self.sum = np.zeros((size, size))
+            self.sum_sq = np.zeros((size, size))
+            self.cross = np.zeros((size, size))
+
+        values = numeric[self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        mask = present.astype(np.float64)
+        values = np.where(present, values - self.shift, 0.0)
+
+        # Entry [i, j] sums over the rows where columns i and j are
+        # both present
+        self.n += mask.T @ mask
+        self.sum += values.T @ mask
+        self.sum_sq += (values ** 2).T @ mask
+        self.cross += values.T @ values
+
+    def _shifted_sums(self, shift):
+        """
+        Returns the sums expressed around another shift.
+
+        Input:
+            - shift: Array with the new shift of each column
+        Output:
+            - sum, sum_sq, cross: Arrays of the shifted sums
+        """
+        delta = self.shift - shift
+        d_row, d_col = delta[:, None], delta[None, :]
+        cross = self.cross + d_col * self.sum + d_row * self.sum.T + \
+            self.n * d_row * d_col
+        sum_sq = self.sum_sq + 2 * d_row * self.sum + self.n * d_row ** 2
+        return self.sum + self.n * d_row, sum_sq, cross
+
+    def merge(self, other):
+        """
+        Adds the rows accumulated by other.
+
+        Input:
+            - other: MomentMatrix over the same columns
+        Output:
+            - self
+        """
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self.columns = other.columns
+            self.shift = other.shift
+            self.n = other.n.copy()
+            self.sum = other.sum.copy()
+            self.sum_sq = other.sum_sq.copy()
+            self.cross = other.cross.copy()
+            return self
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge moments of different columns")
+
+        # pylint: disable=protected-access
+        total, sum_sq, cross = other._shifted_sums(self.shift)
+        self.n += other.n
+        self.sum += total
+        self.sum_sq += sum_sq
+        self.cross += cross
+        return self
+
+    def correlation(self):
+        """
+        Returns the Pearson correlation matrix.
+
+        Output:
+            - corr: Pandas dataframe, NaN for pairs without variance
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.cross - self.sum * self.sum.T / self.n
+            var = self.sum_sq - self.sum ** 2 / self.n
+            corr = cov / np.sqrt(var * var.T)
+        corr = np.clip(corr, -1, 1)
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+
+class DistributionSketch:
+    """
+    Counts of the values of a numeric column.
+
+    Values are counted exactly while there are at most max_distinct of
+    them. Past that, they are counted in bins whose width is a power
+    of two, doubled as often as needed, so that sketches with different
+    widths still merge. Histograms, densities and quantiles are derived
+    from the counts.
+    """
+
+    def __init__(self, max_distinct=10000):
+        """
+        Input:
+            - max_distinct: Maximum number of distinct points kept
+        """
+        self.max_distinct = max_distinct
+        # None while the values are exact, else the bin width
+        self.width = None
+        self.points = np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.n_missing = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _add(self, points, counts):
+        points = np.concatenate([self.points, points])
+        counts = np.concatenate([self.counts, counts])
+        self.points, inverse = np.unique(points, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts,
+                                  minlength=len(self.points)) \
+            .astype(np.int64)
+
+        # Coarsen until the sketch fits in max_distinct points
+        while len(self.points) > self.max_distinct:
+            if self.width is None:
+                spread = max(self.max - self.min, np.finfo(float).tiny)
+                self._set_width(2.0 ** np.ceil(
+                    np.log2(spread / self.max_distinct)))
+            else:
+                self._set_width(2 * self.width)
+
+    def _set_width(self, width):
+        """
+        Re-bins the counts with a larger width.
+
+        Input:
+            - width: New bin width, a power of two
+        """
+        if self.width is None:
+            keys = np.floor(self.points / width)
+        else:
+            keys = np.floor(self.points / (width / self.width))
+        self.width = width
+        self.points, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=self.counts,
+                                  minlength=len(self.points)) \
+            .astype(np.int64)
+
+    def update(self, values):
+        """
+        Adds values.
+
+        Input:
+            - values: Array or Pandas series of numbers
+        """
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        self.n_missing += int((~present).sum())
+        values = values[present]
+        if not len(values):
+            return
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if self.width is not None:
+            values = np.floor(values / self.width)
+        points, counts = np.unique(values, return_counts=True)
+        self._add(points, counts)
+
+    def merge(self, other):
+        """
+        Adds the values counted by other.
+
+        Input:
+            - other: DistributionSketch
+        Output:
+            - self
+        """
+        other_width = other.width
+        points = other.points
+        if self.width != other_width:
+            width = max(self.width or 0, other_width or 0)
+            if self.width != width:
+                self._set_width(width)
+            points = np.floor(points / width) if other_width is None \
+                else np.floor(points / (width / other_width))
+
+        self.n_missing += other.n_missing
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add(points, other.counts)
+        return self
+
+    @property
+    def count(self):
+        """
+        Number of non-missing values.
+        """
+        return int(self.counts.sum())
+
+    def support(self):
+        """
+        Returns the counted values, or the centers of the bins.
+        """
+        if self.width is None:
+            return self.points
+        return (self.points + 0.5) * self.width
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile of the values (inverted CDF), exact
+        while the sketch counts exact values.
+
+        Input:
+            - q: Float or array of floats in [0, 1]
+        """
+        cumulative = np.cumsum(self.counts)
+        ranks = np.asarray(q) * (cumulative[-1] - 1)
+        return self.support()[np.searchsorted(cumulative, ranks,
+                                              side='right')]
+
+    def histogram(self, bins=10):
+        """
+        Returns the histogram of the values over [min, max].
+
+        Input:
+            - bins: Number of bins or array of bin edges
+        Output:
+            - counts, edges: As returned by np.histogram
+        """
+        return np.histogram(self.support(), bins=bins,
+                            range=(self.min, self.max),
+                            weights=self.counts)
+
+    def auto_bin_edges(self):
+        """
+        Returns bin edges following numpy's 'auto' rule, the smaller of
+        the Sturges and Freedman-Diaconis widths, with the interquartile
+        range taken from the sketch.
+
+        Output:
+            - edges: Array of bin edges
+        """
+        spread = self.max - self.min
+        if spread == 0:
+            return np.array([self.min - 0.5, self.max + 0.5])
+
+        width = spread / (np.log2(self.count) + 1)
+        q25, q75 = self.quantile([0.25, 0.75])
+        fd_width = 2 * (q75 - q25) * self.count ** (-1 / 3)
+        if fd_width > 0:
+            width = min(width, fd_width)
+        n_bins = int(np.ceil(spread / width))
+        return np.linspace(self.min, self.max, n_bins + 1)
+
+
+class CategoryCounter:
+    """
+    Counts of the levels of a categorical column.
+    """
+
+    def __init__(self):
+        self.counts = pd.Series(dtype=np.int64)
+
+    def update(self, values):
+        """
+        Adds values.
+
+        Input:
+            - values: Pandas series
+        """
+        counts = values.value_counts(sort=False)
+        counts.index = counts.index.astype(object)
+        self.counts = self.counts.add(counts[counts > 0], fill_value=0) \
+            .astype(np.int64)
+
+    def merge(self, other):
+        """
+        Adds the values counted by other.
+
+        Input:
+            - other: CategoryCounter
+        Output:
+            - self
+        """
+        self.counts = self.counts.add(other.counts, fill_value=0) \
+            .astype(np.int64)
+        return self
+
+    def value_counts(self, normalize=False):
+        """
+        Returns the counts sorted in descending order, like
+        Series.value_counts.
+
+        Input:
+            - normalize: If True, returns the proportions of the levels
+        """
+        counts = self.counts.sort_values(ascending=False, kind='mergesort')
+        return counts / counts.sum() if normalize else counts
+
+
+class EdaStats:
+    """
+    All the statistics drawn by the EDA: distribution sketches of
+    numeric columns, counts of categorical columns and the correlation
+    of the numeric columns.
+    """
+
+    def __init__(self, numeric_columns, category_columns,
+                 exclude_columns=()):
+        """
+        Input:
+            - numeric_columns: Columns summarized by DistributionSketch
+            - category_columns: Columns summarized by CategoryCounter
+            - exclude_columns: Columns left out of the correlation
+        """
+        self.sketches = {col: DistributionSketch()
+                         for col in numeric_columns}
+        self.categories = {col: CategoryCounter()
+                           for col in category_columns}
+        self.exclude_columns = list(exclude_columns)
+        self.moments = MomentMatrix()
+        self.n_rows = 0
+
+    def update(self, frame):
+        """
+        Adds the rows of frame.
+
+        Input:
+            - frame: Pandas dataframe
+        """
+        for col, sketch in self.sketches.items():
+            sketch.update(frame[col])
+        for col, counter in self.categories.items():
+            counter.update(frame[col])
+        self.moments.update(frame.drop(columns=self.exclude_columns))
+        self.n_rows += len(frame)
+
+    def merge(self, other):
+        """
+        Adds the rows accumulated by other.
+
+        Input:
+            - other: EdaStats over the same columns
+        Output:
+            - self
+        """
+        for col, sketch in self.sketches.items():
+            sketch.merge(other.sketches[col])
+        for col, counter in self.categories.items():
+            counter.merge(other.categories[col])
+        self.moments.merge(other.moments)
+        self.n_rows += other.n_rows
+        return self
+
+
+def add_churn(frame):
+    """
+    Adds the binary 'Churn' target derived from 'Attrition_Flag'.
+
+    Input:
+        - frame: Pandas dataframe of raw customer data
+    Output:
+        - frame, with the 'Churn' column
+    """
+    frame['Churn'] = (frame['Attrition_Flag'] != "Existing Customer") \
+        .astype(np.int64)
+    return frame
+
+
+def summarize_chunk(chunk, numeric_columns, category_columns,
+                    exclude_columns=()):
+    """
+    Computes the EdaStats of one chunk, e.g. in a worker process.
+
+    Input:
+        - chunk: Pandas dataframe of raw customer data
+        - numeric_columns, category_columns, exclude_columns: Passed to
+          EdaStats
+    Output:
+        - stats: EdaStats of the chunk
+    """
+    if 'Churn' not in chunk.columns:
+        chunk = add_churn(chunk)
+    stats = EdaStats(numeric_columns, category_columns, exclude_columns)
+    stats.update(chunk)
+    return stats
+
+
+def collect_stats(chunks, numeric_columns, category_columns,
+                  exclude_columns=(), n_jobs=1):
+    """
+    Computes the EdaStats of an iterable of chunks.
+
+    With n_jobs > 1 the chunks are summarized by a pool of worker
+    processes, with at most two chunks per worker in flight, and the
+    partial statistics are merged as they complete.
+
+    Input:
+        - chunks: Iterable of Pandas dataframes, e.g. a chunked
+          pd.read_csv
+        - numeric_columns, category_columns, exclude_columns: Passed to
+          EdaStats
+        - n_jobs: Number of worker processes, -1 to use every CPU
+    Output:
+        - stats: Merged EdaStats
+    """
+    stats = EdaStats(numeric_columns, category_columns, exclude_columns)
+    columns = (numeric_columns, category_columns, exclude_columns)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1:
+        for chunk in chunks:
+            stats.merge(summarize_chunk(chunk, *columns))
+        return stats
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(summarize_chunk, chunk, *columns))
+            if len(pending) >= 2 * n_jobs:
+                stats.merge(pending.popleft().result())
+        while pending:
+            stats.merge(pending.popleft().result())
+    return stats
+
+
+def plot_histogram(sketch, path, bins=10):
+    """
+    Saves the histogram of a sketch, as drawn by Series.hist.
+
+    Input:
+        - sketch: DistributionSketch
+        - path: Path to the image file
+        - bins: Number of bins
+    """
+    fig = plt.figure(figsize=(20, 10))
+    axis = plt.gca()
+    axis.hist(sketch.support(), bins=bins,
+              range=(sketch.min, sketch.max), weights=sketch.counts)
+    axis.grid(True)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def plot_density(sketch, path, label=None):
+    """
+    Saves the density histogram of a sketch with its kernel density
+    estimate, as drawn by sns.histplot(stat='density', kde=True).
+
+    Input:
+        - sketch: DistributionSketch
+        - path: Path to the image file
+        - label: Optional label of the x axis
+    """
+    fig = plt.figure(figsize=(20, 10))
+    # Scott's bandwidth of the raw values, not of the weighted points
+    edges = sketch.auto_bin_edges()
+    sns.histplot(x=sketch.support(), weights=sketch.counts,
+                 bins=len(edges) - 1, binrange=(edges[0], edges[-1]),
+                 stat='density', kde=True,
+                 kde_kws={'bw_method': sketch.count ** -0.2})
+    plt.xlabel(label)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def plot_category_share(counter, path, normalize=False):
+    """
+    Saves the bar plot of the counts of each level.
+
+    Input:
+        - counter: CategoryCounter
+        - path: Path to the image file
+        - normalize: If True, plots the proportions of the levels
+    """
+    fig = plt.figure(figsize=(20, 10))
+    counter.value_counts(normalize=normalize).plot(kind='bar')
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def plot_correlation(moments, path):
+    """
+    Saves the heatmap of the correlation matrix.
+
+    Input:
+        - moments: MomentMatrix
+        - path: Path to the image file
+    """
+    fig = plt.figure(figsize=(20, 10))
+    sns.heatmap(moments.correlation(), annot=False,
+                cmap='Dark2_r', linewidths=2)
+    fig.savefig(path)
+    plt.close(fig)
@@ -0,0 +1,146 @@
+"""
+SHAP computation for the churn models: row budget, chunked parallel
+computation and persisted SHAP values.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import joblib
+from sklearn.model_selection import train_test_split
+
+import shap
+
+from churn_cache import fingerprint
+
+# TreeExplainer of the worker process, built once by _init_worker
+_EXPLAINER = None
+
+
+def sample_rows(features, target=None, max_rows=None, random_state=42):
+    """
+    Returns at most max_rows rows of features, stratified on target.
+
+    Input:
+        - features: Pandas dataframe of features values
+        - target: Optional target used to stratify the sample
+        - max_rows: Row budget, None to keep every row
+        - random_state: Seed of the sampling
+    Output:
+        - sample: Pandas dataframe with at most max_rows rows
+    """
+    if max_rows is None or max_rows >= len(features):
+        return features
+
+    sample, _ = train_test_split(features,
+                                 train_size=max_rows,
+                                 stratify=target,
+                                 random_state=random_state)
+    return sample
+
+
+def _init_worker(model):
+    """
+    Builds the TreeExplainer of a worker process.
+
+    Input:
+        - model: Tree model to explain
+    """
+    global _EXPLAINER  # pylint: disable=global-statement
+    _EXPLAINER = shap.TreeExplainer(model)
+
+
+def _explain_chunk(chunk):
+    """
+    Computes the SHAP values of one chunk in a worker process.
+
+    Input:
+        - chunk: Pandas dataframe of features values
+    Output:
+        - SHAP values, as returned by TreeExplainer.shap_values
+    """
+    return _EXPLAINER.shap_values(chunk)
+
+
+def compute_shap_values(model,
+                        features,
+                        n_jobs=1,
+                        chunk_size=10000,
+                        cache=None):
+    """
+    Computes TreeExplainer SHAP values of model on features.
+
+    The rows are split in chunks that are explained in a pool of
+    n_jobs processes, each worker building its explainer only once.
+    When a DiskCache is given, the SHAP values are stored under a key
+    made of the model and data hashes and reused by later calls.
+
+    Input:
+        - model: Tree model to explain
+        - features: Pandas dataframe of features values
+        - n_jobs: Number of worker processes, 1 to run in process
+          and -1 to use every CPU
+        - chunk_size: Number of rows explained per task
+        - cache: Optional DiskCache for the SHAP values
+    Output:
+        - shap_values: SHAP values, as returned by
+          TreeExplainer.shap_values (one array per class for
+          classifiers)
+    """
+    # No rows to explain, and no chunk results to stitch together
+    if len(features) == 0:
+        return null_shap_values(model, features)
+
+    if cache is not None:
+        key = fingerprint('shap', joblib.hash(model), features)
+        shap_values = cache.get(key)
+        if shap_values is not None:
+            return shap_values
+
+    chunks = [features.iloc[start:start + chunk_size]
+              for start in range(0, len(features), chunk_size)]
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    if n_jobs == 1:
+        _init_worker(model)
+        results = [_explain_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(model,)) as executor:
+            results = list(executor.map(_explain_chunk, chunks))
+
+    # Stitch the chunks back together, class by class
+    if isinstance(results[0], list):
+        shap_values = [np.concatenate([result[i] for result in results])
+                       for i in range(len(results[0]))]
+    else:
+        shap_values = np.concatenate(results)
+
+    if cache is not None:
+        cache.set(key, shap_values)
+    return shap_values
+
+
+def null_shap_values(model, features, n_jobs=1, chunk_size=10000,
+                     cache=None):
+    """
+    Stand-in for compute_shap_values in the fast test mode: zero SHAP
+    values for each class, without building an explainer.
+
+    Input:
+        - model: Fitted classifier with a classes_ attribute
+        - features: Pandas dataframe of features values
+        - n_jobs, chunk_size, cache: Ignored
+    Output:
+        - shap_values: One array of zeros per class, shaped like
+          features
+    """
+    return [np.zeros(features.shape) for _ in model.classes_]
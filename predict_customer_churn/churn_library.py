@@ -8,27 +8,244 @@ Date: November 3rd, 2024
 
 # import libraries
 import os
+import argparse
 
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
 
 import joblib
 
-import matplotlib.pyplot as plt
 import seaborn as sns
 
-from sklearn.metrics import plot_roc_curve, classification_report
 from sklearn.model_selection import GridSearchCV
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
 
-import shap
+from churn_cache import DiskCache, fingerprint, file_digest
+from churn_search import SuccessiveHalvingSearch, MemoizedGridSearch
+from churn_explain import sample_rows, compute_shap_values, \
+    null_shap_values
+from churn_model_store import export_forest
+from churn_metrics import binary_metrics, format_report, save_metrics
+from churn_matrix import build_feature_matrix
+from churn_profile import StageProfiler
+from churn_pipeline import Stage, StageRunner
+from churn_eda import (add_churn, collect_stats, plot_histogram,
+                       plot_density, plot_category_share, plot_correlation)
+from churn_render import (FigureRenderer, plot_report, plot_roc_curves,
+                          plot_importances, plot_shap_summary)
 
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 sns.set()
 
+# Categorical columns of the bank data, encoded as churn proportions
+CATEGORY_LST = ['Gender', 'Education_Level', 'Marital_Status',
+                'Income_Category', 'Card_Category']
+
+# Columns of the model matrix, in the order the models are trained on
+FEATURE_COLS = [
+    'Customer_Age', 'Dependent_count', 'Months_on_book',
+    'Total_Relationship_Count', 'Months_Inactive_12_mon',
+    'Contacts_Count_12_mon', 'Credit_Limit',
+    'Total_Revolving_Bal', 'Avg_Open_To_Buy',
+    'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt', 'Total_Trans_Ct',
+    'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio',
+    'Gender_Churn', 'Education_Level_Churn',
+    'Marital_Status_Churn', 'Income_Category_Churn',
+    'Card_Category_Churn'
+]
+
+# Hyperparameters searched for the Random Forest model
+RF_PARAM_GRID = {'n_estimators': [200, 500],
+                 'max_features': ['auto', 'sqrt'],
+                 'max_depth': [4, 5, 100],
+                 'criterion': ['gini', 'entropy']}
+
+# Settings of the fast test mode: a tiny search space, a stratified
+# sample of the customers and zero SHAP values
+TEST_CONFIG = {'param_grid': {'n_estimators': [20],
+                              'max_features': ['sqrt'],
+                              'max_depth': [4, 8],
+                              'criterion': ['gini']},
+               'max_rows': 2000,
+               'explainer': null_shap_values,
+               'shap_max_rows': 200}
+
+# EDA plots with filenames and plot details
+EDA_PLOTS = {
+    'churn_dist.png': ('Churn', 'hist'),
+    'customer_age_dist.png': ('Customer_Age', 'hist'),
+    'marital_status_dist.png': ('Marital_Status', 'bar', 'normalize'),
+    'total_trans_count_dist.png': ('Total_Trans_Ct', 'sns_histplot')
+}
+
+# Columns left out of the EDA correlation heatmap
+EDA_DROP_COLS = ['Attrition_Flag', 'Gender', 'Education_Level',
+                 'Marital_Status', 'Income_Category', 'Card_Category']
+
+
+class TargetEncoder:
+    """
+    Stateful target encoder which replaces each categorical column by
+    the proportion of the response observed for each category level.
+
+    All the tables are learned in one vectorized pass: every column is
+    factorized into integer codes, the codes are offset so that all
+    columns share one index space, and the per-level sums and counts
+    are aggregated with a single np.bincount. The result is stored as
+    plain arrays, so the fitted encoder can be pickled and applied to
+    new batches without the training frame and without any groupby.
+    The sums and counts are kept too, so partial_fit can learn the
+    tables chunk by chunk. Levels never seen in training, and missing
+    values, are encoded with the prior, the overall response rate.
+    """
+
+    def __init__(self, category_lst, response='Churn'):
+        """
+        Input:
+            - category_lst: List of categorical columns to encode
+            - response: Name of the binary response column
+        """
+        self.category_lst = list(category_lst)
+        self.response = response
+
+        # Column name -> array of category levels / churn rate per level
+        self.levels_ = {}
+        self.rates_ = {}
+
+        # Column name -> response sum / row count per level
+        self.sums_ = {}
+        self.counts_ = {}
+
+        # Response sum and row count over all the rows, for the prior
+        self.total_sum_ = 0.0
+        self.total_count_ = 0
+
+    def fit(self, df):
+        """
+        Learns the response proportion of each category level.
+
+        Input:
+            - df: Pandas dataframe holding category_lst and response
+        Output:
+            - self
+        """
+        self.levels_, self.rates_ = {}, {}
+        self.sums_, self.counts_ = {}, {}
+        self.total_sum_, self.total_count_ = 0.0, 0
+        return self.partial_fit(df)
+
+    def partial_fit(self, df):
+        """
+        Updates the response proportions with one chunk of rows.
+
+        Input:
+            - df: Pandas dataframe holding category_lst and response
+        Output:
+            - self
+        """
+        target = df[self.response].to_numpy(dtype=np.float64)
+        self.total_sum_ += target.sum()
+        self.total_count_ += len(target)
+        prior = self.total_sum_ / max(self.total_count_, 1)
+
+        # Factorize every column into integer codes sharing one index
+        # space, missing values (code -1) are left out of the tables
+        all_codes, all_target, levels = [], [], {}
+        offset = 0
+        for category in self.category_lst:
+            codes, uniques = pd.factorize(df[category], sort=True)
+            valid = codes >= 0
+            all_codes.append(codes[valid] + offset)
+            all_target.append(target[valid])
+            levels[category] = (offset, np.asarray(uniques, dtype=object))
+            offset += len(uniques)
+
+        # Aggregate sums and counts of every level in a single pass
+        codes = np.concatenate(all_codes) if all_codes else \
+            np.empty(0, dtype=np.int64)
+        weights = np.concatenate(all_target) if all_target else \
+            np.empty(0, dtype=np.float64)
+        sums = np.bincount(codes, weights=weights, minlength=offset)
+        counts = np.bincount(codes, minlength=offset)
+
+        for category, (start, uniques) in levels.items():
+            stop = start + len(uniques)
+            level_sums = pd.Series(sums[start:stop], index=uniques)
+            level_counts = pd.Series(counts[start:stop], index=uniques)
+            if category in self.sums_:
+                level_sums = level_sums.add(self.sums_[category],
+                                            fill_value=0).sort_index()
+                level_counts = level_counts.add(self.counts_[category],
+                                                fill_value=0).sort_index()
+            self.sums_[category] = level_sums
+            self.counts_[category] = level_counts
+
+            # Store the rates with the prior appended, used for unseen
+            # levels
+            self.levels_[category] = level_sums.index.to_numpy(dtype=object)
+            self.rates_[category] = np.append(
+                level_sums.to_numpy() / level_counts.to_numpy(), prior)
+
+        return self
+
+    def transform(self, df):
+        """
+        Maps each category level to the learned response proportion.
+
+        Input:
+            - df: Pandas dataframe holding the category_lst columns
+        Output:
+            - encoded: Pandas dataframe with one <category>_<response>
+            column per encoded category, indexed like df
+        """
+        if not self.rates_:
+            raise ValueError("TargetEncoder must be fitted before "
+                             "calling transform.")
+
+        encoded = {}
+        for category in self.category_lst:
+            new_column = category + "_" + self.response
+            encoded[new_column] = self.encode(df, category)
+
+        return pd.DataFrame(encoded, index=df.index)
+
+    def encode(self, df, category):
+        """
+        Maps the levels of one category column to the learned response
+        proportion.
+
+        Input:
+            - df: Pandas dataframe holding the category column
+            - category: Name of the column, one of category_lst
+        Output:
+            - rates: Float64 array of the proportions, the prior for
+            unseen and missing levels
+        """
+        if not self.rates_:
+            raise ValueError("TargetEncoder must be fitted before "
+                             "calling transform.")
+
+        # Unknown and missing levels get -1, i.e. the trailing prior
+        positions = pd.Index(self.levels_[category]).get_indexer(
+            df[category])
+        return self.rates_[category][positions]
+
+    def fit_transform(self, df):
+        """
+        Fits the encoder on df and returns the encoded columns.
+
+        Input:
+            - df: Pandas dataframe holding category_lst and response
+        Output:
+            - encoded: Pandas dataframe with the encoded columns
+        """
+        return self.fit(df).transform(df)
+
 
 class ChurnLibrarySolution:
     """
@@ -39,13 +256,39 @@ class ChurnLibrarySolution:
 
     def __init__(self,
                  img_folder='./images',
-                 model_folder='./models'):
+                 model_folder='./models',
+                 cache_folder='./cache',
+                 shap_max_rows=None,
+                 shap_n_jobs=1,
+                 render_jobs=1,
+                 profiler=None,
+                 param_grid=None,
+                 max_rows=None,
+                 explainer=None):
         """
         Initializes the paths for data, image, and model folders.
 
         Parameters:
         - img_folder: Path to the folder where EDA images will be saved.
         - model_folder: Path to the folder where to save trained models.
+        - cache_folder: Path to the folder where cached intermediate
+          files are kept. It is only created when a cache is used.
+        - shap_max_rows: Maximum number of test rows explained by SHAP,
+          sampled stratified on the target. None explains every row.
+        - shap_n_jobs: Number of processes computing SHAP values.
+        - render_jobs: Number of processes rendering figures, -1 to
+          use every CPU.
+        - profiler: Optional StageProfiler recording the time and
+          memory of each stage and sub-step.
+        - param_grid: Hyperparameters searched for the Random Forest
+          model, RF_PARAM_GRID by default.
+        - max_rows: If set, import_data keeps a sample of at most
+          max_rows customers, stratified on the customer status.
+        - explainer: Function computing the SHAP values, with the
+          signature of compute_shap_values (the default).
+
+        ChurnLibrarySolution(**TEST_CONFIG) runs the whole pipeline in
+        seconds, for the tests.
         """
 
         # Create the image folder if it doesn't exist
@@ -62,72 +305,177 @@ class ChurnLibrarySolution:
         if not self.model_folder.exists():
             self.model_folder.mkdir(parents=True)
 
-    def import_data(self, path):
+        self.cache_folder = Path(cache_folder)
+
+        # SHAP computation settings
+        self.shap_max_rows = shap_max_rows
+        self.shap_n_jobs = shap_n_jobs
+
+        # Figure rendering settings
+        self.render_jobs = render_jobs
+
+        # Target encoder fitted by encoder_helper
+        self.encoder = None
+
+        # Stage profiler, disabled unless one is given
+        self.profiler = profiler or StageProfiler(enabled=False)
+
+        # Search space, data sample and explainer, reduced in test mode
+        self.param_grid = param_grid or RF_PARAM_GRID
+        self.max_rows = max_rows
+        self.explainer = explainer or compute_shap_values
+
+    def import_data(self, path, use_cache=False):
         """
         Returns dataframe for the csv found at pth
 
         Input:
             - path: Path to the CSV file containing the data.
+            - use_cache: If True, the first read writes a typed Arrow
+              copy of the CSV to the cache folder and later reads
+              memory-map that copy instead of parsing the CSV again.
         Output:
             - df: Pandas dataframe
         """
-        try:
-            # Reads the CSV file into a pandas DataFrame
-            df = pd.read_csv(path, index_col=0)
-        except FileNotFoundError:
-            print(f"File not found: {path}")
+        with self.profiler.stage('import_data') as stage:
+            try:
+                if use_cache:
+                    df = self._import_cached(Path(path))
+                else:
+                    # Reads the CSV file into a pandas DataFrame
+                    df = pd.read_csv(path, index_col=0)
+                if self.max_rows is not None:
+                    df = sample_rows(df, df['Attrition_Flag'],
+                                     self.max_rows).sort_index()
+                stage['rows'] = len(df)
+            except FileNotFoundError:
+                print(f"File not found: {path}")
         return df
 
+    def _import_cached(self, path):
+        """
+        Reads path through the columnar cache.
+
+        The cached copy is an uncompressed Arrow IPC (Feather v2) file
+        named after the source size, mtime and content hash, so any
+        change to the CSV produces a new cache entry.
+
+        Input:
+            - path: Path to the CSV file containing the data.
+        Output:
+            - df: Pandas dataframe with categorical columns
+        """
+        stat = path.stat()
+        key = f"{stat.st_size}-{stat.st_mtime_ns}-{file_digest(path)}"
+        cache_path = self.cache_folder / f"{path.stem}-{key}.arrow"
+
+        if not cache_path.exists():
+            df = pd.read_csv(path, index_col=0,
+                             dtype={col: 'category' for col in CATEGORY_LST})
+
+            # Drop stale copies of the same source before writing
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            for stale in self.cache_folder.glob(f"{path.stem}-*.arrow"):
+                stale.unlink()
+
+            # Write next to the target and rename, so that a reader
+            # never sees a partially written cache file
+            tmp_path = cache_path.with_suffix('.tmp')
+            feather.write_feather(pa.Table.from_pandas(df),
+                                  str(tmp_path),
+                                  compression='uncompressed')
+            os.replace(tmp_path, cache_path)
+
+        table = feather.read_table(str(cache_path), memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
     def perform_eda(self, df):
         """
         Perform EDA on df and save figures to images folder
+
+        The statistics behind every figure are gathered in a single pass
+        over df, and the figures are drawn from those summaries.
+
         Input:
             - df: Pandas dataframe
         """
 
-        # Create a binary target column 'Churn' from 'Attrition_Flag'
-        df['Churn'] = df['Attrition_Flag'].apply(
-            lambda val: 0 if val == "Existing Customer" else 1)
-
-        # Dictionary to store EDA plots with filenames and plot details
-        eda_plots = {
-            'churn_dist.png': ('Churn', 'hist'),
-            'customer_age_dist.png': ('Customer_Age', 'hist'),
-            'marital_status_dist.png': ('Marital_Status',
-                                        'bar',
-                                        'normalize'),
-            'total_trans_count_dist.png': ('Total_Trans_Ct',
-                                           'sns_histplot')
-        }
-
-        # Generate and save each plot
-        for file, (column, plot_type, *args) in eda_plots.items():
-            fig = plt.figure(figsize=(20, 10))
-            if plot_type == 'hist':
-                df[column].hist()
-            elif plot_type == 'bar':
-                df[column].value_counts(args[0]).plot(kind='bar')
-            elif plot_type == 'sns_histplot':
-                sns.histplot(df[column], stat='density', kde=True)
-            fig.savefig(self.img_eda_folder / file)
-            plt.close(fig)
-
-        # Generate and save a heatmap for feature correlations
-        fig = plt.figure(figsize=(20, 10))
-        cols_to_drop = ['Attrition_Flag', 'Gender', 'Education_Level',
-                        'Marital_Status', 'Income_Category',
-                        'Card_Category']
-        df_aux = df.drop(columns=cols_to_drop)
-        sns.heatmap(df_aux.corr(), annot=False,
-                    cmap='Dark2_r', linewidths=2)
-        fig.savefig(self.img_eda_folder / 'features_correlation.png')
-        plt.close(fig)
+        with self.profiler.stage('perform_eda', rows=len(df)):
+            # Create a binary target column 'Churn' from 'Attrition_Flag'
+            add_churn(df)
+
+            with self.profiler.stage('collect_stats'):
+                stats = collect_stats([df], *self._eda_columns())
+            self._render_eda(stats)
+
+    def perform_eda_from_file(self, path, chunksize=100000, n_jobs=1):
+        """
+        Perform EDA on a CSV file read in chunks, without loading it in
+        memory, and save figures to images folder
+
+        Input:
+            - path: Path to the CSV file containing the data.
+            - chunksize: Number of rows per chunk
+            - n_jobs: Number of processes summarizing the chunks, -1 to
+              use every CPU
+        """
+        with self.profiler.stage('perform_eda_from_file') as stage:
+            with self.profiler.stage('collect_stats'):
+                chunks = pd.read_csv(path, index_col=0, chunksize=chunksize)
+                stats = collect_stats(chunks, *self._eda_columns(),
+                                      n_jobs=n_jobs)
+            stage['rows'] = stats.n_rows
+            self._render_eda(stats)
+
+    @staticmethod
+    def _eda_columns():
+        """
+        Returns the numeric columns, categorical columns and excluded
+        columns summarized for EDA_PLOTS.
+        """
+        numeric_columns = [column for column, plot_type, *_ in
+                           EDA_PLOTS.values() if plot_type != 'bar']
+        category_columns = [column for column, plot_type, *_ in
+                            EDA_PLOTS.values() if plot_type == 'bar']
+        return numeric_columns, category_columns, EDA_DROP_COLS
+
+    def _render_eda(self, stats):
+        """
+        Draws EDA_PLOTS and the correlation heatmap from stats
+
+        Input:
+            - stats: EdaStats returned by collect_stats
+        """
+        with self.profiler.stage('render_figures') as stage, \
+                FigureRenderer(self.render_jobs) as renderer:
+            # Generate and save each plot
+            for file, (column, plot_type, *args) in EDA_PLOTS.items():
+                path = self.img_eda_folder / file
+                if plot_type == 'hist':
+                    renderer.submit(path, plot_histogram,
+                                    stats.sketches[column])
+                elif plot_type == 'bar':
+                    renderer.submit(path, plot_category_share,
+                                    stats.categories[column],
+                                    normalize='normalize' in args)
+                elif plot_type == 'sns_histplot':
+                    renderer.submit(path, plot_density,
+                                    stats.sketches[column], label=column)
+
+            # Generate and save a heatmap for feature correlations
+            renderer.submit(self.img_eda_folder / 'features_correlation.png',
+                            plot_correlation, stats.moments)
+        stage['figures'] = renderer.report
 
     def encoder_helper(self, df, category_lst, response='Churn'):
         """
         Helper function to turn each categorical column into a new
         column with propotion of churn for each category
 
+        The churn proportions are learned by a TargetEncoder which is
+        kept in self.encoder, so the same tables can be applied to new
+        batches of customers later on.
+
         Input:
             - df: Pandas dataframe
             - category_lst: List of columns that contain categorical
@@ -137,20 +485,28 @@ class ChurnLibrarySolution:
         Output:
             df: Pandas dataframe with new columns for
         """
+        # Check which category columns exist in DataFrame
+        present_lst = []
         for category in category_lst:
-            # Check if category column exists in DataFrame
             if category in df.columns:
-                # Calculate churn proportion for each category level
-                cat_groups = df.groupby(category)[response].mean()
-                new_column = category + "_" + response
-                # Map churn proportion back to each row in the DataFrame
-                df[new_column] = df[category].map(cat_groups)
+                present_lst.append(category)
             else:
                 print(f"Warning: {category} column not found in df.")
 
+        # Nothing to encode
+        if not present_lst:
+            return df
+
+        # Learn the churn proportion tables and map them back to df
+        self.encoder = TargetEncoder(present_lst, response=response)
+        encoded = self.encoder.fit(df).transform(df)
+        for column in encoded.columns:
+            df[column] = encoded[column]
+
         return df
 
-    def perform_feature_engineering(self, df, response='Churn'):
+    def perform_feature_engineering(self, df, response='Churn',
+                                    as_matrix=False):
         """
         Performs feature engineering by encoding categorical variables
         and splitting data into training and testing sets.
@@ -159,136 +515,150 @@ class ChurnLibrarySolution:
               - df: Pandas dataframe
               - response: String of response name [optional argument
               that could be used for naming variables or index y column]
+              - as_matrix: If True, the features are written straight
+              into a float32 FeatureMatrix instead of being copied into
+              float64 frames, and df is left unchanged
         output:
               - features_train: Features training data
               - features_test: Features testing data
               - target_train: Target training data
               - target_test: Target testing data
+              or, with as_matrix, a FeatureMatrix whose split() returns
+              the same four sets as views of the matrix
         """
-        # List of categorical columns to be encoded
-        category_list = ['Gender', 'Education_Level', 'Marital_Status',
-                         'Income_Category', 'Card_Category']
-
-        df = self.encoder_helper(df, category_list)
-
-        # Define the columns to keep for model training
-        keep_cols = [
-            'Customer_Age', 'Dependent_count', 'Months_on_book',
-            'Total_Relationship_Count', 'Months_Inactive_12_mon',
-            'Contacts_Count_12_mon', 'Credit_Limit',
-            'Total_Revolving_Bal', 'Avg_Open_To_Buy',
-            'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt', 'Total_Trans_Ct',
-            'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio',
-            'Gender_Churn', 'Education_Level_Churn',
-            'Marital_Status_Churn', 'Income_Category_Churn',
-            'Card_Category_Churn', 'Churn'
-        ]
-
-        # Keep only necessary columns for modeling
-        df = df[keep_cols]
-        y = df[response]
-        x = df.drop(response, axis=1)
-
-        # Split data into training and testing sets
-        features_train, features_test, target_train, target_test = \
-            train_test_split(x, y, test_size=0.3, random_state=42)
+        with self.profiler.stage('perform_feature_engineering',
+                                 rows=len(df)):
+            with self.profiler.stage('encoder_helper'):
+                if as_matrix:
+                    # Only learn the tables, the encoded columns are
+                    # written into the matrix one at a time
+                    self.encoder = TargetEncoder(CATEGORY_LST,
+                                                 response=response).fit(df)
+                else:
+                    df = self.encoder_helper(df, CATEGORY_LST)
+
+            # Save the fitted encoder so scoring jobs can reuse its tables
+            joblib.dump(self.encoder,
+                        self.model_folder / 'target_encoder.pkl')
+
+            if as_matrix:
+                with self.profiler.stage('build_feature_matrix'):
+                    return build_feature_matrix(df, FEATURE_COLS,
+                                                self.encoder,
+                                                response=response)
+
+            # Define the columns to keep for model training
+            keep_cols = FEATURE_COLS + ['Churn']
+
+            # Keep only necessary columns for modeling
+            with self.profiler.stage('train_test_split'):
+                df = df[keep_cols]
+                y = df[response]
+                x = df.drop(response, axis=1)
+
+                # Split data into training and testing sets
+                features_train, features_test, target_train, target_test = \
+                    train_test_split(x, y, test_size=0.3, random_state=42)
 
         return features_train, features_test, target_train, target_test
 
-    def classification_report_image(self, targets, predictions):
+    def classification_report_image(self, targets, probabilities):
         """
         Produces classification report for training and testing results
         and stores report as image in images folder.
-        
+
+        All the metrics of a model and split are derived in one pass
+        from its churn probabilities, and they are also saved in
+        machine-readable form to metrics.json in the results folder.
+
         Input:
-            - targets: Dictionary containing true training and test 
+            - targets: Dictionary containing true training and test
             values
               Format:
                 {'train': target_train, 'test': target_test}
-              
-            - predictions: Dictionary containing model predictions for
-              training and testing sets.
+
+            - probabilities: Dictionary containing the churn
+              probabilities of each model for training and testing sets.
               Format:
                 {
-                    'Model': {'train': target_train_preds_model, 
-                                'test': target_test_preds_model}
+                    'Model': {'train': target_train_proba_model,
+                                'test': target_test_proba_model}
                 }
+        Output:
+            - metrics: Dictionary of model name -> split -> metrics, as
+              returned by churn_metrics.binary_metrics
         """
-        for model_name, preds in predictions.items():
-            plt.rc('figure', figsize=(5, 5))
-
-            # Add texts for classification report for training/test sets
-            plt.text(0.01, 1.25, f'{model_name} Train',
-                        {'fontsize': 10}, fontproperties='monospace')
-            plt.text(0.01, 0.7, classification_report(targets['train'],
-                                                        preds['train']),
-                        {'fontsize': 10}, fontproperties='monospace')
-            plt.text(0.01, 0.6, f'{model_name} Test',
-                        {'fontsize': 10}, fontproperties='monospace')
-            plt.text(0.01, 0.05, classification_report(targets['test'],
-                                                        preds['test']),
-                    {'fontsize': 10}, fontproperties='monospace')
-
-            # Remove axes
-            plt.axis('off')
-            plt.tight_layout()
-
-            # Save the figure to a file
-            file_name = f'{model_name.lower().replace(" ", "_")}'
-            file_name += '_results.png'
-            plt.savefig(self.img_res_folder / file_name)
-            plt.close()
-
-    def feature_importance_plot(self, model, features_test):
+        with self.profiler.stage('classification_report_image') as stage, \
+                FigureRenderer(self.render_jobs) as renderer:
+            metrics = {}
+            for model_name, proba in probabilities.items():
+                metrics[model_name] = {
+                    split: binary_metrics(targets[split], proba[split])
+                    for split in ('train', 'test')}
+
+                # Save the reports of the training/test sets to a file
+                file_name = f'{model_name.lower().replace(" ", "_")}'
+                file_name += '_results.png'
+                renderer.submit(self.img_res_folder / file_name,
+                                plot_report, model_name,
+                                format_report(metrics[model_name]['train']),
+                                format_report(metrics[model_name]['test']))
+
+            save_metrics(metrics, self.img_res_folder / 'metrics.json')
+        stage['figures'] = renderer.report
+        return metrics
+
+    def feature_importance_plot(self, model, features_test,
+                                target_test=None, use_cache=False):
         """
         Creates and stores the feature importances in pth
         input:
             - model: Model object containing feature_importances_
             - features_test: Pandas dataframe of features values
+            - target_test: Optional target values, used to stratify
+              the rows sampled for SHAP
+            - use_cache: If True, SHAP values are persisted in the
+              cache folder and reused when model and data are unchanged
         """
-        # Feature importances
-        importances = model.best_estimator_.feature_importances_
-
-        # Sort Feature importances in descending order
-        indices = np.argsort(importances)[::-1]
-
-        # Rearrange feature so they match the sorted feature importances
-        names = [features_test.columns[i] for i in indices]
-
-        fig = plt.figure(figsize=(20, 5))
-        plt.title("Feature Importance")
-        plt.ylabel('Importance')
-        plt.bar(range(features_test.shape[1]), importances[indices])
-        plt.xticks(range(features_test.shape[1]), names, rotation=90)
-        plt.tight_layout()
-
-        # Save the image to a file
-        fig.savefig(self.img_res_folder / 'feature_importances.png')
-        plt.close(fig)
-
-        # SHAP Figure
-        fig = plt.figure(figsize=(20, 5))
-
-        explainer = shap.TreeExplainer(model.best_estimator_)
-        shap_values = explainer.shap_values(features_test)
-
-        # Create the SHAP summary plot
-        shap.summary_plot(shap_values, features_test,
-                          plot_type="bar", show=False)
-
-        # Save the plot as an image file
-        fig.savefig(self.img_res_folder / "shap_summary_plot.png",
-                    format="png",
-                    dpi=300,
-                    bbox_inches="tight")
-
-        plt.close(fig)
+        with self.profiler.stage('feature_importance_plot') as stage, \
+                FigureRenderer(self.render_jobs) as renderer:
+            # Feature importances
+            importances = model.best_estimator_.feature_importances_
+
+            # Sort Feature importances in descending order
+            indices = np.argsort(importances)[::-1]
+
+            # Rearrange feature so they match the sorted feature importances
+            names = [features_test.columns[i] for i in indices]
+
+            renderer.submit(self.img_res_folder / 'feature_importances.png',
+                            plot_importances, names, importances[indices])
+
+            # Explain at most shap_max_rows rows, in shap_n_jobs processes
+            features_shap = sample_rows(features_test, target_test,
+                                        self.shap_max_rows)
+            shap_cache = DiskCache(self.cache_folder / 'shap') \
+                if use_cache else None
+            with self.profiler.stage('compute_shap_values',
+                                     rows=len(features_shap)):
+                shap_values = self.explainer(model.best_estimator_,
+                                             features_shap,
+                                             n_jobs=self.shap_n_jobs,
+                                             cache=shap_cache)
+
+            # SHAP Figure
+            renderer.submit(self.img_res_folder / 'shap_summary_plot.png',
+                            plot_shap_summary, shap_values, features_shap)
+        stage['figures'] = renderer.report
 
     def train_models(self,
                      features_train,
                      features_test,
                      target_train,
-                     target_test):
+                     target_test,
+                     search='grid',
+                     search_options=None,
+                     use_cache=False):
         """
         Trains Random Forest and Logistic Regression models, evaluates
         them, and saves the models and evaluation results.
@@ -297,73 +667,291 @@ class ChurnLibrarySolution:
               - features_test: Features testing data
               - target_train: Target training data
               - target_test: Target testing data
+              - search: 'grid' for an exhaustive GridSearchCV, or
+                'halving' for a SuccessiveHalvingSearch
+              - search_options: Optional dictionary of keyword
+                arguments for SuccessiveHalvingSearch, e.g.
+                {'resource': 'n_samples', 'factor': 2}
+              - use_cache: If True, the fold scores of the grid search
+                and the fitted models are memoized in the cache folder
+                and reused by later runs on the same data
         """
-        # Initialize Random Forest and Logistic Regression models
-        rfc = RandomForestClassifier(random_state=42, n_jobs=-1)
-        lrc = LogisticRegression(n_jobs=-1, max_iter=1000)
-
-        # Define hyperparameters for Grid Search
-        param_grid = {'n_estimators': [200, 500],
-                      'max_features': ['auto', 'sqrt'],
-                      'max_depth': [4, 5, 100],
-                      'criterion': ['gini', 'entropy']}
-
-        # Grid Search for Random Forest model
-        cv_rfc = GridSearchCV(estimator=rfc,
-                              param_grid=param_grid,
-                              cv=5)
-        cv_rfc.fit(features_train, target_train)
-
-        best_estimator_rf = cv_rfc.best_estimator_
-
-        # Train Logistic Regression model
-        lrc.fit(features_train, target_train)
-
-        # Save best models to disk
-        joblib.dump(cv_rfc.best_estimator_,
-                    self.model_folder / 'rfc_model.pkl')
-        joblib.dump(lrc, self.model_folder / 'logistic_model.pkl')
-
-        # Plot and save ROC curves
-        plt.figure(figsize=(15, 8))
-        axis = plt.gca()
-        plot_roc_curve(lrc, features_test,
-                        target_test, ax=axis, alpha=0.8)
-        plot_roc_curve(best_estimator_rf, features_test,
-                        target_test, ax=axis, alpha=0.8)
-        plt.savefig(self.img_res_folder / 'roc_curve_result.png')
-        plt.close()
-
-        targets = {
-            'train': target_train,
-            'test': target_test
-        }
-
-        # Generate predictions for both train and test data
-        predictions = {
-            'RF': {'train': best_estimator_rf.predict(features_train), 
-                    'test': best_estimator_rf.predict(features_test)},
-            'Logistic': {'train': lrc.predict(features_train), 
-                        'test': lrc.predict(features_test)}
-        }
-
-        # Save classification reports and feature importance
-        self.classification_report_image(targets, predictions)
-        self.feature_importance_plot(cv_rfc, features_test)
+        with self.profiler.stage('train_models',
+                                 rows=len(features_train) +
+                                 len(features_test)):
+            # Initialize Random Forest and Logistic Regression models
+            rfc = RandomForestClassifier(random_state=42, n_jobs=-1)
+            lrc = LogisticRegression(n_jobs=-1, max_iter=1000)
+
+            fit_cache = DiskCache(self.cache_folder / 'fits') \
+                if use_cache else None
+
+            # Hyperparameter search for Random Forest model
+            if search == 'grid' and use_cache:
+                cv_rfc = MemoizedGridSearch(estimator=rfc,
+                                            param_grid=self.param_grid,
+                                            cache=fit_cache,
+                                            cv=5)
+            elif search == 'grid':
+                cv_rfc = GridSearchCV(estimator=rfc,
+                                      param_grid=self.param_grid,
+                                      cv=5)
+            elif search == 'halving':
+                cv_rfc = SuccessiveHalvingSearch(estimator=rfc,
+                                                 param_grid=self.param_grid,
+                                                 **(search_options or {}))
+            else:
+                raise ValueError(f"Unknown search: {search}")
+            with self.profiler.stage(f'rf_search {search}',
+                                     rows=len(features_train)):
+                cv_rfc.fit(features_train, target_train)
+
+            if search == 'halving':
+                report = cv_rfc.report_
+                print(f"Successive halving over {report['resources']} "
+                      f"{report['resource']} took "
+                      f"{report['elapsed_seconds']:.1f}s, saving an "
+                      f"estimated {report['estimated_savings_seconds']:.1f}s "
+                      "against the full grid.")
+
+            best_estimator_rf = cv_rfc.best_estimator_
+
+            # Train Logistic Regression model
+            with self.profiler.stage('logistic_fit',
+                                     rows=len(features_train)):
+                # Solve in float64 even for a float32 feature matrix,
+                # where lbfgs would stop early on the coarser gradients.
+                # A float64 frame is used as is, without a copy
+                logistic_train = features_train
+                if not (features_train.dtypes == np.float64).all():
+                    logistic_train = features_train.astype(np.float64)
+                if use_cache:
+                    key = fingerprint(logistic_train, target_train,
+                                      lrc.get_params())
+                    cached = fit_cache.get(key)
+                    if cached is None:
+                        lrc.fit(logistic_train, target_train)
+                        fit_cache.set(key, lrc)
+                    else:
+                        lrc = cached
+                else:
+                    lrc.fit(logistic_train, target_train)
+                del logistic_train
+
+            with self.profiler.stage('save_models'):
+                # Save best models to disk
+                joblib.dump(cv_rfc.best_estimator_,
+                            self.model_folder / 'rfc_model.pkl')
+                joblib.dump(lrc, self.model_folder / 'logistic_model.pkl')
+
+                # Export the forest as flat arrays that scoring workers can
+                # memory-map and share
+                export_forest(best_estimator_rf,
+                              self.model_folder / 'rfc_model')
+
+            targets = {
+                'train': target_train,
+                'test': target_test
+            }
+
+            # Churn probabilities for both train and test data, computed
+            # once and reused by every metric and plot
+            with self.profiler.stage('predict_proba'):
+                probabilities = {
+                    'RF': {
+                        'train': best_estimator_rf.predict_proba(
+                            features_train)[:, 1],
+                        'test': best_estimator_rf.predict_proba(
+                            features_test)[:, 1]
+                    },
+                    'Logistic': {
+                        'train': lrc.predict_proba(features_train)[:, 1],
+                        'test': lrc.predict_proba(features_test)[:, 1]
+                    }
+                }
+
+            # Save classification reports and metrics
+            metrics = self.classification_report_image(targets, probabilities)
+
+            # Plot and save ROC curves
+            curves = []
+            for model_name, model in (('Logistic', lrc),
+                                      ('RF', best_estimator_rf)):
+                test_metrics = metrics[model_name]['test']
+                curves.append((f"{type(model).__name__} "
+                               f"(AUC = {test_metrics['roc_auc']:.2f})",
+                               test_metrics['roc']['fpr'],
+                               test_metrics['roc']['tpr']))
+            with FigureRenderer(self.render_jobs) as renderer:
+                renderer.submit(self.img_res_folder / 'roc_curve_result.png',
+                                plot_roc_curves, curves)
+
+            # Save feature importance
+            self.feature_importance_plot(cv_rfc, features_test, target_test,
+                                         use_cache=use_cache)
+
+    def run_pipeline(self,
+                     path,
+                     search='grid',
+                     search_options=None,
+                     use_cache=False,
+                     force=False,
+                     as_matrix=False):
+        """
+        Runs import, EDA, feature engineering and training as stages of
+        a StageRunner persisted in the cache folder. A stage is skipped,
+        and its images, models and results are restored, when the data,
+        its parameters and its code are unchanged since its last run.
+
+        Input:
+            - path: Path to the CSV file containing the data.
+            - search, search_options, use_cache: Passed to train_models
+            - force: If True, every stage runs again
+            - as_matrix: If True, feature engineering builds a float32
+              FeatureMatrix, persisted as is
+        Output:
+            - status: Dictionary of stage name -> 'ran' or 'skipped'
+        """
+        def feature_engineering(df):
+            # The 'Churn' target, also added by perform_eda
+            add_churn(df)
+            if as_matrix:
+                return self.perform_feature_engineering(df, as_matrix=True)
+            features_train, features_test, target_train, target_test = \
+                self.perform_feature_engineering(df)
+            # Persist the encoded frame once, with the split indices
+            return {'features': pd.concat([features_train, features_test]),
+                    'target': pd.concat([target_train, target_test]),
+                    'train_index': features_train.index.to_numpy(),
+                    'test_index': features_test.index.to_numpy()}
+
+        def train(split):
+            if as_matrix:
+                training_split = split.split()
+            else:
+                features, target = split['features'], split['target']
+                training_split = (features.loc[split['train_index']],
+                                  features.loc[split['test_index']],
+                                  target.loc[split['train_index']],
+                                  target.loc[split['test_index']])
+            self.train_models(*training_split,
+                              search=search,
+                              search_options=search_options,
+                              use_cache=use_cache)
+
+        def eda(df):
+            # Only the figures are persisted, as outputs of the stage
+            self.perform_eda(df)
+            return sorted(path.name for path in self.img_eda_folder.iterdir())
+
+        runner = StageRunner(self.cache_folder / 'stages')
+        runner.add(Stage(
+            'import_data',
+            lambda: self.import_data(path, use_cache=use_cache),
+            params={'data': file_digest(path),
+                    'max_rows': self.max_rows},
+            code=[ChurnLibrarySolution.import_data,
+                  ChurnLibrarySolution._import_cached],
+            persist=False))
+        runner.add(Stage(
+            'perform_eda', eda,
+            deps=['import_data'],
+            params={'eda_plots': EDA_PLOTS,
+                    'eda_drop_cols': EDA_DROP_COLS},
+            code=[ChurnLibrarySolution.perform_eda,
+                  ChurnLibrarySolution._render_eda, 'churn_eda',
+                  'churn_render'],
+            outputs=[self.img_eda_folder]))
+        runner.add(Stage(
+            'perform_feature_engineering', feature_engineering,
+            deps=['import_data'],
+            params={'category_lst': CATEGORY_LST,
+                    'feature_cols': FEATURE_COLS,
+                    'as_matrix': as_matrix},
+            code=[ChurnLibrarySolution.perform_feature_engineering,
+                  ChurnLibrarySolution.encoder_helper, TargetEncoder,
+                  add_churn, 'churn_matrix'],
+            outputs=[self.model_folder / 'target_encoder.pkl']))
+        runner.add(Stage(
+            'train_models', train,
+            deps=['perform_feature_engineering'],
+            params={'search': search,
+                    'search_options': search_options,
+                    'param_grid': self.param_grid,
+                    'shap_max_rows': self.shap_max_rows,
+                    'explainer': self.explainer.__name__},
+            code=[ChurnLibrarySolution.train_models,
+                  ChurnLibrarySolution.classification_report_image,
+                  ChurnLibrarySolution.feature_importance_plot,
+                  'churn_search', 'churn_metrics', 'churn_explain',
+                  'churn_model_store', 'churn_render'],
+            outputs=[self.model_folder / 'rfc_model.pkl',
+                     self.model_folder / 'logistic_model.pkl',
+                     self.model_folder / 'rfc_model',
+                     self.img_res_folder]))
+        return runner.run(force=force)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train and evaluate the churn models",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record time and memory of each stage in a JSON trace",
+    )
+
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        help="Path to the JSON trace of the profiled run",
+        required=False,
+        default="./logs/churn_library_profile.json",
+    )
+
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="With --profile, also dump cProfile statistics of the "
+             "slowest stage next to the trace (.prof)",
+    )
+
+    parser.add_argument(
+        "--render_jobs",
+        type=int,
+        help="Number of processes rendering figures, -1 to use every CPU",
+        required=False,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--feature_matrix",
+        action="store_true",
+        help="Build the features as one float32 matrix, split by views",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run every stage, even those whose inputs are unchanged",
+    )
+
+    ARGS = parser.parse_args()
+
     # Instantiate and run the churn prediction solution
-    cls = ChurnLibrarySolution()
+    PROFILER = StageProfiler(enabled=ARGS.profile, cprofile=ARGS.cprofile)
+    cls = ChurnLibrarySolution(render_jobs=ARGS.render_jobs,
+                               profiler=PROFILER)
 
-    # Read data stored in the given file
+    # Data import, EDA, feature engineering and model training,
+    # prediction and evaluation, skipping the unchanged stages
     FILE_PATH = r"./data/bank_data.csv"
-    DF = cls.import_data(FILE_PATH)
-
-    cls.perform_eda(DF)
-
-    # Feature engineering
-    training_split = cls.perform_feature_engineering(DF)
+    cls.run_pipeline(FILE_PATH, force=ARGS.force,
+                     as_matrix=ARGS.feature_matrix)
 
-    # Model training,prediction and evaluation
-    cls.train_models(*training_split)
+    if ARGS.profile:
+        PROFILER.save(ARGS.profile_output,
+                      Path(ARGS.profile_output).with_suffix('.prof'))
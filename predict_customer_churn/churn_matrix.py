@@ -0,0 +1,211 @@
+"""
+Memory-lean feature matrix of the churn models.
+
+build_feature_matrix writes the model features straight into one
+contiguous float32 NumPy array, column by column, instead of copying
+the frame to select the columns, again to drop the response and once
+more for each of the four split frames. The rows are written in split
+order (training rows first), so the training and testing sets are
+views of the same array, and the split itself is kept as the arrays
+of the original row labels. Column names are kept next to the array.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import numpy as np
+import pandas as pd
+
+from sklearn.model_selection import train_test_split
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from churn_metrics import binary_metrics
+
+
+class FeatureMatrix:
+    """
+    Features and target of the churn models, split in training and
+    testing rows.
+    """
+
+    def __init__(self, values, target, columns, index, n_train,
+                 response='Churn'):
+        """
+        Input:
+            - values: C-contiguous float32 array of shape
+              (n_rows, n_features), training rows first
+            - target: Array of the response, in the same row order
+            - columns: Names of the feature columns
+            - index: Array of the original row labels, in the same
+              row order
+            - n_train: Number of training rows
+            - response: Name of the response
+        """
+        self.values = values
+        self.target = target
+        self.columns = list(columns)
+        self.index = index
+        self.n_train = n_train
+        self.response = response
+
+    @property
+    def train_index(self):
+        """
+        Original row labels of the training set.
+        """
+        return self.index[:self.n_train]
+
+    @property
+    def test_index(self):
+        """
+        Original row labels of the testing set.
+        """
+        return self.index[self.n_train:]
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the features, target and row labels.
+        """
+        return self.values.nbytes + self.target.nbytes + self.index.nbytes
+
+    def split(self):
+        """
+        Returns the training and testing sets as pandas objects sharing
+        the memory of the matrix, so no data is copied.
+
+        Output:
+            - features_train: Features training data
+            - features_test: Features testing data
+            - target_train: Target training data
+            - target_test: Target testing data
+        """
+        rows = {'train': slice(None, self.n_train),
+                'test': slice(self.n_train, None)}
+        features, target = {}, {}
+        for name, part in rows.items():
+            index = pd.Index(self.index[part])
+            features[name] = pd.DataFrame(self.values[part], index=index,
+                                          columns=self.columns, copy=False)
+            target[name] = pd.Series(self.target[part], index=index,
+                                     name=self.response, copy=False)
+
+        return features['train'], features['test'], \
+            target['train'], target['test']
+
+
+def feature_values(df, feature_cols, encoder, rows=None):
+    """
+    Writes the features of df into a new float32 array, one column at a
+    time.
+
+    Input:
+        - df: Pandas dataframe holding the raw features
+        - feature_cols: Names of the feature columns, either columns of
+          df or <category>_<response> columns of the encoder
+        - encoder: Fitted TargetEncoder of the category columns
+        - rows: Optional positions of the rows to write, in order
+    Output:
+        - values: C-contiguous float32 array of shape
+          (n_rows, n_features)
+    """
+    if rows is None:
+        rows = np.arange(len(df))
+
+    encoded = {f"{category}_{encoder.response}": category
+               for category in encoder.category_lst}
+    values = np.empty((len(rows), len(feature_cols)), dtype=np.float32)
+    for j, column in enumerate(feature_cols):
+        if column in encoded:
+            data = encoder.encode(df, encoded[column])
+        else:
+            data = df[column].to_numpy()
+        values[:, j] = data[rows]
+    return values
+
+
+def build_feature_matrix(df, feature_cols, encoder, response='Churn',
+                         test_size=0.3, random_state=42):
+    """
+    Builds the feature matrix of df, with the same rows in each set as
+    train_test_split of the feature frame.
+
+    Input:
+        - df: Pandas dataframe holding the raw features and response
+        - feature_cols: Names of the feature columns, either columns of
+          df or <category>_<response> columns of the encoder
+        - encoder: Fitted TargetEncoder of the category columns
+        - response: Name of the response column
+        - test_size, random_state: Passed to train_test_split
+    Output:
+        - matrix: FeatureMatrix
+    """
+    # The split only depends on the number of rows and the seed
+    train_rows, test_rows = train_test_split(np.arange(len(df)),
+                                             test_size=test_size,
+                                             random_state=random_state)
+    order = np.concatenate([train_rows, test_rows])
+
+    return FeatureMatrix(feature_values(df, feature_cols, encoder, order),
+                         df[response].to_numpy()[order],
+                         feature_cols,
+                         df.index.to_numpy()[order],
+                         len(train_rows),
+                         response=response)
+
+
+def validate_matrix(matrix, frames, tolerance=0.01, random_state=42):
+    """
+    Checks that models trained on a feature matrix are as good as the
+    models trained on the float64 frames of the same split.
+
+    Fixed-parameter random forest and logistic regression models are
+    fitted on both, and their test AUC and accuracy are compared. The
+    forest sees the same float32 values either way and scores the same;
+    the logistic regression, stopped by max_iter on unscaled features,
+    moves by a few thousandths with the rounding of the features.
+
+    Input:
+        - matrix: FeatureMatrix
+        - frames: Tuple (features_train, features_test, target_train,
+          target_test) of perform_feature_engineering
+        - tolerance: Largest accepted difference of each metric
+        - random_state: Seed of the random forest
+    Output:
+        - report: Dictionary of model name -> metric -> value on the
+          frames, value on the matrix and absolute difference
+    """
+    if not (np.array_equal(frames[0].index, matrix.train_index) and
+            np.array_equal(frames[1].index, matrix.test_index)):
+        raise ValueError("The feature matrix and the frames do not hold "
+                         "the same split.")
+
+    models = {
+        'RF': lambda: RandomForestClassifier(n_estimators=100,
+                                             random_state=random_state,
+                                             n_jobs=-1),
+        'Logistic': lambda: LogisticRegression(max_iter=1000)}
+    report = {}
+    for name, make_model in models.items():
+        metrics = {}
+        for kind, sets in (('frames', frames), ('matrix', matrix.split())):
+            features_train, features_test, target_train, target_test = sets
+            if name == 'Logistic':
+                # As in train_models, lbfgs is solved in float64
+                features_train = features_train.astype(np.float64)
+            model = make_model().fit(features_train, target_train)
+            metrics[kind] = binary_metrics(
+                target_test, model.predict_proba(features_test)[:, 1])
+
+        report[name] = {}
+        for metric in ('roc_auc', 'accuracy'):
+            difference = abs(metrics['frames'][metric] -
+                             metrics['matrix'][metric])
+            if difference > tolerance:
+                raise ValueError(f"{name} {metric} changed by "
+                                 f"{difference:.4f} on the feature matrix.")
+            report[name][metric] = {'frames': metrics['frames'][metric],
+                                    'matrix': metrics['matrix'][metric],
+                                    'difference': difference}
+    return report
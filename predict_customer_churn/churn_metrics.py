@@ -0,0 +1,168 @@
+"""
+Single-pass metrics of the binary churn classifiers.
+
+Every metric is derived from the churn probabilities of a model, which
+are computed only once per data split: the predicted labels, the
+confusion matrix, the per-class precision/recall/F1 and the ROC curve.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import json
+
+import numpy as np
+
+
+def roc_points(target, scores):
+    """
+    Computes the ROC curve of binary scores in one sort.
+
+    Input:
+        - target: Array of 0/1 true labels
+        - scores: Array of scores of the positive class
+    Output:
+        - Dictionary with the false positive rates (fpr), true positive
+          rates (tpr) and decreasing thresholds of the curve
+    """
+    order = np.argsort(scores, kind='mergesort')[::-1]
+    scores = scores[order]
+    target = target[order]
+
+    # Last position of each distinct threshold
+    distinct = np.where(np.diff(scores))[0]
+    ends = np.r_[distinct, len(target) - 1]
+
+    true_pos = np.cumsum(target)[ends]
+    false_pos = 1 + ends - true_pos
+    thresholds = scores[ends]
+
+    # Drop the points lying on a straight segment of the curve
+    if len(true_pos) > 2:
+        keep = np.where(np.r_[True,
+                              np.logical_or(np.diff(false_pos, 2),
+                                            np.diff(true_pos, 2)),
+                              True])[0]
+        true_pos, false_pos = true_pos[keep], false_pos[keep]
+        thresholds = thresholds[keep]
+
+    # Start the curve at (0, 0)
+    true_pos = np.r_[0, true_pos]
+    false_pos = np.r_[0, false_pos]
+    thresholds = np.r_[thresholds[0] + 1, thresholds]
+
+    return {'fpr': false_pos / max(false_pos[-1], 1),
+            'tpr': true_pos / max(true_pos[-1], 1),
+            'thresholds': thresholds}
+
+
+def binary_metrics(target, proba):
+    """
+    Derives all the evaluation metrics of a binary classifier from its
+    probabilities.
+
+    Input:
+        - target: 0/1 true labels
+        - proba: Probabilities of the positive class
+    Output:
+        - Dictionary with the confusion matrix, the precision, recall,
+          f1-score and support of each class and their averages, the
+          accuracy, the ROC curve and its AUC
+    """
+    target = np.asarray(target).astype(np.int64)
+    proba = np.asarray(proba, dtype=np.float64)
+    labels = (proba > 0.5).astype(np.int64)
+
+    # Rows are true labels, columns predicted labels
+    confusion = np.bincount(2 * target + labels,
+                            minlength=4).reshape(2, 2)
+    true_pos = np.diag(confusion).astype(np.float64)
+    predicted = confusion.sum(axis=0)
+    support = confusion.sum(axis=1)
+
+    precision = np.divide(true_pos, predicted,
+                          out=np.zeros(2), where=predicted > 0)
+    recall = np.divide(true_pos, support,
+                       out=np.zeros(2), where=support > 0)
+    denominator = precision + recall
+    f1_score = np.divide(2 * precision * recall, denominator,
+                         out=np.zeros(2), where=denominator > 0)
+
+    metrics = {'confusion_matrix': confusion.tolist()}
+    for label in (0, 1):
+        metrics[str(label)] = {'precision': precision[label],
+                               'recall': recall[label],
+                               'f1-score': f1_score[label],
+                               'support': int(support[label])}
+
+    total = int(support.sum())
+    metrics['accuracy'] = true_pos.sum() / total
+    for name, weights in (('macro avg', np.ones(2) / 2),
+                          ('weighted avg', support / total)):
+        metrics[name] = {'precision': float(precision @ weights),
+                         'recall': float(recall @ weights),
+                         'f1-score': float(f1_score @ weights),
+                         'support': total}
+
+    roc = roc_points(target, proba)
+    metrics['roc'] = roc
+    metrics['roc_auc'] = float(np.sum(np.diff(roc['fpr']) *
+                                      (roc['tpr'][1:] + roc['tpr'][:-1]))
+                               / 2)
+    return metrics
+
+
+def format_report(metrics, digits=2):
+    """
+    Formats metrics as the text of sklearn's classification_report.
+
+    Input:
+        - metrics: Dictionary returned by binary_metrics
+        - digits: Number of digits of the floating point values
+    Output:
+        - report: Text report
+    """
+    width = len('weighted avg')
+    headers = ['precision', 'recall', 'f1-score', 'support']
+    row_fmt = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+
+    report = ('{:>{width}s} ' + ' {:>9}' * 4).format('', *headers,
+                                                      width=width)
+    report += '\n\n'
+    for name in ('0', '1'):
+        row = metrics[name]
+        report += row_fmt.format(name, row['precision'], row['recall'],
+                                 row['f1-score'], row['support'],
+                                 width=width, digits=digits)
+    report += '\n'
+
+    report += ('{:>{width}s} ' + ' {:>9.{digits}}' * 2 +
+               ' {:>9.{digits}f}' + ' {:>9}\n').format(
+                   'accuracy', '', '', metrics['accuracy'],
+                   metrics['weighted avg']['support'],
+                   width=width, digits=digits)
+    for name in ('macro avg', 'weighted avg'):
+        row = metrics[name]
+        report += row_fmt.format(name, row['precision'], row['recall'],
+                                 row['f1-score'], row['support'],
+                                 width=width, digits=digits)
+    return report
+
+
+def save_metrics(metrics, path):
+    """
+    Writes nested metrics dictionaries to a JSON file.
+
+    Input:
+        - metrics: Dictionary of model name -> split -> binary_metrics
+        - path: Path to the JSON file
+    """
+    def to_builtin(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f"Cannot serialize {type(value)}")
+
+    with open(path, 'w') as file:
+        json.dump(metrics, file, indent=2, default=to_builtin)
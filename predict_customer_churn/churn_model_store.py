@@ -0,0 +1,157 @@
+"""
+Export of random forests as flat, memory-mappable node arrays.
+
+A forest unpickled with joblib rebuilds every tree in private memory,
+so each worker process holds its own copy of all the node arrays. The
+export below concatenates the nodes of every tree into a few plain
+.npy files, which np.load(mmap_mode='r') maps read-only: all the
+workers of a host then share the same page cache pages.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import json
+
+from pathlib import Path
+import numpy as np
+
+# Node arrays written by export_forest
+ARRAY_NAMES = ['roots', 'left', 'right', 'feature', 'threshold', 'value']
+
+
+def export_forest(model, folder):
+    """
+    Writes the trees of a fitted forest classifier as flat arrays.
+
+    Child indices are global positions in the concatenated arrays (-1
+    for leaves), and the leaf values are stored as class probabilities.
+
+    Input:
+        - model: Fitted RandomForestClassifier
+        - folder: Path to the folder where the arrays are written
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    roots, left, right, feature, threshold, value = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+
+        roots.append(offset)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+
+        # Normalize the per-node class counts into probabilities
+        counts = tree.value[:, 0, :]
+        value.append(counts / counts.sum(axis=1, keepdims=True))
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays = {'roots': np.asarray(roots, dtype=np.int64),
+              'left': np.concatenate(left).astype(np.int64),
+              'right': np.concatenate(right).astype(np.int64),
+              'feature': np.concatenate(feature).astype(np.int64),
+              'threshold': np.concatenate(threshold).astype(np.float64),
+              'value': np.concatenate(value).astype(np.float64)}
+
+    # Plain uncompressed .npy files, whose data can be memory-mapped
+    for name, array in arrays.items():
+        np.save(folder / f'{name}.npy', np.ascontiguousarray(array))
+
+    meta = {'classes': np.asarray(model.classes_).tolist(),
+            'n_features': int(model.n_features_in_),
+            'max_depth': int(max_depth)}
+    with open(folder / 'meta.json', 'w') as file:
+        json.dump(meta, file)
+
+
+class MappedForest:
+    """
+    Forest classifier evaluated from the arrays written by
+    export_forest.
+
+    The trees are walked level by level for all trees and rows at once,
+    comparing float32 features to the thresholds as scikit-learn does,
+    so predictions match the original forest.
+    """
+
+    def __init__(self, folder, mmap_mode='r'):
+        """
+        Input:
+            - folder: Path to the folder written by export_forest
+            - mmap_mode: Passed to np.load, None loads private copies
+        """
+        folder = Path(folder)
+        with open(folder / 'meta.json') as file:
+            meta = json.load(file)
+
+        self.classes_ = np.asarray(meta['classes'])
+        self.n_features_ = meta['n_features']
+        self.max_depth = meta['max_depth']
+        self.arrays = {name: np.load(folder / f'{name}.npy',
+                                     mmap_mode=mmap_mode)
+                       for name in ARRAY_NAMES}
+
+    def predict_proba(self, features, chunk_size=2000):
+        """
+        Averages the leaf class probabilities of all trees.
+
+        Input:
+            - features: Pandas dataframe or array of features values
+            - chunk_size: Number of rows walked at once
+        Output:
+            - proba: Array of shape (n_rows, n_classes)
+        """
+        data = np.asarray(features, dtype=np.float32)
+        roots = self.arrays['roots']
+        left, right = self.arrays['left'], self.arrays['right']
+        feature = self.arrays['feature']
+        threshold = self.arrays['threshold']
+        value = self.arrays['value']
+
+        proba = np.empty((len(data), len(self.classes_)))
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            rows = np.arange(len(chunk))
+
+            # One current node per (tree, row), starting at the roots
+            nodes = np.repeat(roots[:, None], len(chunk), axis=1)
+            for _ in range(self.max_depth):
+                go_left = chunk[rows, feature[nodes]] <= threshold[nodes]
+                children = np.where(go_left, left[nodes], right[nodes])
+                # Leaves have no children and keep their position
+                nodes = np.where(children == -1, nodes, children)
+
+            proba[start:start + len(chunk)] = value[nodes].mean(axis=0)
+        return proba
+
+    def predict(self, features):
+        """
+        Predicts the most probable class of each row.
+
+        Input:
+            - features: Pandas dataframe or array of features values
+        Output:
+            - Array of predicted classes
+        """
+        return self.classes_[self.predict_proba(features).argmax(axis=1)]
+
+
+def load_forest(folder, mmap_mode='r'):
+    """
+    Loads a forest exported by export_forest.
+
+    Input:
+        - folder: Path to the folder written by export_forest
+        - mmap_mode: Passed to np.load, None loads private copies
+    Output:
+        - MappedForest
+    """
+    return MappedForest(folder, mmap_mode=mmap_mode)
@@ -0,0 +1,256 @@
+"""
+Incremental stage runner of the churn pipeline.
+
+The pipeline is a small DAG of stages. Each stage is keyed by a
+fingerprint of its parameters, of the source code it runs and of the
+keys of the stages it depends on, so a stage key changes whenever
+anything upstream of it changes. The result and the output files of a
+stage are persisted under its key, and a rerun with the same key
+restores them instead of running the stage again.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import shutil
+import inspect
+import importlib
+import logging
+
+from pathlib import Path
+
+import joblib
+
+from churn_cache import fingerprint
+
+
+def code_version(code):
+    """
+    Returns a digest of the source code of functions, classes and
+    modules.
+
+    Input:
+        - code: List of functions, classes, modules or module names
+    Output:
+        - digest: Hexadecimal string
+    """
+    sources = []
+    for obj in code:
+        if isinstance(obj, str):
+            obj = importlib.import_module(obj)
+        sources.append(inspect.getsource(obj))
+    return fingerprint(*sources)
+
+
+def _copy_changed(src, dst):
+    """
+    Copies the files of src (a file or a folder) to dst, skipping
+    the files that already have the same size and modification time.
+
+    Input:
+        - src: Path to the source file or folder
+        - dst: Path to the destination file or folder
+    """
+    src, dst = Path(src), Path(dst)
+    if not src.exists():
+        return
+    if src.is_dir():
+        pairs = [(path, dst / path.relative_to(src))
+                 for path in src.rglob('*') if path.is_file()]
+    else:
+        pairs = [(src, dst)]
+
+    for source, target in pairs:
+        if target.exists():
+            source_stat, target_stat = source.stat(), target.stat()
+            if source_stat.st_size == target_stat.st_size and \
+                    source_stat.st_mtime_ns == target_stat.st_mtime_ns:
+                continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source, target)
+
+
+class Stage:
+    """
+    A step of the pipeline.
+    """
+
+    def __init__(self,
+                 name,
+                 func,
+                 deps=(),
+                 params=None,
+                 code=(),
+                 outputs=(),
+                 persist=True):
+        """
+        Input:
+            - name: Unique name of the stage
+            - func: Callable taking the results of deps, in order
+            - deps: Names of the stages whose results func takes
+            - params: JSON-serializable parameters of the stage, part of
+              its key
+            - code: Functions, classes or modules whose source is part of
+              the key of the stage
+            - outputs: Paths of the files or folders written by func,
+              persisted with the result
+            - persist: If False, the result is not persisted and the
+              stage runs whenever a dependent stage needs it
+        """
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.code = list(code)
+        self.outputs = [Path(path) for path in outputs]
+        self.persist = persist
+
+
+class StageRunner:
+    """
+    Runs a DAG of stages, skipping those whose key is unchanged.
+    """
+
+    def __init__(self, folder):
+        """
+        Input:
+            - folder: Path to the folder where the stage results and
+              outputs are persisted
+        """
+        self.folder = Path(folder)
+        self.stages = {}
+        self._keys = {}
+        self._results = {}
+        self._ran = set()
+        self.force = False
+
+    def add(self, stage):
+        """
+        Adds a stage, after all the stages it depends on.
+
+        Input:
+            - stage: Stage
+        """
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {stage.name} depends on unknown "
+                                 f"stage {dep}")
+        self.stages[stage.name] = stage
+
+    def key(self, name):
+        """
+        Returns the fingerprint of a stage.
+
+        Input:
+            - name: Name of the stage
+        Output:
+            - key: Hexadecimal string
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            self._keys[name] = fingerprint(
+                name, stage.params, code_version(stage.code),
+                [self.key(dep) for dep in stage.deps])
+        return self._keys[name]
+
+    def _entry(self, name):
+        return self.folder / name / self.key(name)
+
+    def is_done(self, name):
+        """
+        Returns whether a stage was persisted with its current key.
+
+        Input:
+            - name: Name of the stage
+        """
+        return self.stages[name].persist and \
+            (self._entry(name) / 'done').exists()
+
+    def result(self, name):
+        """
+        Returns the result of a stage, loaded from its persisted entry
+        or computed from the results of its dependencies.
+
+        Input:
+            - name: Name of the stage
+        Output:
+            - result: Value returned by the stage function
+        """
+        if name in self._results:
+            return self._results[name]
+
+        stage = self.stages[name]
+        if not self.force and self.is_done(name):
+            result = joblib.load(self._entry(name) / 'result.joblib')
+        else:
+            result = stage.func(*[self.result(dep) for dep in stage.deps])
+            self._ran.add(name)
+            if stage.persist:
+                self._save(stage, result)
+
+        self._results[name] = result
+        return result
+
+    def _save(self, stage, result):
+        """
+        Persists the result and the output files of a stage, and drops
+        the entries of its previous keys.
+
+        Input:
+            - stage: Stage
+            - result: Value returned by the stage function
+        """
+        entry = self._entry(stage.name)
+
+        # Fill a temporary folder and rename it, so that an
+        # interrupted run never leaves an entry marked as done
+        tmp_entry = entry.with_name(f"{entry.name}.tmp{os.getpid()}")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        tmp_entry.mkdir(parents=True)
+        joblib.dump(result, tmp_entry / 'result.joblib')
+        for i, path in enumerate(stage.outputs):
+            _copy_changed(path, tmp_entry / 'outputs' / str(i))
+        (tmp_entry / 'done').touch()
+
+        for stale in entry.parent.iterdir():
+            if stale != tmp_entry:
+                shutil.rmtree(stale)
+        os.replace(tmp_entry, entry)
+
+    def _restore(self, stage):
+        """
+        Restores the output files of a persisted stage.
+
+        Input:
+            - stage: Stage
+        """
+        for i, path in enumerate(stage.outputs):
+            _copy_changed(self._entry(stage.name) / 'outputs' / str(i),
+                          path)
+
+    def run(self, force=False):
+        """
+        Runs every stage whose key changed since its last run, and
+        restores the outputs of the others.
+
+        Input:
+            - force: If True, every stage runs again
+        Output:
+            - status: Dictionary of stage name -> 'ran' or 'skipped'
+        """
+        self.force = force
+        self._results = {}
+        self._ran = set()
+
+        for name, stage in self.stages.items():
+            if not force and self.is_done(name):
+                self._restore(stage)
+                logging.info("Skipping %s: inputs unchanged", name)
+            elif stage.persist:
+                self.result(name)
+            # Stages which are not persisted only run when a dependent
+            # stage needs their result
+
+        return {name: 'ran' if name in self._ran else 'skipped'
+                for name in self.stages}
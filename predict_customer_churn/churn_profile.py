@@ -0,0 +1,175 @@
+"""
+Per-stage profiling of the churn pipeline.
+
+StageProfiler records the wall time, CPU time, peak resident memory and
+row count of every stage of a run and of the sub-steps nested in it,
+and writes them as a JSON trace. Optionally, every top-level stage runs
+under cProfile and the statistics of the slowest one are dumped.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import json
+import time
+import resource
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from pathlib import Path
+
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB.
+
+    Output:
+        - VmHWM of /proc/self/status, or the lifetime peak reported by
+          getrusage outside Linux
+    """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident set size of the process to its current
+    value, so that the next reading is the peak of the stage only.
+
+    Output:
+        - True if the peak could be reset (Linux only)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _children_cpu_seconds():
+    """
+    Returns the CPU time of the terminated child processes, e.g. the
+    workers of a process pool.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class StageProfiler:
+    """
+    Records a tree of timed stages.
+
+    Stages are opened with the stage context manager, which yields the
+    record of the stage so that its row count can be filled in once it
+    is known. A disabled profiler keeps no records and costs nothing.
+    """
+
+    def __init__(self, enabled=True, cprofile=False):
+        """
+        Input:
+            - enabled: If False, stages are not recorded
+            - cprofile: If True, top-level stages run under cProfile and
+              the statistics of the slowest one are kept
+        """
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+        self._stack = []
+        self._slowest = None
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Records the stage run inside the with block.
+
+        Input:
+            - name: Name of the stage
+            - rows: Number of rows processed, can also be set later
+              through the 'rows' key of the yielded record
+        Output:
+            - record: Dictionary of the stage
+        """
+        record = {'name': name, 'rows': rows}
+        if not self.enabled:
+            yield record
+            return
+
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            parent['children'].append(record)
+            # Keep the peak reached by the parent so far before the
+            # counter is reset for the child
+            parent['peak_rss_mb'] = max(parent['peak_rss_mb'],
+                                        _peak_rss_mb())
+        else:
+            self.stages.append(record)
+
+        record['children'] = []
+        record['peak_rss_mb'] = 0.0
+        exact_peak = _reset_peak_rss()
+        self._stack.append(record)
+
+        profile = None
+        if self.cprofile and parent is None:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children_cpu = _children_cpu_seconds()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['children_cpu_seconds'] = \
+                _children_cpu_seconds() - children_cpu
+            record['peak_rss_mb'] = max(record['peak_rss_mb'],
+                                        _peak_rss_mb())
+            record['exact_peak'] = exact_peak
+            self._stack.pop()
+
+            if parent is not None:
+                parent['peak_rss_mb'] = max(parent['peak_rss_mb'],
+                                            record['peak_rss_mb'])
+
+            if profile is not None:
+                profile.disable()
+                slowest = self._slowest
+                if slowest is None or \
+                        record['wall_seconds'] > slowest[0]['wall_seconds']:
+                    self._slowest = (record, profile)
+
+    def save(self, path, cprofile_path=None):
+        """
+        Writes the trace of the recorded stages.
+
+        Input:
+            - path: Path to the JSON trace
+            - cprofile_path: Path to the cProfile dump of the slowest
+              top-level stage, written only if cProfile is enabled
+        """
+        trace = {'started': self.started,
+                 'pid': os.getpid(),
+                 'stages': self.stages}
+
+        if self._slowest is not None and cprofile_path is not None:
+            record, profile = self._slowest
+            Path(cprofile_path).parent.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(str(cprofile_path))
+            trace['cprofile'] = {'stage': record['name'],
+                                 'path': str(cprofile_path)}
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(trace, file, indent=2)
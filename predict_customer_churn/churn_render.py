@@ -0,0 +1,224 @@
+"""
+Parallel, incremental rendering of the churn figures.
+
+Figures are described by a plotting function and the summary data it
+draws. FigureRenderer hashes both, skips the figures whose hash matches
+the one recorded next to the existing image, and renders the others in
+a pool of processes using the non-interactive Agg backend, so that the
+main process never touches the pyplot state.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pathlib import Path
+
+import joblib
+import matplotlib
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+import shap
+
+from churn_pipeline import code_version
+
+# Hashes of the figures of a folder, keyed by file name
+MANIFEST_NAME = '.figures.json'
+
+
+def _init_worker():
+    """
+    Sets up matplotlib in a rendering process.
+    """
+    matplotlib.use('Agg')
+    sns.set()
+
+
+def _render(func, path, args, kwargs):
+    """
+    Renders one figure, e.g. in a worker process.
+
+    Input:
+        - func: Plotting function, called as func(*args, path, **kwargs)
+        - path: Path to the image file
+        - args, kwargs: Summary data drawn by func
+    Output:
+        - seconds: Rendering time
+    """
+    tic = time.perf_counter()
+    func(*args, path, **kwargs)
+    return time.perf_counter() - tic
+
+
+class FigureRenderer:
+    """
+    Renders figures in parallel, skipping unchanged ones.
+
+    Used as a context manager: figures are submitted inside the with
+    block and the block exits once all of them are written.
+    """
+
+    def __init__(self, n_jobs=1):
+        """
+        Input:
+            - n_jobs: Number of rendering processes, 1 to render in
+              process and -1 to use every CPU
+        """
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        self.pool = None
+        self.pending = []
+        self.manifests = {}
+        # Status and rendering time of each submitted figure
+        self.report = {}
+
+    def __enter__(self):
+        if self.n_jobs > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.n_jobs,
+                                            initializer=_init_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _manifest(self, folder):
+        if folder not in self.manifests:
+            try:
+                with open(folder / MANIFEST_NAME) as file:
+                    self.manifests[folder] = json.load(file)
+            except (FileNotFoundError, ValueError):
+                self.manifests[folder] = {}
+        return self.manifests[folder]
+
+    def submit(self, path, func, *args, **kwargs):
+        """
+        Renders func(*args, path, **kwargs) unless path exists and was
+        rendered from the same function and data.
+
+        Input:
+            - path: Path to the image file
+            - func: Module-level plotting function
+            - args, kwargs: Summary data drawn by func
+        """
+        path = Path(path)
+        digest = joblib.hash((code_version([func]), args, kwargs))
+        manifest = self._manifest(path.parent)
+        if path.exists() and manifest.get(path.name) == digest:
+            self.report[path.name] = {'status': 'skipped'}
+            return
+
+        # Forget the previous hash until the new image is written
+        manifest.pop(path.name, None)
+        if self.pool is None:
+            self._done(path, digest, _render(func, path, args, kwargs))
+        else:
+            future = self.pool.submit(_render, func, path, args, kwargs)
+            self.pending.append((path, digest, future))
+
+    def _done(self, path, digest, seconds):
+        self._manifest(path.parent)[path.name] = digest
+        self.report[path.name] = {'status': 'rendered',
+                                  'seconds': seconds}
+
+    def close(self):
+        """
+        Waits for the pending figures and records their hashes.
+        """
+        try:
+            for path, digest, future in self.pending:
+                self._done(path, digest, future.result())
+        finally:
+            self.pending = []
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+            for folder, manifest in self.manifests.items():
+                with open(folder / MANIFEST_NAME, 'w') as file:
+                    json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+def plot_report(title, train_report, test_report, path):
+    """
+    Saves the classification reports of a model as an image.
+
+    Input:
+        - title: Name of the model
+        - train_report, test_report: Text reports of the training and
+          testing sets
+        - path: Path to the image file
+    """
+    plt.rc('figure', figsize=(5, 5))
+
+    # Add texts for classification report for training/test sets
+    plt.text(0.01, 1.25, f'{title} Train',
+             {'fontsize': 10}, fontproperties='monospace')
+    plt.text(0.01, 0.7, train_report,
+             {'fontsize': 10}, fontproperties='monospace')
+    plt.text(0.01, 0.6, f'{title} Test',
+             {'fontsize': 10}, fontproperties='monospace')
+    plt.text(0.01, 0.05, test_report,
+             {'fontsize': 10}, fontproperties='monospace')
+
+    # Remove axes
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_roc_curves(curves, path):
+    """
+    Saves ROC curves on one axis.
+
+    Input:
+        - curves: List of (label, fpr, tpr) tuples
+        - path: Path to the image file
+    """
+    plt.figure(figsize=(15, 8))
+    axis = plt.gca()
+    for label, fpr, tpr in curves:
+        axis.plot(fpr, tpr, alpha=0.8, label=label)
+    axis.set_xlabel('False Positive Rate (Positive label: 1)')
+    axis.set_ylabel('True Positive Rate (Positive label: 1)')
+    axis.legend(loc='lower right')
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_importances(names, importances, path):
+    """
+    Saves the bar plot of feature importances.
+
+    Input:
+        - names: Feature names, sorted by decreasing importance
+        - importances: Importances in the same order
+        - path: Path to the image file
+    """
+    fig = plt.figure(figsize=(20, 5))
+    plt.title("Feature Importance")
+    plt.ylabel('Importance')
+    plt.bar(range(len(names)), importances)
+    plt.xticks(range(len(names)), names, rotation=90)
+    plt.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def plot_shap_summary(shap_values, features, path):
+    """
+    Saves the SHAP summary bar plot.
+
+    Input:
+        - shap_values: SHAP values of features
+        - features: Pandas dataframe of the explained rows
+        - path: Path to the image file
+    """
+    fig = plt.figure(figsize=(20, 5))
+    shap.summary_plot(shap_values, features, plot_type="bar", show=False)
+    fig.savefig(path, format="png", dpi=300, bbox_inches="tight")
+    plt.close(fig)
+
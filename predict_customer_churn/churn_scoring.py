@@ -0,0 +1,250 @@
+"""
+Batch scoring of customer files with the saved churn models.
+
+The input is read in chunks, every chunk is encoded with the saved
+target encoder and scored in a pool of worker processes, and the
+predictions are written incrementally, so the peak memory only depends
+on the chunk size and on the number of workers.
+
+Usage:
+    python churn_scoring.py --input ./data/bank_data.csv \
+                            --output ./data/bank_data_scores.csv
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+
+import joblib
+
+from churn_library import FEATURE_COLS
+from churn_model_store import load_forest
+
+logger = logging.getLogger()
+
+# Model and encoder of the worker process, loaded once by _init_worker
+_MODEL = None
+_ENCODER = None
+
+
+def engineer_features(df, encoder):
+    """
+    Builds the model matrix of a batch of customers, with the same
+    columns and encodings as perform_feature_engineering.
+
+    Input:
+        - df: Pandas dataframe of raw customer data
+        - encoder: Fitted TargetEncoder
+    Output:
+        - features: Pandas dataframe with the FEATURE_COLS columns
+    """
+    encoded = encoder.transform(df)
+    return pd.concat([df, encoded], axis=1)[FEATURE_COLS]
+
+
+def read_chunks(path, chunksize):
+    """
+    Yields the rows of a CSV or Parquet file in chunks.
+
+    Input:
+        - path: Path to a .csv or .parquet file
+        - chunksize: Number of rows per chunk
+    Output:
+        - Iterator of Pandas dataframes
+    """
+    if str(path).endswith('.parquet'):
+        for batch in parquet.ParquetFile(path).iter_batches(
+                batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, index_col=0, chunksize=chunksize)
+
+
+def _init_worker(model_path, encoder_path):
+    """
+    Loads the model and the encoder of a worker process.
+
+    Input:
+        - model_path: Path to the pickled model, or to the folder of a
+          forest exported by export_forest, which is memory-mapped and
+          shared by all the workers
+        - encoder_path: Path to the pickled TargetEncoder
+    """
+    global _MODEL, _ENCODER  # pylint: disable=global-statement
+    if os.path.isdir(model_path):
+        _MODEL = load_forest(model_path)
+    else:
+        _MODEL = joblib.load(model_path)
+    _ENCODER = joblib.load(encoder_path)
+
+
+def score_chunk(df, id_column):
+    """
+    Scores one chunk of customers in a worker process.
+
+    Input:
+        - df: Pandas dataframe of raw customer data
+        - id_column: Column identifying the customers, kept in the
+          output
+    Output:
+        - scores: Pandas dataframe with the id, the predicted label and
+          the churn probability of each customer
+    """
+    features = engineer_features(df, _ENCODER)
+    probability = _MODEL.predict_proba(features)[:, 1]
+    # Strictly above 0.5, like predict and binary_metrics, which resolve
+    # a tie to class 0
+    return pd.DataFrame({id_column: df[id_column].to_numpy(),
+                         'prediction': (probability > 0.5).astype('int8'),
+                         'probability': probability})
+
+
+class ScoreWriter:
+    """
+    Appends chunks of scores to a CSV or Parquet file.
+    """
+
+    def __init__(self, path):
+        """
+        Input:
+            - path: Path to a .csv or .parquet output file
+        """
+        self.path = str(path)
+        self.parquet_writer = None
+        self.header = True
+
+        # Start from an empty file, chunks are appended afterwards
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, scores):
+        """
+        Appends one chunk of scores to the output file.
+
+        Input:
+            - scores: Pandas dataframe returned by score_chunk
+        """
+        if self.path.endswith('.parquet'):
+            table = pa.Table.from_pandas(scores, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = parquet.ParquetWriter(self.path,
+                                                            table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            scores.to_csv(self.path, mode='a', header=self.header,
+                          index=False)
+            self.header = False
+
+    def close(self):
+        """
+        Closes the output file.
+        """
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def go(args):
+    """
+    Scores args.input chunk by chunk and writes args.output.
+
+    At most two chunks per worker are in flight at any time, and the
+    scores are written in input order as soon as they are ready.
+
+    Input:
+        - args: Parsed command line arguments
+    """
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+    writer = ScoreWriter(args.output)
+    n_rows = 0
+
+    logger.info("Scoring %s with %s workers", args.input, n_jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             initializer=_init_worker,
+                             initargs=(args.model, args.encoder)) as pool:
+        pending = deque()
+        for chunk in read_chunks(args.input, args.chunksize):
+            pending.append(pool.submit(score_chunk, chunk, args.id_column))
+
+            # Bound the number of chunks held in memory
+            if len(pending) >= 2 * n_jobs:
+                scores = pending.popleft().result()
+                writer.write(scores)
+                n_rows += len(scores)
+
+        while pending:
+            scores = pending.popleft().result()
+            writer.write(scores)
+            n_rows += len(scores)
+
+    writer.close()
+    logger.info("Wrote %s scores to %s", n_rows, args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+
+    parser = argparse.ArgumentParser(
+        description="Score a customer file with a saved churn model",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--input", type=str, help="CSV or Parquet file to score",
+        required=True
+    )
+
+    parser.add_argument(
+        "--output", type=str, help="CSV or Parquet file for the scores",
+        required=True
+    )
+
+    parser.add_argument(
+        "--model",
+        type=str,
+        help="Path to the pickled model or to an exported forest folder",
+        required=False,
+        default="./models/rfc_model.pkl",
+    )
+
+    parser.add_argument(
+        "--encoder",
+        type=str,
+        help="Path to the pickled target encoder",
+        required=False,
+        default="./models/target_encoder.pkl",
+    )
+
+    parser.add_argument(
+        "--id_column",
+        type=str,
+        help="Column identifying the customers",
+        required=False,
+        default="CLIENTNUM",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows scored per chunk",
+        required=False,
+        default=100000,
+    )
+
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        help="Number of worker processes, -1 to use every CPU",
+        required=False,
+        default=-1,
+    )
+
+    go(parser.parse_args())
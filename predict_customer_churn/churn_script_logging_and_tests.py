@@ -2,14 +2,46 @@
 Test functions and logging for churn library
 churn.
 
+The tests run in the fast test mode of the library (TEST_CONFIG)
+unless --full is given. With pytest, the fixtures of conftest.py
+import and encode the data once per session:
+    pytest churn_script_logging_and_tests.py [--full]
+
 Author: Yuri Marca
 Date: November 14th, 2024
 """
 
 
 import os
+import json
+import argparse
 import logging
-from churn_library import ChurnLibrarySolution
+import tempfile
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import shap
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GridSearchCV
+import joblib
+from churn_library import ChurnLibrarySolution, TargetEncoder, TEST_CONFIG
+from churn_library import CATEGORY_LST
+from churn_profile import StageProfiler
+from churn_pipeline import Stage, StageRunner
+from churn_eda import collect_stats
+from churn_render import FigureRenderer, plot_importances
+from churn_synthetic import fit_profile, generate_chunks
+from churn_matrix import validate_matrix
+from churn_stream import StreamingLogisticTrainer
+import churn_scoring
+from churn_scoring import engineer_features
+from churn_metrics import binary_metrics
+from churn_search import SuccessiveHalvingSearch, MemoizedGridSearch
+from churn_cache import DiskCache
+import churn_explain
+from churn_explain import compute_shap_values, sample_rows
+from churn_model_store import export_forest, load_forest
 
 logging.basicConfig(
     filename='./logs/churn_library.log',
@@ -18,6 +50,19 @@ logging.basicConfig(
     format='%(name)s - %(levelname)s - %(message)s')
 
 
+class TreeCountingForest(RandomForestClassifier):
+    '''
+    Random forest recording how many trees each call to fit grows.
+    '''
+    grown_trees = []
+
+    def fit(self, X, y, sample_weight=None):
+        before = len(getattr(self, 'estimators_', []))
+        super().fit(X, y, sample_weight)
+        TreeCountingForest.grown_trees.append(len(self.estimators_) - before)
+        return self
+
+
 def test_import(import_data):
     '''
     Test data import function.
@@ -39,16 +84,38 @@ def test_import(import_data):
         raise err
 
 
-def test_eda(perform_eda, df):
+def test_import_cached(import_data):
+    '''
+    Test data import through the columnar cache.
+    '''
+    try:
+        df_csv = import_data("./data/bank_data.csv")
+        # First call writes the cache, second call reads it back
+        import_data("./data/bank_data.csv", use_cache=True)
+        df_cached = import_data("./data/bank_data.csv", use_cache=True)
+
+        assert df_cached.shape == df_csv.shape
+        assert df_cached.index.equals(df_csv.index)
+        assert df_cached['Gender'].dtype == 'category'
+        logging.info("Testing import_data cache: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing import_data cache: Cached DataFrame " + \
+                        "does not match the CSV")
+        raise err
+
+
+def test_eda(cls, perform_eda, df):
     '''
     Test perform_eda function.
     '''
     try:
         perform_eda(df)
-        assert os.path.isfile('./images/eda/churn_dist.png')
-        assert os.path.isfile('./images/eda/customer_age_dist.png')
-        assert os.path.isfile('./images/eda/marital_status_dist.png')
-        assert os.path.isfile('./images/eda/total_trans_count_dist.png')
+        assert os.path.isfile(cls.img_eda_folder / 'churn_dist.png')
+        assert os.path.isfile(cls.img_eda_folder / 'customer_age_dist.png')
+        assert os.path.isfile(cls.img_eda_folder /
+                              'marital_status_dist.png')
+        assert os.path.isfile(cls.img_eda_folder /
+                              'total_trans_count_dist.png')
         logging.info("Testing perform_eda: SUCCESS")
     except AssertionError as err:
         logging.error("Testing perform_eda: EDA files were not" +
@@ -60,6 +127,40 @@ def test_eda(perform_eda, df):
         raise err
 
 
+def test_eda_stats(df):
+    '''
+    Test EDA statistics merged over chunks against pandas.
+    '''
+    try:
+        drop_cols = ['Attrition_Flag', 'Gender', 'Education_Level',
+                     'Marital_Status', 'Income_Category', 'Card_Category']
+        # Uneven chunks, whatever the number of rows of the test mode,
+        # so that every statistic is merged several times
+        bounds = [0, len(df) // 7, len(df) // 2, len(df) - 5, len(df)]
+        chunks = [df.iloc[start:end].copy()
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+        assert all(len(chunk) > 0 for chunk in chunks)
+        stats = collect_stats(chunks, ['Customer_Age'], ['Marital_Status'],
+                              drop_cols)
+
+        expected = df.drop(columns=drop_cols).corr()
+        assert (stats.moments.correlation() - expected).abs().max().max() \
+            < 1e-9
+        assert stats.categories['Marital_Status'].value_counts() \
+            .equals(df['Marital_Status'].value_counts())
+        assert stats.sketches['Customer_Age'].quantile(0.5) == \
+            df['Customer_Age'].quantile(0.5, interpolation='lower')
+        logging.info("Testing collect_stats: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing collect_stats: Merged statistics do " + \
+                        "not match pandas")
+        raise err
+    except Exception as err:
+        logging.error("Testing collect_stats: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
 def test_encoder_helper(encoder_helper, df):
     '''
     Test encoder helper function.
@@ -71,6 +172,10 @@ def test_encoder_helper(encoder_helper, df):
 
         for category in category_lst:
             assert f"{category}_Churn" in df.columns
+
+        # An empty category list leaves the DataFrame as it is
+        columns = list(df.columns)
+        assert list(encoder_helper(df, []).columns) == columns
         logging.info("Testing encoder_helper: SUCCESS")
     except AssertionError as err:
         logging.error("Testing encoder_helper: Not all encoded " + \
@@ -82,6 +187,157 @@ def test_encoder_helper(encoder_helper, df):
         raise err
 
 
+def test_target_encoder(df):
+    '''
+    Test TargetEncoder tables against the per-category churn proportion.
+    '''
+    try:
+        category_lst = ['Gender', 'Education_Level', 'Marital_Status',
+                        'Income_Category', 'Card_Category']
+        encoder = TargetEncoder(category_lst).fit(df)
+        encoded = encoder.transform(df.head(100))
+
+        for category in category_lst:
+            expected = df.head(100)[category].map(
+                df.groupby(category)['Churn'].mean())
+            assert (encoded[f"{category}_Churn"] - expected).abs().max() \
+                < 1e-12
+
+        # Unseen and missing levels get the overall churn rate
+        unseen = df.head(2).assign(Gender=['Unseen', None])
+        assert (encoder.transform(unseen)['Gender_Churn'] -
+                df['Churn'].mean()).abs().max() < 1e-12
+        logging.info("Testing TargetEncoder: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing TargetEncoder: Encoded proportions do " + \
+                        "not match the category churn rates")
+        raise err
+    except Exception as err:
+        logging.error("Testing TargetEncoder: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_stage_profiler(tmp_path):
+    '''
+    Test StageProfiler trace of nested stages.
+    '''
+    trace_path = str(tmp_path / 'test_profile.json')
+    try:
+        profiler = StageProfiler()
+        with profiler.stage('outer', rows=10):
+            with profiler.stage('inner') as stage:
+                stage['rows'] = 5
+        profiler.save(trace_path)
+
+        with open(trace_path) as file:
+            trace = json.load(file)
+        outer = trace['stages'][0]
+        assert outer['name'] == 'outer' and outer['rows'] == 10
+        assert outer['children'][0]['rows'] == 5
+        assert outer['wall_seconds'] >= \
+            outer['children'][0]['wall_seconds']
+        assert outer['peak_rss_mb'] > 0
+        logging.info("Testing StageProfiler: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing StageProfiler: The trace does not " + \
+                        "match the recorded stages")
+        raise err
+    except Exception as err:
+        logging.error("Testing StageProfiler: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_stage_runner():
+    '''
+    Test StageRunner skips unchanged stages and reruns changed ones.
+    '''
+    try:
+        calls = []
+
+        def build(folder, scale):
+            runner = StageRunner(folder)
+            runner.add(Stage('source', lambda: calls.append('source') or 2,
+                             persist=False))
+            runner.add(Stage('scaled',
+                             lambda x: calls.append('scaled') or x * scale,
+                             deps=['source'], params={'scale': scale}))
+            return runner
+
+        with tempfile.TemporaryDirectory() as folder:
+            status = build(folder, 3).run()
+            assert status == {'source': 'ran', 'scaled': 'ran'}
+            assert build(folder, 3).run() == {'source': 'skipped',
+                                              'scaled': 'skipped'}
+            assert build(folder, 3).result('scaled') == 6
+            assert build(folder, 4).run()['scaled'] == 'ran'
+            assert calls == ['source', 'scaled', 'source', 'scaled']
+        logging.info("Testing StageRunner: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing StageRunner: Unchanged stages were " + \
+                        "not skipped or changed stages did not rerun")
+        raise err
+    except Exception as err:
+        logging.error("Testing StageRunner: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_figure_renderer():
+    '''
+    Test FigureRenderer skips figures drawn from unchanged data.
+    '''
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'importances.png')
+            statuses = []
+            for importances in ([0.7, 0.3], [0.7, 0.3], [0.6, 0.4]):
+                with FigureRenderer() as renderer:
+                    renderer.submit(path, plot_importances, ['a', 'b'],
+                                    importances)
+                statuses.append(renderer.report['importances.png']['status'])
+            assert os.path.getsize(path) > 0
+            assert statuses == ['rendered', 'skipped', 'rendered']
+        logging.info("Testing FigureRenderer: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing FigureRenderer: Unchanged figures were " + \
+                        "not skipped or changed figures not rendered")
+        raise err
+    except Exception as err:
+        logging.error("Testing FigureRenderer: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_synthetic_data(df):
+    '''
+    Test the synthetic data generator against the real data.
+    '''
+    try:
+        profile = fit_profile(df.drop(columns=['Churn'], errors='ignore'))
+        synthetic = pd.concat(generate_chunks(profile, 20000,
+                                              chunk_size=7000))
+
+        assert list(synthetic.columns) == profile['columns']
+        assert synthetic.index.equals(pd.RangeIndex(20000))
+        assert synthetic['CLIENTNUM'].is_unique
+        real_rate = (df['Attrition_Flag'] != "Existing Customer").mean()
+        rate = (synthetic['Attrition_Flag'] != "Existing Customer").mean()
+        assert abs(rate - real_rate) < 0.02
+        assert (synthetic['Total_Revolving_Bal'] <=
+                synthetic['Credit_Limit']).all()
+        logging.info("Testing generate_chunks: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing generate_chunks: Synthetic data does " + \
+                        "not match the real data")
+        raise err
+    except Exception as err:
+        logging.error("Testing generate_chunks: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
 def test_perform_feature_engineering(perform_feature_engineering, df):
     '''
     Test perform_feature_engineering function.
@@ -106,7 +362,344 @@ def test_perform_feature_engineering(perform_feature_engineering, df):
         raise err
 
 
+def test_feature_matrix(perform_feature_engineering, df):
+    '''
+    Test the float32 feature matrix against the feature frames.
+    '''
+    try:
+        frames = perform_feature_engineering(df.copy())
+        matrix = perform_feature_engineering(df.copy(), as_matrix=True)
+        features_train, features_test, target_train, target_test = \
+            matrix.split()
+
+        assert matrix.values.dtype == np.float32
+        assert matrix.values.flags['C_CONTIGUOUS']
+        assert np.shares_memory(features_train.to_numpy(), matrix.values)
+        assert list(features_test.columns) == list(frames[1].columns)
+        assert target_train.equals(frames[2]) and \
+            target_test.equals(frames[3])
+        assert np.allclose(features_test.to_numpy(), frames[1].to_numpy(),
+                           rtol=1e-6, equal_nan=True)
+        validate_matrix(matrix, frames)
+        logging.info("Testing feature matrix: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing feature matrix: The matrix does not " + \
+                        "match the feature frames")
+        raise err
+    except Exception as err:
+        logging.error("Testing feature matrix: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_streaming_training(df):
+    '''
+    Test the out-of-core logistic training, resumed from a checkpoint.
+    '''
+    try:
+        # Raw customer data, without the columns added by the library
+        df = df.drop(columns=[column for column in df.columns
+                              if column.endswith('Churn')])
+        target = (df['Attrition_Flag'] != "Existing Customer").astype(int)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'customers.csv')
+            df.to_csv(path)
+            checkpoint = os.path.join(folder, 'checkpoint.joblib')
+
+            trainer = StreamingLogisticTrainer(
+                chunksize=2000, epochs=1, holdout_fraction=0.2,
+                checkpoint_path=checkpoint).fit(path)
+            assert len(trainer.history_) == 1
+
+            # A second run resumes after the first epoch
+            trainer = StreamingLogisticTrainer(
+                chunksize=2000, epochs=2, holdout_fraction=0.2,
+                checkpoint_path=checkpoint).fit(path)
+            assert [row['epoch'] for row in trainer.history_] == [1, 2]
+            assert trainer.history_[0]['rows'] < 0.9 * len(df)
+
+            # The pipeline takes the frames of engineer_features, with
+            # the feature names the scaler was fitted with
+            features = engineer_features(df, trainer.encoder_)
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', UserWarning)
+                proba = trainer.pipeline_.predict_proba(features)[:, 1]
+            assert binary_metrics(target, proba)['roc_auc'] > 0.8
+
+            # Without any epoch there is no classifier to use
+            untrained = StreamingLogisticTrainer(
+                chunksize=2000, epochs=0, holdout_fraction=0.2).fit(path)
+            try:
+                untrained.pipeline_
+                raise AssertionError("pipeline_ without a classifier")
+            except ValueError:
+                pass
+        logging.info("Testing StreamingLogisticTrainer: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing StreamingLogisticTrainer: Training " + \
+                        "did not resume or the model is not accurate")
+        raise err
+    except Exception as err:
+        logging.error("Testing StreamingLogisticTrainer: An error " + \
+                        "occurred - %s", err)
+        raise err
+
+
+def test_successive_halving(features_train, target_train):
+    '''
+    Test the rungs of SuccessiveHalvingSearch and the trees it grows.
+    '''
+    try:
+        features, target = features_train.head(400), target_train.head(400)
+        grid = {'max_depth': [2, 4, 8, None],
+                'min_samples_leaf': [1, 5],
+                'n_estimators': [9]}
+
+        # 8 candidates, a third of them promoted from 3 to 9 trees
+        TreeCountingForest.grown_trees.clear()
+        search = SuccessiveHalvingSearch(
+            TreeCountingForest(random_state=42), grid, factor=3,
+            cv=3).fit(features, target)
+        rungs = pd.DataFrame(search.cv_results_)
+        assert search.report_['resources'] == [3, 9]
+        assert rungs.groupby('rung')['resources'].agg(['first', 'size']) \
+            .values.tolist() == [[3, 8], [9, 3]]
+        promoted = rungs[rungs['rung'] == 0] \
+            .nlargest(3, 'mean_test_score', keep='first')['params'].tolist()
+        assert rungs[rungs['rung'] == 1]['params'].tolist() == promoted
+
+        # With warm_start a promoted forest only grows its 6 missing
+        # trees in each fold, then the best candidate is refitted
+        assert TreeCountingForest.grown_trees == \
+            [3] * 8 * 3 + [6] * 3 * 3 + [9]
+        assert search.best_params_['n_estimators'] == 9
+        assert len(search.best_estimator_.estimators_) == 9
+
+        # With rows as the budget, each rung doubles the rows
+        search = SuccessiveHalvingSearch(
+            RandomForestClassifier(n_estimators=5, random_state=42),
+            {'max_depth': [2, 4, 8, None]}, resource='n_samples',
+            factor=2, cv=3).fit(features, target)
+        assert search.report_['resources'] == [100, 200, 400]
+        assert [len(rung) for _, rung in pd.DataFrame(
+            search.cv_results_).groupby('rung')] == [4, 2, 1]
+        logging.info("Testing SuccessiveHalvingSearch: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing SuccessiveHalvingSearch: The rungs or " + \
+                        "the grown trees do not follow the schedule")
+        raise err
+    except Exception as err:
+        logging.error("Testing SuccessiveHalvingSearch: An error " + \
+                        "occurred - %s", err)
+        raise err
+
+
+def test_memoized_grid_search(features_train, target_train, tmp_path):
+    '''
+    Test MemoizedGridSearch against GridSearchCV and its cached rerun.
+    '''
+    try:
+        features, target = features_train.head(400), target_train.head(400)
+        grid = {'max_depth': [2, 4, None]}
+        cache = DiskCache(tmp_path / 'fits')
+
+        def search():
+            return MemoizedGridSearch(
+                TreeCountingForest(n_estimators=5, random_state=42), grid,
+                cache, cv=3).fit(features, target)
+
+        TreeCountingForest.grown_trees.clear()
+        first = search()
+        assert first.n_cached_ == 0
+        assert first.best_params_ == GridSearchCV(
+            RandomForestClassifier(n_estimators=5, random_state=42), grid,
+            cv=3).fit(features, target).best_params_
+
+        # The rerun reads every score and the refitted model back
+        grown = len(TreeCountingForest.grown_trees)
+        second = search()
+        assert len(TreeCountingForest.grown_trees) == grown
+        assert second.n_cached_ == 3
+        assert second.best_params_ == first.best_params_
+        assert [list(result['split_test_scores'])
+                for result in second.cv_results_] == \
+            [list(result['split_test_scores'])
+             for result in first.cv_results_]
+        assert (second.best_estimator_.predict(features) ==
+                first.best_estimator_.predict(features)).all()
+
+        # Other data is a cache miss
+        assert MemoizedGridSearch(
+            TreeCountingForest(n_estimators=5, random_state=42), grid,
+            cache, cv=3).fit(features.head(300), target.head(300)) \
+            .n_cached_ == 0
+        logging.info("Testing MemoizedGridSearch: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing MemoizedGridSearch: The search differs " + \
+                        "from GridSearchCV or refitted cached candidates")
+        raise err
+    except Exception as err:
+        logging.error("Testing MemoizedGridSearch: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_disk_cache(tmp_path):
+    '''
+    Test DiskCache entries and the eviction of the least recently used.
+    '''
+    try:
+        value = np.zeros(1000)
+        cache = DiskCache(tmp_path / 'cache')
+        cache.set('a', value)
+        assert 'a' in cache and 'b' not in cache
+        assert (cache.get('a') == value).all()
+        assert cache.get('b', 'missing') == 'missing'
+
+        # Room for two entries. 'b' becomes the least recently used once
+        # 'a' is read, and is evicted by 'c'
+        entry_size = (tmp_path / 'cache' / 'a.joblib').stat().st_size
+        cache = DiskCache(tmp_path / 'lru', max_bytes=int(2.5 * entry_size))
+        for key in ('a', 'b'):
+            cache.set(key, value)
+            os.utime(tmp_path / 'lru' / f"{key}.joblib", (1, 1))
+        cache.get('a')
+        cache.set('c', value)
+        assert [key in cache for key in 'abc'] == [True, False, True]
+
+        # The entry just written is kept, even alone over the limit
+        cache = DiskCache(tmp_path / 'small', max_bytes=1)
+        cache.set('a', value)
+        cache.set('b', value)
+        assert 'a' not in cache and 'b' in cache
+        logging.info("Testing DiskCache: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing DiskCache: Entries were lost or the " + \
+                        "least recently used were not evicted")
+        raise err
+    except Exception as err:
+        logging.error("Testing DiskCache: An error occurred - %s", err)
+        raise err
+
+
+def test_compute_shap_values(features_train, target_train, tmp_path):
+    '''
+    Test the budgeted, chunked and cached SHAP values of a forest.
+    '''
+    try:
+        forest = RandomForestClassifier(n_estimators=5, max_depth=3,
+                                        random_state=42)
+        forest.fit(features_train, target_train)
+
+        # Row budget, stratified on the target
+        sample = sample_rows(features_train, target_train, max_rows=60)
+        assert len(sample) == 60
+        assert abs(target_train.loc[sample.index].mean() -
+                   target_train.mean()) < 0.05
+
+        # Chunks of 25 rows explained by 2 worker processes, the same
+        # values as a single explainer
+        cache = DiskCache(tmp_path / 'shap')
+        shap_values = compute_shap_values(forest, sample, n_jobs=2,
+                                          chunk_size=25, cache=cache)
+        expected = shap.TreeExplainer(forest).shap_values(sample)
+        assert np.allclose(np.asarray(shap_values), np.asarray(expected))
+
+        # The second call is served from the cache, without building an
+        # explainer in this process
+        churn_explain._EXPLAINER = None
+        cached = compute_shap_values(forest, sample, n_jobs=1, cache=cache)
+        assert churn_explain._EXPLAINER is None
+        assert np.array_equal(np.asarray(cached), np.asarray(shap_values))
+        logging.info("Testing compute_shap_values: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing compute_shap_values: Chunked or cached " + \
+                        "SHAP values differ from the explainer")
+        raise err
+    except Exception as err:
+        logging.error("Testing compute_shap_values: An error occurred - %s",
+                                                                    err)
+        raise err
+
+
+def test_mapped_forest(features_train, features_test, target_train,
+                       tmp_path):
+    '''
+    Test the exported, memory-mapped forest against scikit-learn.
+    '''
+    try:
+        forest = RandomForestClassifier(n_estimators=10, random_state=42)
+        forest.fit(features_train, target_train)
+        export_forest(forest, tmp_path / 'forest')
+        mapped = load_forest(tmp_path / 'forest')
+
+        # Chunks of rows walked through every tree, frames or arrays
+        expected = forest.predict_proba(features_test)
+        assert np.array_equal(
+            mapped.predict_proba(features_test, chunk_size=100), expected)
+        assert np.array_equal(
+            mapped.predict_proba(features_test.to_numpy()), expected)
+        assert (mapped.predict(features_test) ==
+                forest.predict(features_test)).all()
+        logging.info("Testing MappedForest: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing MappedForest: Probabilities differ " + \
+                        "from the scikit-learn forest")
+        raise err
+    except Exception as err:
+        logging.error("Testing MappedForest: An error occurred - %s", err)
+        raise err
+
+
+def test_scoring(df, tmp_path):
+    '''
+    Test scoring a customer file by chunks in worker processes.
+    '''
+    try:
+        # Raw customer data, without the columns added by the library
+        raw = df.drop(columns=[column for column in df.columns
+                               if column.endswith('Churn')])
+        input_path = tmp_path / 'customers.csv'
+        raw.to_csv(input_path)
+
+        encoder = TargetEncoder(CATEGORY_LST).fit(df)
+        features = engineer_features(raw, encoder)
+        forest = RandomForestClassifier(n_estimators=10, random_state=42)
+        forest.fit(features, df['Churn'])
+        joblib.dump(forest, tmp_path / 'model.pkl')
+        joblib.dump(encoder, tmp_path / 'encoder.pkl')
+        export_forest(forest, tmp_path / 'forest')
+        expected = forest.predict_proba(features)[:, 1]
+
+        # Chunks of 300 rows over 2 workers, with the pickled model and
+        # with the exported forest, to CSV and Parquet
+        for model, output in (('model.pkl', 'scores.csv'),
+                              ('forest', 'scores.parquet')):
+            churn_scoring.go(argparse.Namespace(
+                input=str(input_path), output=str(tmp_path / output),
+                model=str(tmp_path / model),
+                encoder=str(tmp_path / 'encoder.pkl'),
+                id_column='CLIENTNUM', chunksize=300, n_jobs=2))
+            scores = pd.read_csv(tmp_path / output) \
+                if output.endswith('.csv') \
+                else pd.read_parquet(tmp_path / output)
+
+            assert scores['CLIENTNUM'].tolist() == raw['CLIENTNUM'].tolist()
+            assert np.allclose(scores['probability'], expected)
+            assert (scores['prediction'] ==
+                    (expected > 0.5).astype(int)).all()
+        logging.info("Testing churn_scoring: SUCCESS")
+    except AssertionError as err:
+        logging.error("Testing churn_scoring: The scores differ from " + \
+                        "the in-memory model")
+        raise err
+    except Exception as err:
+        logging.error("Testing churn_scoring: An error occurred - %s", err)
+        raise err
+
+
 def test_train_models(
+        cls,
         train_models,
         features_train,
         features_test,
@@ -119,9 +712,9 @@ def test_train_models(
         train_models(features_train, features_test,
                         target_train, target_test)
 
-        assert os.path.isfile('./models/rfc_model.pkl')
-        assert os.path.isfile('./models/logistic_model.pkl')
-        assert os.path.isfile('./images/results/roc_curve_result.png')
+        assert os.path.isfile(cls.model_folder / 'rfc_model.pkl')
+        assert os.path.isfile(cls.model_folder / 'logistic_model.pkl')
+        assert os.path.isfile(cls.img_res_folder / 'roc_curve_result.png')
         logging.info("Testing train_models: SUCCESS")
     except AssertionError as err:
         logging.error(
@@ -135,23 +728,92 @@ def test_train_models(
 
 
 if __name__ == "__main__":
-    cls = ChurnLibrarySolution()
+    parser = argparse.ArgumentParser(
+        description="Test the churn library",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Run with the production search space, data and SHAP "
+             "explainer instead of the fast test mode",
+    )
+
+    ARGS = parser.parse_args()
+
+    # Images, models and cache go to a temporary folder, so the committed
+    # ones are left untouched
+    TMP_DIR = tempfile.TemporaryDirectory()
+    FOLDERS = {'img_folder': os.path.join(TMP_DIR.name, 'images'),
+               'model_folder': os.path.join(TMP_DIR.name, 'models'),
+               'cache_folder': os.path.join(TMP_DIR.name, 'cache')}
+    cls = ChurnLibrarySolution(**FOLDERS) if ARGS.full else \
+        ChurnLibrarySolution(**FOLDERS, **TEST_CONFIG)
 
     # Test data import
     test_import(cls.import_data)
+    test_import_cached(cls.import_data)
     DF = cls.import_data("./data/bank_data.csv")
 
     # Test perform_eda
-    test_eda(cls.perform_eda, DF)
+    test_eda(cls, cls.perform_eda, DF)
+
+    # Test EDA statistics
+    test_eda_stats(DF)
 
     # Test encoder_helper
     test_encoder_helper(cls.encoder_helper, DF)
 
+    # Test TargetEncoder
+    test_target_encoder(DF)
+
+    # Test StageProfiler
+    test_stage_profiler(Path(TMP_DIR.name))
+
+    # Test StageRunner
+    test_stage_runner()
+
+    # Test FigureRenderer
+    test_figure_renderer()
+
+    # Test synthetic data
+    test_synthetic_data(DF)
+
     # Test perform_feature_engineering
     training_split = cls.perform_feature_engineering(DF)
 
     test_perform_feature_engineering(cls.perform_feature_engineering,
                                         DF)
 
+    # Test the feature matrix
+    test_feature_matrix(cls.perform_feature_engineering, DF)
+
+    # Test streaming training
+    test_streaming_training(DF)
+
+    # Test SuccessiveHalvingSearch
+    test_successive_halving(training_split[0], training_split[2])
+
+    # Test MemoizedGridSearch
+    test_memoized_grid_search(training_split[0], training_split[2],
+                              Path(TMP_DIR.name) / 'test_search')
+
+    # Test DiskCache
+    test_disk_cache(Path(TMP_DIR.name) / 'test_cache')
+
+    # Test compute_shap_values
+    test_compute_shap_values(training_split[0], training_split[2],
+                             Path(TMP_DIR.name) / 'test_shap')
+
+    # Test MappedForest
+    test_mapped_forest(training_split[0], training_split[1],
+                       training_split[2], Path(TMP_DIR.name) / 'test_forest')
+
+    # Test churn_scoring
+    test_scoring(DF, Path(TMP_DIR.name))
+
     # Test train_models
-    test_train_models(cls.train_models,*training_split)
+    test_train_models(cls, cls.train_models, *training_split)
+
+    TMP_DIR.cleanup()
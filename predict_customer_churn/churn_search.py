@@ -0,0 +1,310 @@
+"""
+Hyperparameter searches used by the churn library as cheaper
+alternatives to an exhaustive GridSearchCV: a successive-halving search
+and a grid search memoized on disk.
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import math
+import time
+
+import numpy as np
+
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.model_selection import cross_val_score
+
+from churn_cache import fingerprint
+
+
+def _take_rows(data, indices):
+    """
+    Selects rows from a pandas object or a NumPy array.
+
+    Input:
+        - data: Pandas dataframe/series or NumPy array
+        - indices: Integer positions of the rows to keep
+    Output:
+        - Rows of data at the given positions
+    """
+    if hasattr(data, 'iloc'):
+        return data.iloc[indices]
+    return data[indices]
+
+
+class SuccessiveHalvingSearch:
+    """
+    Successive halving over a parameter grid.
+
+    Every candidate is cross-validated with a small budget, the best
+    1/factor of them are kept and the budget is multiplied by factor,
+    until the remaining candidates are evaluated with the full budget.
+
+    The budget can be the number of trees (resource='n_estimators') or
+    the number of training rows (resource='n_samples'). With trees as
+    the budget, the forests of each fold are fitted with warm_start, so
+    promoting a candidate only grows the trees it is missing instead of
+    refitting the forest from scratch.
+
+    The fitted object exposes the same attributes that the library
+    reads from GridSearchCV: best_params_, best_score_ and
+    best_estimator_ (refitted on the whole training set).
+    """
+
+    def __init__(self,
+                 estimator,
+                 param_grid,
+                 resource='n_estimators',
+                 factor=3,
+                 min_resources=None,
+                 max_resources=None,
+                 cv=5,
+                 random_state=42):
+        """
+        Input:
+            - estimator: Scikit-learn estimator to tune
+            - param_grid: Dictionary of parameter lists, as for
+              GridSearchCV
+            - resource: 'n_estimators' or 'n_samples'
+            - factor: Fraction of candidates dropped and budget growth
+              between two rungs
+            - min_resources: Budget of the first rung. Derived from
+              max_resources and the number of rungs when None.
+            - max_resources: Budget of the last rung. Defaults to the
+              largest n_estimators of the grid, or to all the rows.
+            - cv: Number of folds or scikit-learn splitter
+            - random_state: Seed used to subsample rows
+        """
+        if resource not in ('n_estimators', 'n_samples'):
+            raise ValueError(f"Unknown resource: {resource}")
+
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.resource = resource
+        self.factor = factor
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+        self.cv = cv
+        self.random_state = random_state
+
+    def _schedule(self, n_candidates, n_samples):
+        """
+        Computes the budget of each rung.
+
+        Input:
+            - n_candidates: Number of candidates of the first rung
+            - n_samples: Number of training rows
+        Output:
+            - resources: List with the budget of each rung
+        """
+        max_resources = self.max_resources
+        if max_resources is None:
+            if self.resource == 'n_estimators':
+                max_resources = max(self.param_grid.get(
+                    'n_estimators', [self.estimator.n_estimators]))
+            else:
+                max_resources = n_samples
+
+        n_rungs = 1 + int(math.floor(math.log(n_candidates, self.factor)))
+        min_resources = self.min_resources
+        if min_resources is None:
+            min_resources = max(
+                1, max_resources // self.factor ** (n_rungs - 1))
+
+        resources = []
+        budget = min_resources
+        for _ in range(n_rungs - 1):
+            resources.append(int(min(budget, max_resources)))
+            budget *= self.factor
+        resources.append(int(max_resources))
+        return resources
+
+    def fit(self, features, target):
+        """
+        Runs the search and refits the best candidate.
+
+        Input:
+            - features: Features training data
+            - target: Target training data
+        Output:
+            - self
+        """
+        start = time.perf_counter()
+
+        # With trees as the budget, n_estimators is not searched over
+        grid = dict(self.param_grid)
+        grid_estimators = grid.get('n_estimators',
+                                   [self.estimator.n_estimators])
+        if self.resource == 'n_estimators':
+            grid.pop('n_estimators', None)
+        candidates = list(ParameterGrid(grid))
+
+        folds = list(check_cv(self.cv, target, classifier=True)
+                     .split(features, target))
+        resources = self._schedule(len(candidates), len(target))
+        rng = np.random.RandomState(self.random_state)
+
+        # Forests of the surviving candidates, one per fold
+        forests = {}
+        # Seconds per unit of budget and per fold of each candidate
+        unit_costs = {}
+        self.cv_results_ = []
+
+        alive = list(range(len(candidates)))
+        for rung, budget in enumerate(resources):
+            scores = {}
+            for idx in alive:
+                fold_scores = []
+                elapsed = 0.0
+                for fold, (train_idx, val_idx) in enumerate(folds):
+                    tic = time.perf_counter()
+                    if self.resource == 'n_estimators':
+                        model = forests.get((idx, fold))
+                        if model is None:
+                            model = clone(self.estimator).set_params(
+                                warm_start=True, **candidates[idx])
+                            forests[(idx, fold)] = model
+                        added = budget - len(getattr(model,
+                                                     'estimators_', []))
+                        model.set_params(n_estimators=budget)
+                        model.fit(_take_rows(features, train_idx),
+                                  _take_rows(target, train_idx))
+                    else:
+                        added = min(budget, len(train_idx))
+                        rows = rng.permutation(train_idx)[:added]
+                        model = clone(self.estimator).set_params(
+                            **candidates[idx])
+                        model.fit(_take_rows(features, rows),
+                                  _take_rows(target, rows))
+                    elapsed += (time.perf_counter() - tic) / max(added, 1)
+                    fold_scores.append(model.score(
+                        _take_rows(features, val_idx),
+                        _take_rows(target, val_idx)))
+
+                scores[idx] = float(np.mean(fold_scores))
+                unit_costs[idx] = elapsed / len(folds)
+                self.cv_results_.append({'rung': rung,
+                                         'resources': budget,
+                                         'params': candidates[idx],
+                                         'mean_test_score': scores[idx]})
+
+            # Keep the best 1/factor candidates for the next rung
+            if rung < len(resources) - 1:
+                n_keep = max(1, int(math.ceil(len(alive) / self.factor)))
+                ranked = sorted(alive, key=lambda i: -scores[i])
+                for idx in ranked[n_keep:]:
+                    for fold in range(len(folds)):
+                        forests.pop((idx, fold), None)
+                alive = ranked[:n_keep]
+
+        best = max(alive, key=lambda i: scores[i])
+        forests.clear()
+
+        self.best_params_ = dict(candidates[best])
+        if self.resource == 'n_estimators':
+            self.best_params_['n_estimators'] = resources[-1]
+        self.best_score_ = scores[best]
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        self.best_estimator_.fit(features, target)
+
+        # Extrapolate the cost of fitting every fold of the full grid
+        # from the per-tree (or per-row) cost measured for each candidate
+        n_rows = len(folds[0][0])
+        full_grid = 0.0
+        for idx in range(len(candidates)):
+            if self.resource == 'n_estimators':
+                full_grid += unit_costs[idx] * sum(grid_estimators)
+            else:
+                full_grid += unit_costs[idx] * n_rows
+        full_grid *= len(folds)
+
+        # Both searches end with the same refit of the best candidate
+        if self.resource == 'n_estimators':
+            full_grid += unit_costs[best] * resources[-1]
+        else:
+            full_grid += unit_costs[best] * len(target)
+
+        elapsed = time.perf_counter() - start
+        self.report_ = {'resource': self.resource,
+                        'resources': resources,
+                        'n_candidates': len(candidates),
+                        'elapsed_seconds': elapsed,
+                        'estimated_full_grid_seconds': full_grid,
+                        'estimated_savings_seconds': full_grid - elapsed}
+        return self
+
+
+class MemoizedGridSearch:
+    """
+    Exhaustive grid search whose fold scores and refitted best
+    estimator are memoized in a DiskCache.
+
+    The scores of each candidate are keyed by a fingerprint of the
+    training matrix, the target, the full estimator parameters and the
+    cross-validation splitter (including its seed), so a rerun on the
+    same data only fits the candidates that were never scored before.
+    Candidates are ranked like GridSearchCV does, so both searches pick
+    the same best parameters.
+    """
+
+    def __init__(self, estimator, param_grid, cache, cv=5):
+        """
+        Input:
+            - estimator: Scikit-learn estimator to tune
+            - param_grid: Dictionary of parameter lists
+            - cache: DiskCache used to store scores and estimators
+            - cv: Number of folds or scikit-learn splitter
+        """
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cache = cache
+        self.cv = cv
+
+    def fit(self, features, target):
+        """
+        Scores every candidate, reusing cached fold scores, and refits
+        (or reloads) the best candidate.
+
+        Input:
+            - features: Features training data
+            - target: Target training data
+        Output:
+            - self
+        """
+        splitter = check_cv(self.cv, target, classifier=True)
+        data_key = fingerprint(features, target, repr(splitter))
+
+        self.cv_results_ = []
+        self.n_cached_ = 0
+        for params in ParameterGrid(self.param_grid):
+            model = clone(self.estimator).set_params(**params)
+            key = fingerprint(data_key, 'scores', model.get_params())
+
+            scores = self.cache.get(key)
+            if scores is None:
+                scores = cross_val_score(model, features, target,
+                                         cv=splitter)
+                self.cache.set(key, scores)
+            else:
+                self.n_cached_ += 1
+
+            self.cv_results_.append({'params': params,
+                                     'split_test_scores': scores,
+                                     'mean_test_score': scores.mean()})
+
+        # First candidate with the highest mean score, as GridSearchCV
+        best = max(self.cv_results_, key=lambda r: r['mean_test_score'])
+        self.best_params_ = best['params']
+        self.best_score_ = best['mean_test_score']
+
+        model = clone(self.estimator).set_params(**self.best_params_)
+        key = fingerprint(data_key, 'refit', model.get_params())
+        self.best_estimator_ = self.cache.get(key)
+        if self.best_estimator_ is None:
+            self.best_estimator_ = model.fit(features, target)
+            self.cache.set(key, self.best_estimator_)
+
+        return self
@@ -0,0 +1,378 @@
+"""
+Out-of-core training of the churn logistic model.
+
+StreamingLogisticTrainer never holds the training data in memory. It
+reads the customer file in chunks and learns, pass after pass:
+
+1. the target encoding of the category columns (TargetEncoder
+   partial_fit),
+2. the mean and variance of every feature (StandardScaler
+   partial_fit),
+3. a logistic regression by averaged stochastic gradient descent
+   (SGDClassifier partial_fit), for several epochs. Averaging the
+   iterates keeps the early, large steps from throwing the weights
+   off on small files.
+
+A fixed fraction of the customers, chosen by a hash of their id, is
+held out of every pass. After each epoch the model is scored on these
+customers, training stops once the held-out log loss no longer
+improves, and the best model is kept. The state is checkpointed after
+every pass, so an interrupted run resumes where it stopped.
+
+The result is a scikit-learn pipeline (scaler and classifier) taking
+the FEATURE_COLS frames of engineer_features, and its target encoder,
+so both can be used by churn_scoring.py.
+
+Usage:
+    python churn_stream.py --input ./data/bank_data.csv \
+                           --chunksize 100000 --epochs 10
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import os
+import copy
+import argparse
+import logging
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import joblib
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import log_loss
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from churn_cache import fingerprint
+from churn_eda import add_churn
+from churn_library import CATEGORY_LST, FEATURE_COLS, TargetEncoder
+from churn_matrix import feature_values
+from churn_metrics import binary_metrics
+from churn_scoring import read_chunks
+
+logger = logging.getLogger()
+
+# Resolution of the hash deciding which customers are held out
+HOLDOUT_BUCKETS = 10000
+
+# Logistic loss of SGDClassifier, named 'log' before scikit-learn 1.1
+LOGISTIC_LOSS = 'log_loss' if 'log_loss' in SGDClassifier.loss_functions \
+    else 'log'
+
+
+def feature_frame(values):
+    """
+    FEATURE_COLS frame of the values of feature_values, without a copy.
+
+    The scaler is fitted and applied on these frames, so that the
+    pipeline takes the frames of engineer_features, with their feature
+    names.
+    """
+    return pd.DataFrame(values, columns=FEATURE_COLS, copy=False)
+
+
+class StreamingLogisticTrainer:
+    """
+    Trains the target encoder, the feature scaler and a logistic
+    regression over chunks of a customer file.
+    """
+
+    def __init__(self,
+                 chunksize=100000,
+                 epochs=10,
+                 holdout_fraction=0.05,
+                 patience=2,
+                 tol=1e-4,
+                 alpha=1e-4,
+                 id_column='CLIENTNUM',
+                 checkpoint_path=None,
+                 random_state=42):
+        """
+        Input:
+            - chunksize: Number of rows read at once
+            - epochs: Maximum number of passes of gradient descent
+            - holdout_fraction: Fraction of the customers held out to
+              stop the training, kept in memory as float32 features
+            - patience: Number of epochs without an improvement of the
+              held-out log loss larger than tol before stopping
+            - tol: Smallest improvement of the held-out log loss
+            - alpha: L2 regularization of the classifier
+            - id_column: Column identifying the customers, hashed to
+              choose the held-out ones (the index if missing)
+            - checkpoint_path: Optional path where the state is saved
+              after every pass and resumed from
+            - random_state: Seed of the classifier and of the shuffling
+              of each chunk
+        """
+        self.chunksize = chunksize
+        self.epochs = epochs
+        self.holdout_fraction = holdout_fraction
+        self.patience = patience
+        self.tol = tol
+        self.alpha = alpha
+        self.id_column = id_column
+        self.checkpoint_path = checkpoint_path
+        self.random_state = random_state
+
+        # Training state, saved in the checkpoints
+        self.state_ = None
+
+    def _params(self):
+        return {'chunksize': self.chunksize,
+                'holdout_fraction': self.holdout_fraction,
+                'alpha': self.alpha,
+                'id_column': self.id_column,
+                'random_state': self.random_state}
+
+    def _chunks(self, path):
+        """
+        Yields the chunks of path with their 'Churn' column and the mask
+        of their held-out rows.
+        """
+        for chunk in read_chunks(path, self.chunksize):
+            add_churn(chunk)
+            ids = chunk[self.id_column] if self.id_column in chunk \
+                else chunk.index
+            buckets = pd.util.hash_array(np.asarray(ids)) % HOLDOUT_BUCKETS
+            yield chunk, buckets < self.holdout_fraction * HOLDOUT_BUCKETS
+
+    def _checkpoint(self):
+        """
+        Saves the state, through a temporary file so that an interrupted
+        save never corrupts the previous checkpoint.
+        """
+        if self.checkpoint_path is None:
+            return
+        path = Path(self.checkpoint_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        joblib.dump(self.state_, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _resume(self, key):
+        """
+        Loads the checkpoint of a run with the same data and parameters.
+        """
+        if self.checkpoint_path is None or \
+                not Path(self.checkpoint_path).exists():
+            return None
+        state = joblib.load(self.checkpoint_path)
+        return state if state['key'] == key else None
+
+    def fit(self, path):
+        """
+        Trains on the customers of a CSV or Parquet file.
+
+        Input:
+            - path: Path to the customer file
+        Output:
+            - self
+        """
+        stat = os.stat(path)
+        key = fingerprint(str(path), stat.st_size, stat.st_mtime_ns,
+                          self._params())
+        self.state_ = self._resume(key)
+        if self.state_ is None:
+            self.state_ = {'key': key, 'step': 'encoder', 'epoch': 0,
+                           'history': [], 'stale_epochs': 0,
+                           'best_loss': np.inf, 'best_model': None}
+        else:
+            logger.info("Resuming from %s after %s epochs",
+                        self.checkpoint_path, self.state_['epoch'])
+        state = self.state_
+
+        if state['step'] == 'encoder':
+            encoder = TargetEncoder(CATEGORY_LST)
+            for chunk, holdout in self._chunks(path):
+                encoder.partial_fit(chunk[~holdout])
+            state.update(encoder=encoder, step='scaler')
+            self._checkpoint()
+
+        if state['step'] == 'scaler':
+            scaler = StandardScaler()
+            holdout_values, holdout_target = [], []
+            for chunk, holdout in self._chunks(path):
+                scaler.partial_fit(feature_frame(feature_values(
+                    chunk, FEATURE_COLS, state['encoder'],
+                    np.flatnonzero(~holdout))))
+                holdout_values.append(feature_values(
+                    chunk, FEATURE_COLS, state['encoder'],
+                    np.flatnonzero(holdout)))
+                holdout_target.append(chunk['Churn'].to_numpy()[holdout])
+            state.update(scaler=scaler,
+                         holdout_values=np.concatenate(holdout_values),
+                         holdout_target=np.concatenate(holdout_target),
+                         model=SGDClassifier(loss=LOGISTIC_LOSS,
+                                             alpha=self.alpha,
+                                             average=True,
+                                             random_state=self.random_state),
+                         step='epochs')
+            self._checkpoint()
+
+        self._train(path)
+        return self
+
+    def _train(self, path):
+        """
+        Runs the epochs of gradient descent, with early stopping on the
+        held-out customers.
+        """
+        state = self.state_
+        scaler, model = state['scaler'], state['model']
+        holdout_values = scaler.transform(
+            feature_frame(state['holdout_values']))
+
+        while state['epoch'] < self.epochs and \
+                state['stale_epochs'] < self.patience:
+            rng = np.random.default_rng([self.random_state,
+                                         state['epoch']])
+            rows = 0
+            for chunk, holdout in self._chunks(path):
+                train_rows = rng.permutation(np.flatnonzero(~holdout))
+                model.partial_fit(
+                    scaler.transform(feature_frame(feature_values(
+                        chunk, FEATURE_COLS, state['encoder'], train_rows))),
+                    chunk['Churn'].to_numpy()[train_rows],
+                    classes=np.array([0, 1]))
+                rows += len(train_rows)
+
+            proba = model.predict_proba(holdout_values)[:, 1]
+            loss = log_loss(state['holdout_target'], proba, labels=[0, 1])
+            roc_auc = binary_metrics(state['holdout_target'],
+                                     proba)['roc_auc']
+            state['epoch'] += 1
+            state['history'].append({'epoch': state['epoch'],
+                                     'rows': rows,
+                                     'holdout_log_loss': loss,
+                                     'holdout_roc_auc': roc_auc})
+            logger.info("Epoch %s: %s rows, held-out log loss %.4f, "
+                        "AUC %.4f", state['epoch'], rows, loss, roc_auc)
+
+            if loss < state['best_loss'] - self.tol:
+                state.update(best_loss=loss, stale_epochs=0,
+                             best_model=copy.deepcopy(model))
+            else:
+                state['stale_epochs'] += 1
+            self._checkpoint()
+
+    @property
+    def encoder_(self):
+        """
+        Target encoder learned on the training customers.
+        """
+        return self.state_['encoder']
+
+    @property
+    def pipeline_(self):
+        """
+        Scaler and best classifier, as a pipeline taking the
+        FEATURE_COLS frames of engineer_features.
+
+        Raises a ValueError when no epoch improved the held-out loss,
+        e.g. with epochs=0.
+        """
+        if self.state_ is None or self.state_['best_model'] is None:
+            raise ValueError("No trained classifier: fit at least one "
+                             "epoch before using the pipeline")
+        return Pipeline([('scaler', self.state_['scaler']),
+                         ('logistic', self.state_['best_model'])])
+
+    @property
+    def history_(self):
+        """
+        Rows, held-out log loss and AUC of each epoch.
+        """
+        return self.state_['history']
+
+    def save(self, model_folder):
+        """
+        Saves the pipeline and the encoder for churn_scoring.py.
+
+        Input:
+            - model_folder: Path to the model folder
+        Output:
+            - model_path, encoder_path: Paths of the saved files
+        """
+        model_folder = Path(model_folder)
+        model_folder.mkdir(parents=True, exist_ok=True)
+        model_path = model_folder / 'logistic_stream_model.pkl'
+        encoder_path = model_folder / 'stream_target_encoder.pkl'
+        joblib.dump(self.pipeline_, model_path)
+        joblib.dump(self.encoder_, encoder_path)
+        return model_path, encoder_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+
+    parser = argparse.ArgumentParser(
+        description="Train the churn logistic model over file chunks",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--input", type=str, help="CSV or Parquet file of customers",
+        required=True
+    )
+
+    parser.add_argument(
+        "--model_folder",
+        type=str,
+        help="Folder of the trained pipeline and encoder",
+        required=False,
+        default="./models",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows read at once",
+        required=False,
+        default=100000,
+    )
+
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        help="Maximum number of passes of gradient descent",
+        required=False,
+        default=10,
+    )
+
+    parser.add_argument(
+        "--holdout_fraction",
+        type=float,
+        help="Fraction of the customers held out for early stopping",
+        required=False,
+        default=0.05,
+    )
+
+    parser.add_argument(
+        "--patience",
+        type=int,
+        help="Epochs without improvement before stopping",
+        required=False,
+        default=2,
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="Checkpoint saved after every pass and resumed from",
+        required=False,
+        default="./cache/stream/checkpoint.joblib",
+    )
+
+    ARGS = parser.parse_args()
+    TRAINER = StreamingLogisticTrainer(
+        chunksize=ARGS.chunksize,
+        epochs=ARGS.epochs,
+        holdout_fraction=ARGS.holdout_fraction,
+        patience=ARGS.patience,
+        checkpoint_path=ARGS.checkpoint).fit(ARGS.input)
+    MODEL_PATH, _ = TRAINER.save(ARGS.model_folder)
+    logger.info("Best held-out log loss %.4f, model saved to %s",
+                TRAINER.state_['best_loss'], MODEL_PATH)
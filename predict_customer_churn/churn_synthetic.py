@@ -0,0 +1,217 @@
+"""
+Synthetic bank customer data, at any row count.
+
+A profile is fitted on the real bank_data.csv, separately for churned
+and existing customers: the churn rate, the real rows and the empirical
+quantile function of each numeric column. Synthetic customers are drawn
+by a smoothed bootstrap: a real row of the sampled class is picked, its
+category levels are kept and each numeric value is moved by a small
+random step in quantile (rank) space before being mapped back. The
+synthetic data thus has the same columns, levels, marginal
+distributions, correlations (including those between categories and
+numeric columns) and churn rate as the real data, without repeating
+its rows. Avg_Open_To_Buy and Avg_Utilization_Ratio are derived from
+Credit_Limit and Total_Revolving_Bal, as in the real data.
+
+Usage:
+    python churn_synthetic.py --rows 1000000 \
+                              --output ./data/bank_data_1000000.csv
+
+Author: Yuri Marca
+Date: November 3rd, 2024
+"""
+
+import argparse
+import logging
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger()
+
+# Columns computed from the others instead of being sampled
+DERIVED_COLS = ['Avg_Open_To_Buy', 'Avg_Utilization_Ratio']
+
+# Number of points of the empirical quantile function of each column
+N_QUANTILES = 1001
+
+
+def _decimals(values, max_decimals=3):
+    """
+    Returns the number of decimals the values are rounded to.
+    """
+    for decimals in range(max_decimals + 1):
+        if np.allclose(np.round(values, decimals), values):
+            return decimals
+    return max_decimals
+
+
+def fit_profile(df, response='Attrition_Flag'):
+    """
+    Learns the distribution sampled by generate_chunks.
+
+    Input:
+        - df: Pandas dataframe of real customer data
+        - response: Column of the customer status
+    Output:
+        - profile: Dictionary describing the data
+    """
+    numeric_cols = [col for col in df.select_dtypes('number').columns
+                    if col not in DERIVED_COLS + ['CLIENTNUM']]
+    category_cols = [col for col in df.columns
+                     if col not in numeric_cols + DERIVED_COLS +
+                     ['CLIENTNUM', response]]
+
+    grid = np.linspace(0, 1, N_QUANTILES)
+    classes = {}
+    for label, group in df.groupby(response):
+        values = group[numeric_cols].to_numpy(dtype=np.float64)
+
+        # Position of each value in the quantile function of its column
+        ranks = group[numeric_cols].rank(method='average').to_numpy()
+        classes[label] = {
+            'share': len(group) / len(df),
+            'quantiles': np.quantile(values, grid, axis=0),
+            'ranks': (ranks - 0.5) / len(group),
+            'categories': group[category_cols].to_numpy(dtype=object),
+        }
+
+    return {'columns': list(df.columns),
+            'response': response,
+            'numeric_cols': numeric_cols,
+            'category_cols': category_cols,
+            'decimals': {col: _decimals(df[col].to_numpy())
+                         for col in numeric_cols + DERIVED_COLS},
+            'client_min': int(df['CLIENTNUM'].min()),
+            'classes': classes}
+
+
+def generate_chunks(profile, n_rows, chunk_size=1000000, bandwidth=0.01,
+                    random_state=42):
+    """
+    Samples synthetic customers from a profile, chunk by chunk.
+
+    Input:
+        - profile: Dictionary returned by fit_profile
+        - n_rows: Total number of customers
+        - chunk_size: Number of customers per chunk
+        - bandwidth: Standard deviation of the steps in rank space
+        - random_state: Seed of the sampling
+    Output:
+        - Iterator of Pandas dataframes with the columns of the real
+          data, indexed from 0 to n_rows - 1
+    """
+    rng = np.random.default_rng(random_state)
+    labels = list(profile['classes'])
+    shares = [profile['classes'][label]['share'] for label in labels]
+    numeric_cols = profile['numeric_cols']
+    category_cols = profile['category_cols']
+    decimals = profile['decimals']
+    grid = np.linspace(0, 1, N_QUANTILES)
+
+    for start in range(0, n_rows, chunk_size):
+        size = min(chunk_size, n_rows - start)
+        status = rng.choice(len(labels), size=size, p=shares)
+
+        numeric = np.empty((size, len(numeric_cols)))
+        categories = np.empty((size, len(category_cols)), dtype=object)
+        for i, label in enumerate(labels):
+            params = profile['classes'][label]
+            rows = np.flatnonzero(status == i)
+            seeds = rng.integers(len(params['ranks']), size=len(rows))
+
+            # Move the ranks of the seed rows and map them back to values
+            ranks = params['ranks'][seeds] + bandwidth * \
+                rng.standard_normal((len(rows), len(numeric_cols)))
+            ranks = np.abs(ranks)
+            ranks = np.where(ranks > 1, 2 - ranks, ranks)
+            for j in range(len(numeric_cols)):
+                numeric[rows, j] = np.interp(ranks[:, j], grid,
+                                             params['quantiles'][:, j])
+            categories[rows] = params['categories'][seeds]
+
+        chunk = {col: categories[:, j] for j, col in enumerate(category_cols)}
+        for j, col in enumerate(numeric_cols):
+            values = np.round(numeric[:, j], decimals[col])
+            chunk[col] = values.astype(np.int64) if decimals[col] == 0 \
+                else values
+
+        # Balances never exceed the credit limit
+        chunk['Total_Revolving_Bal'] = np.minimum(
+            chunk['Total_Revolving_Bal'],
+            np.floor(chunk['Credit_Limit']).astype(np.int64))
+        chunk['Avg_Open_To_Buy'] = np.round(
+            chunk['Credit_Limit'] - chunk['Total_Revolving_Bal'],
+            decimals['Avg_Open_To_Buy'])
+        chunk['Avg_Utilization_Ratio'] = np.round(
+            chunk['Total_Revolving_Bal'] / chunk['Credit_Limit'],
+            decimals['Avg_Utilization_Ratio'])
+
+        chunk[profile['response']] = np.asarray(labels, dtype=object)[status]
+        chunk['CLIENTNUM'] = profile['client_min'] + \
+            np.arange(start, start + size)
+
+        index = pd.RangeIndex(start, start + size)
+        yield pd.DataFrame(chunk, index=index)[profile['columns']]
+
+
+def write_synthetic(path, n_rows, source='./data/bank_data.csv',
+                    chunk_size=1000000, random_state=42):
+    """
+    Writes a synthetic CSV file shaped like source.
+
+    Input:
+        - path: Path to the synthetic CSV file
+        - n_rows: Number of customers
+        - source: Path to the real CSV file the profile is fitted on
+        - chunk_size: Number of customers generated at once
+        - random_state: Seed of the sampling
+    """
+    profile = fit_profile(pd.read_csv(source, index_col=0))
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(f"{path}.tmp")
+    for i, chunk in enumerate(generate_chunks(profile, n_rows, chunk_size,
+                                              random_state=random_state)):
+        chunk.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=i == 0)
+    tmp_path.replace(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic bank customer data",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--rows", type=int, help="Number of customers", required=True
+    )
+
+    parser.add_argument(
+        "--output", type=str, help="Path to the synthetic CSV file",
+        required=True
+    )
+
+    parser.add_argument(
+        "--source",
+        type=str,
+        help="Real CSV file the synthetic data is modelled on",
+        required=False,
+        default="./data/bank_data.csv",
+    )
+
+    parser.add_argument(
+        "--random_state",
+        type=int,
+        help="Seed of the sampling",
+        required=False,
+        default=42,
+    )
+
+    ARGS = parser.parse_args()
+    logger.info("Generating %s customers to %s", ARGS.rows, ARGS.output)
+    write_synthetic(ARGS.output, ARGS.rows, source=ARGS.source,
+                    random_state=ARGS.random_state)
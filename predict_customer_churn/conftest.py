@@ -0,0 +1,114 @@
+"""
+Session-scoped pytest fixtures of churn_script_logging_and_tests.py.
+
+The library runs in its fast test mode (TEST_CONFIG) unless pytest is
+called with --full, and the data is imported, given its 'Churn' column,
+encoded and split only once for the whole session.
+
+Author: Yuri Marca
+Date: November 14th, 2024
+"""
+
+import os
+
+import pytest
+
+from churn_library import ChurnLibrarySolution, CATEGORY_LST, TEST_CONFIG
+from churn_eda import add_churn
+
+
+def pytest_addoption(parser):
+    """
+    Adds the --full option, running the tests on the production setup.
+    """
+    parser.addoption("--full", action="store_true", default=False,
+                     help="Run with the production search space, data "
+                          "and SHAP explainer")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def project_folder():
+    """
+    Runs the tests from the project folder, where the data, images and
+    models folders are.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    previous = os.getcwd()
+    os.chdir(folder)
+    os.makedirs('logs', exist_ok=True)
+    yield folder
+    os.chdir(previous)
+
+
+@pytest.fixture(scope="session")
+def cls(request, project_folder, tmp_path_factory):
+    """
+    Library instance shared by the tests. Its images, models and cache
+    go to temporary folders, so the committed ones are left untouched.
+    """
+    folders = {'img_folder': tmp_path_factory.mktemp('images'),
+               'model_folder': tmp_path_factory.mktemp('models'),
+               'cache_folder': tmp_path_factory.mktemp('cache')}
+    if request.config.getoption("--full"):
+        return ChurnLibrarySolution(**folders)
+    return ChurnLibrarySolution(**folders, **TEST_CONFIG)
+
+
+@pytest.fixture(scope="session")
+def import_data(cls):
+    return cls.import_data
+
+
+@pytest.fixture(scope="session")
+def perform_eda(cls):
+    return cls.perform_eda
+
+
+@pytest.fixture(scope="session")
+def encoder_helper(cls):
+    return cls.encoder_helper
+
+
+@pytest.fixture(scope="session")
+def perform_feature_engineering(cls):
+    return cls.perform_feature_engineering
+
+
+@pytest.fixture(scope="session")
+def train_models(cls):
+    return cls.train_models
+
+
+@pytest.fixture(scope="session")
+def df(cls):
+    """
+    Customer data with its 'Churn' column and encoded categories.
+    """
+    data = cls.import_data("./data/bank_data.csv")
+    add_churn(data)
+    return cls.encoder_helper(data, CATEGORY_LST)
+
+
+@pytest.fixture(scope="session")
+def training_split(cls, df):
+    return cls.perform_feature_engineering(df.copy())
+
+
+@pytest.fixture(scope="session")
+def features_train(training_split):
+    return training_split[0]
+
+
+@pytest.fixture(scope="session")
+def features_test(training_split):
+    return training_split[1]
+
+
+@pytest.fixture(scope="session")
+def target_train(training_split):
+    return training_split[2]
+
+
+@pytest.fixture(scope="session")
+def target_test(training_split):
+    return training_split[3]
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Compares the I/O of the intermediate datasets of the pipeline as CSV
+files (the previous format) and as typed Parquet tables.
+
+Both paths replay the reads and writes of the steps on the same
+preprocessed data: preprocess writes the dataset, check_data reads it
+twice (reference and sample), segregate reads it and writes the train
+and test sets, random_forest reads the train set and evaluate the test
+set. The Parquet consumers only load the columns they use.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+from sklearn.model_selection import train_test_split
+
+from pipeline_utils.tables import SCHEMA, read_table, write_table
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def preprocess(path, replicas):
+    """
+    Preprocessed dataset as logged by the preprocess step, repeated
+    replicas times to benchmark larger data.
+    """
+    df = pd.read_parquet(path).drop_duplicates().reset_index(drop=True)
+    df['title'] = df['title'].fillna(value='')
+    df['song_name'] = df['song_name'].fillna(value='')
+    df['text_feature'] = df['title'] + ' ' + df['song_name']
+    return pd.concat([df] * replicas, ignore_index=True)
+
+
+def csv_path(df, splits, folder, columns, stratify):
+    """
+    Reads and writes of the steps with CSV files, as in the previous
+    version of the pipeline.
+    """
+    data = os.path.join(folder, "processed_data.csv")
+    yield "preprocess: write", df.to_csv, (data,), data
+    for role in ("reference", "sample"):
+        yield f"check_data: read {role}", pd.read_csv, (data,), None
+    yield "segregate: read", pd.read_csv, (data,), None
+
+    for split, part in zip(("train", "test"), splits):
+        path = os.path.join(folder, f"data_{split}.csv")
+        yield f"segregate: write {split}", part.to_csv, (path,), path
+    for step, split in (("random_forest", "train"), ("evaluate", "test")):
+        path = os.path.join(folder, f"data_{split}.csv")
+        yield f"{step}: read", pd.read_csv, (path,), None
+
+
+def parquet_path(df, splits, folder, columns, stratify):
+    """
+    Reads and writes of the steps with typed Parquet tables and column
+    projection.
+    """
+    data = os.path.join(folder, "processed_data.parquet")
+    yield "preprocess: write", write_table, (df, data), data
+    for role in ("reference", "sample"):
+        yield f"check_data: read {role}", read_table, (data, list(SCHEMA)), \
+            None
+    yield "segregate: read", read_table, (data,), None
+
+    for split, part in zip(("train", "test"), splits):
+        path = os.path.join(folder, f"data_{split}.parquet")
+        yield f"segregate: write {split}", write_table, (part, path), path
+    path = os.path.join(folder, "data_train.parquet")
+    yield "random_forest: read", read_table, \
+        (path, columns + ["genre", stratify]), None
+    path = os.path.join(folder, "data_test.parquet")
+    yield "evaluate: read", read_table, (path, columns + ["genre"]), None
+
+
+def run_path(name, hops, repeats):
+    """
+    Best time of each read or write, and the size of the written files.
+    """
+    results = {}
+    for hop, function, arguments, written in hops:
+        times = []
+        for _ in range(repeats):
+            tic = time.perf_counter()
+            output = function(*arguments)
+            times.append(time.perf_counter() - tic)
+        results[hop] = {"seconds": min(times)}
+        if written is not None:
+            results[hop]["bytes"] = os.path.getsize(written)
+        else:
+            results[hop]["columns"] = output.shape[1]
+        logger.info(f"{name} {hop}: {min(times):.3f}s")
+    return results
+
+
+def go(args):
+
+    with open(args.config) as fp:
+        model_config = yaml.safe_load(fp)["random_forest_pipeline"]
+    columns = [column for kind in ("numerical", "categorical", "nlp")
+               for column in model_config["features"][kind]]
+
+    df = preprocess(args.input, args.replicas)
+    splits = train_test_split(df, test_size=0.3, random_state=42,
+                              stratify=df[args.stratify])
+    logger.info(f"Benchmarking on {len(df)} rows")
+
+    report = {"rows": len(df), "paths": {}}
+    for name, hops in (("csv", csv_path), ("parquet", parquet_path)):
+        with tempfile.TemporaryDirectory() as folder:
+            results = run_path(name, hops(df, splits, folder, columns,
+                                          args.stratify), args.repeats)
+
+            # Test set as the last step sees it
+            read = read_table if name == "parquet" else pd.read_csv
+            test = read(os.path.join(folder, f"data_test.{name}"))
+
+        report["paths"][name] = {
+            "hops": results,
+            "seconds": sum(hop["seconds"] for hop in results.values()),
+            "bytes": sum(hop.get("bytes", 0) for hop in results.values()),
+            # Columns whose type or values did not survive the steps
+            "changed_columns": [
+                column for column in SCHEMA
+                if not test[column].reset_index(drop=True).equals(
+                    splits[1][column].reset_index(drop=True))],
+        }
+
+    csv, parquet = report["paths"]["csv"], report["paths"]["parquet"]
+    report["speedup"] = csv["seconds"] / parquet["seconds"]
+    report["size_ratio"] = csv["bytes"] / parquet["bytes"]
+    logger.info(f"CSV: {csv['seconds']:.2f}s, {csv['bytes'] / 1e6:.1f} MB "
+                f"written, changed columns: {csv['changed_columns']}")
+    logger.info(f"Parquet: {parquet['seconds']:.2f}s, "
+                f"{parquet['bytes'] / 1e6:.1f} MB written, changed columns: "
+                f"{parquet['changed_columns']}")
+    logger.info(f"Parquet is {report['speedup']:.1f}x faster and "
+                f"{report['size_ratio']:.1f}x smaller")
+
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare CSV and Parquet intermediate artifacts",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--input",
+        type=str,
+        help="Raw Parquet file, as logged by the download step",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        help="Number of copies of the preprocessed data to benchmark on",
+        required=False,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        help="Number of runs of each read and write, the best is kept",
+        required=False,
+        default=3,
+    )
+
+    parser.add_argument(
+        "--config",
+        type=str,
+        help="Pipeline configuration holding the features of the model",
+        required=False,
+        default="config.yaml",
+    )
+
+    parser.add_argument(
+        "--stratify",
+        type=str,
+        help="Column used for the stratified split",
+        required=False,
+        default="genre",
+    )
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="JSON report",
+        required=False,
+        default="io_benchmark.json",
+    )
+
+    args = parser.parse_args()
+
+    go(args)
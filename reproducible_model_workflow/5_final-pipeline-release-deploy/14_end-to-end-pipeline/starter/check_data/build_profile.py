@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+import wandb
+
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts
+from pipeline_utils.profile import build_profile, save_profile
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def go(args):
+
+    run = wandb.init(job_type="reference_profile")
+    artifacts = Artifacts.from_env(run)
+
+    logger.info("Downloading the reference artifact")
+    reference_path = artifacts.file(args.reference_artifact)
+
+    # Sorted values (or quantiles) of each numeric column, read one
+    # column at a time
+    logger.info("Profiling the reference dataset")
+    profile = build_profile(reference_path, max_points=args.max_points)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        temp_path = os.path.join(tmp_dir, args.artifact_name)
+        save_profile(profile, temp_path)
+
+        logger.info("Logging artifact")
+        artifacts.log(
+            args.artifact_name,
+            temp_path,
+            artifact_type="reference_profile",
+            description=f"Profile of the numeric columns of {args.reference_artifact}",
+            metadata={
+                "reference_artifact": args.reference_artifact,
+                "max_points": args.max_points,
+            },
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the profile of the reference dataset used by the data tests",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--reference_artifact",
+        type=str,
+        help="Fully-qualified name for the reference dataset artifact",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--artifact_name", type=str, help="Name for the profile artifact", required=True
+    )
+
+    parser.add_argument(
+        "--max_points",
+        type=int,
+        help="Largest number of values kept per column, quantiles are kept beyond it",
+        required=False,
+        default=100000,
+    )
+
+    args = parser.parse_args()
+
+    go(args)
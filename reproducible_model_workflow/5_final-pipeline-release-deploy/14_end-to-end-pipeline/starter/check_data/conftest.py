@@ -1,37 +1,76 @@
+import os
+import sys
+
 import pytest
-import pandas as pd
 import wandb
+import yaml
+
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts
+from pipeline_utils.profile import load_profile
+from pipeline_utils.tables import read_table
+from pipeline_utils.validation import Validator
 
 
 run = wandb.init(job_type="data_tests")
+artifacts = Artifacts.from_env(run)
 
 
 def pytest_addoption(parser):
-    parser.addoption("--reference_artifact", action="store")
+    parser.addoption("--reference_profile", action="store")
     parser.addoption("--sample_artifact", action="store")
     parser.addoption("--ks_alpha", action="store")
+    parser.addoption("--validation_rules", action="store")
 
 
 @pytest.fixture(scope="session")
-def data(request):
-
-    reference_artifact = request.config.option.reference_artifact
-
-    if reference_artifact is None:
-        pytest.fail("--reference_artifact missing on command line")
+def sample_path(request):
 
     sample_artifact = request.config.option.sample_artifact
 
     if sample_artifact is None:
         pytest.fail("--sample_artifact missing on command line")
 
-    local_path = run.use_artifact(reference_artifact).file()
-    sample1 = pd.read_csv(local_path)
+    return artifacts.file(sample_artifact)
+
+
+@pytest.fixture(scope="session")
+def data(request, sample_path):
+
+    reference_profile = request.config.option.reference_profile
+
+    if reference_profile is None:
+        pytest.fail("--reference_profile missing on command line")
+
+    # The reference dataset is only needed through its profile
+    local_path = artifacts.file(reference_profile)
+    profile = load_profile(local_path)
+
+    # Only the profiled columns of the sample are compared
+    sample = read_table(sample_path, columns=list(profile))
+
+    return profile, sample
+
+
+@pytest.fixture(scope="session")
+def validation(request, sample_path):
+
+    validation_rules = request.config.option.validation_rules
+
+    if validation_rules is None:
+        pytest.fail("--validation_rules missing on command line")
+
+    with open(validation_rules) as fp:
+        rules = yaml.safe_load(fp)
+
+    # All the rules are checked in one pass over the whole sample
+    validator = Validator.from_config(rules)
+    report = validator.validate(sample_path, batch_size=rules.get("batch_size", 100000))
 
-    local_path = run.use_artifact(sample_artifact).file()
-    sample2 = pd.read_csv(local_path)
+    run.summary["validation_violations"] = int(report["violations"].sum())
 
-    return sample1, sample2
+    return report
 
 
 @pytest.fixture(scope='session')
@@ -1,95 +1,33 @@
-import scipy.stats
-import pandas as pd
+from pipeline_utils.profile import ks_test
+from pipeline_utils.validation import failures
 
 
-def test_column_presence_and_type(data):
+def test_column_presence_and_type(validation):
 
-    # Disregard the reference dataset
-    _, data = data
+    # Kinds of the required columns, as declared in the validation rules
+    failed = failures(validation, "dtype")
 
-    required_columns = {
-        "time_signature": pd.api.types.is_integer_dtype,
-        "key": pd.api.types.is_integer_dtype,
-        "danceability": pd.api.types.is_float_dtype,
-        "energy": pd.api.types.is_float_dtype,
-        "loudness": pd.api.types.is_float_dtype,
-        "speechiness": pd.api.types.is_float_dtype,
-        "acousticness": pd.api.types.is_float_dtype,
-        "instrumentalness": pd.api.types.is_float_dtype,
-        "liveness": pd.api.types.is_float_dtype,
-        "valence": pd.api.types.is_float_dtype,
-        "tempo": pd.api.types.is_float_dtype,
-        "duration_ms": pd.api.types.is_integer_dtype,  # This is integer, not float as one might expect
-        "text_feature": pd.api.types.is_string_dtype,
-        "genre": pd.api.types.is_string_dtype
-    }
+    assert not failed, "\n".join(failed)
 
-    # Check column presence
-    assert set(data.columns.values).issuperset(set(required_columns.keys()))
 
-    for col_name, format_verification_funct in required_columns.items():
-
-        assert format_verification_funct(data[col_name]), f"Column {col_name} failed test {format_verification_funct}"
-
-
-def test_class_names(data):
-
-    # Disregard the reference dataset
-    _, data = data
+def test_class_names(validation):
 
     # Check that only the known classes are present
-    known_classes = [
-        "Dark Trap",
-        "Underground Rap",
-        "Trap Metal",
-        "Emo",
-        "Rap",
-        "RnB",
-        "Pop",
-        "Hiphop",
-        "techhouse",
-        "techno",
-        "trance",
-        "psytrance",
-        "trap",
-        "dnb",
-        "hardstyle",
-    ]
-
-    assert data["genre"].isin(known_classes).all()
+    failed = failures(validation, "classes")
 
+    assert not failed, "\n".join(failed)
 
-def test_column_ranges(data):
 
-    # Disregard the reference dataset
-    _, data = data
+def test_column_ranges(validation):
 
-    ranges = {
-        "time_signature": (1, 5),
-        "key": (0, 11),
-        "danceability": (0, 1),
-        "energy": (0, 1),
-        "loudness": (-35, 5),
-        "speechiness": (0, 1),
-        "acousticness": (0, 1),
-        "instrumentalness": (0, 1),
-        "liveness": (0, 1),
-        "valence": (0, 1),
-        "tempo": (50, 250),
-        "duration_ms": (20000, 1000000),
-    }
+    failed = failures(validation, "range")
 
-    for col_name, (minimum, maximum) in ranges.items():
-
-        assert data[col_name].dropna().between(minimum, maximum).all(), (
-            f"Column {col_name} failed the test. Should be between {minimum} and {maximum}, "
-            f"instead min={data[col_name].min()} and max={data[col_name].max()}"
-        )
+    assert not failed, "\n".join(failed)
 
 
 def test_kolmogorov_smirnov(data, ks_alpha):
 
-    sample1, sample2 = data
+    profile, sample = data
 
     columns = [
         "danceability",
@@ -109,9 +47,12 @@ def test_kolmogorov_smirnov(data, ks_alpha):
     # https://towardsdatascience.com/precision-and-recall-trade-off-and-multiple-hypothesis-testing-family-wise-error-rate-vs-false-71a85057ca2b)
     alpha_prime = 1 - (1 - ks_alpha)**(1 / len(columns))
 
+    # All the tests at once, against the profile of the reference dataset
+    results = ks_test(profile, sample, columns)
+
     for col in columns:
 
-        ts, p_value = scipy.stats.ks_2samp(sample1[col], sample2[col])
+        p_value = results.loc[col, "p_value"]
 
         # NOTE: as always, the p-value should be interpreted as the probability of
         # obtaining a test statistic (TS) equal or more extreme that the one we got
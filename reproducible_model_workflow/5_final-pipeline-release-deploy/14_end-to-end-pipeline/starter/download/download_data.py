@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 import argparse
 import logging
+import os
 import pathlib
+import sys
 import wandb
-import requests
-import tempfile
+
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts
+from pipeline_utils.download import RangedDownload
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -16,37 +21,29 @@ def go(args):
     # Derive the base name of the file from the URL
     basename = pathlib.Path(args.file_url).name.split("?")[0].split("#")[0]
 
-    # Download file, streaming so we can download files larger than
-    # the available memory. We use a named temporary file that gets
-    # destroyed at the end of the context, so we don't leave anything
-    # behind and the file gets removed even in case of errors
-    logger.info(f"Downloading {args.file_url} ...")
-    with tempfile.NamedTemporaryFile(mode='wb+') as fp:
-
-        logger.info("Creating run")
-        with wandb.init(job_type="download_data") as run:
-            # Download the file streaming and write to open temp file
-            with requests.get(args.file_url, stream=True) as r:
-                for chunk in r.iter_content(chunk_size=8192):
-                    fp.write(chunk)
-
-            # Make sure the file has been written to disk before uploading
-            # to W&B
-            fp.flush()
+    logger.info("Creating run")
+    with wandb.init(job_type="download_data") as run:
+        artifacts = Artifacts.from_env(run)
 
-            logger.info("Creating artifact")
-            artifact = wandb.Artifact(
-                name=args.artifact_name,
-                type=args.artifact_type,
-                description=args.artifact_description,
-                metadata={'original_url': args.file_url}
-            )
-            artifact.add_file(fp.name, name=basename)
+        # Download the file in parallel ranges, streaming so we can
+        # download files larger than the available memory. An interrupted
+        # download leaves a partial file that the next run resumes, and
+        # the download is skipped if the artifact store holds the file
+        logger.info(f"Downloading {args.file_url} ...")
+        report = RangedDownload(
+            args.file_url, basename, parts=args.parts, store=artifacts.store
+        ).run(args.checksum)
 
-            logger.info("Logging artifact")
-            run.log_artifact(artifact)
+        logger.info("Logging artifact")
+        artifacts.log(
+            args.artifact_name,
+            basename,
+            artifact_type=args.artifact_type,
+            description=args.artifact_description,
+            metadata={'original_url': args.file_url, 'sha256': report['sha256']},
+        )
 
-            artifact.wait()
+    os.remove(basename)
 
 
 if __name__ == "__main__":
@@ -73,6 +70,22 @@ if __name__ == "__main__":
         required=True,
     )
 
+    parser.add_argument(
+        "--parts",
+        type=int,
+        help="Number of parts of the file downloaded at the same time",
+        required=False,
+        default=8,
+    )
+
+    parser.add_argument(
+        "--checksum",
+        type=str,
+        help="Expected checksum of the file, as <algorithm>:<hex digest>. Use 'null' to skip the check",
+        required=False,
+        default="null",
+    )
+
     args = parser.parse_args()
 
     go(args)
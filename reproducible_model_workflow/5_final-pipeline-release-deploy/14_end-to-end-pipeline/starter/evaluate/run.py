@@ -2,12 +2,18 @@
 import argparse
 import itertools
 import logging
-import pandas as pd
+import os
+import sys
 import wandb
 import mlflow.sklearn
 import matplotlib.pyplot as plt
 from sklearn.metrics import roc_auc_score, plot_confusion_matrix
 
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts
+from pipeline_utils.splits import read_split
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
@@ -15,22 +21,23 @@ logger = logging.getLogger()
 def go(args):
 
     run = wandb.init(job_type="test")
+    artifacts = Artifacts.from_env(run)
+
+    logger.info("Downloading and reading the exported model")
+    model_export_path = artifacts.download(args.model_export)
+
+    pipe = mlflow.sklearn.load_model(model_export_path)
+
+    used_columns = list(itertools.chain.from_iterable([x[2] for x in pipe['preprocessor'].transformers]))
 
+    # Only load the columns used by the model and the target
     logger.info("Downloading and reading test artifact")
-    test_data_path = run.use_artifact(args.test_data).file()
-    df = pd.read_csv(test_data_path, low_memory=False)
+    df = read_split(artifacts, args.test_data, columns=used_columns + ["genre"])
 
     # Extract the target from the features
     logger.info("Extracting target from dataframe")
     X_test = df.copy()
     y_test = X_test.pop("genre")
-
-    logger.info("Downloading and reading the exported model")
-    model_export_path = run.use_artifact(args.model_export).download()
-
-    pipe = mlflow.sklearn.load_model(model_export_path)
-
-    used_columns = list(itertools.chain.from_iterable([x[2] for x in pipe['preprocessor'].transformers]))
     pred_proba = pipe.predict_proba(X_test[used_columns])
 
     logger.info("Scoring")
@@ -1,8 +1,9 @@
-import mlflow
 import os
 import hydra
 from omegaconf import DictConfig, OmegaConf
 
+from pipeline_utils.executor import Step, StepExecutor
+
 
 # This automatically reads in the configuration
 @hydra.main(config_name='config')
@@ -15,6 +16,17 @@ def go(config: DictConfig):
     # You can get the path at the root of the MLflow project with this:
     root_path = hydra.utils.get_original_cwd()
 
+    # Shared store of the artifacts used by the steps, and optionally a
+    # local folder standing in for W&B to run offline
+    store = config["artifacts"]["store"]
+    os.environ["PIPELINE_ARTIFACT_STORE"] = os.path.join(
+        root_path, os.path.expanduser(store)) if store else ""
+    os.environ["PIPELINE_ARTIFACT_STORE_MB"] = str(config["artifacts"]["store_mb"])
+    if config["artifacts"]["local_server"]:
+        os.environ["PIPELINE_ARTIFACT_SERVER"] = os.path.join(
+            root_path, os.path.expanduser(config["artifacts"]["local_server"]))
+        os.environ["WANDB_MODE"] = "offline"
+
     # Check which steps we need to execute
     if isinstance(config["main"]["execute_steps"], str):
         # This was passed on the command line as a comma-separated list of steps
@@ -23,50 +35,158 @@ def go(config: DictConfig):
         assert isinstance(config["main"]["execute_steps"], list)
         steps_to_execute = config["main"]["execute_steps"]
 
+    # Each step declares the artifacts it reads and produces, the executor
+    # runs a step as soon as its inputs are ready
+    steps = []
+
     # Download step
     if "download" in steps_to_execute:
 
-        _ = mlflow.run(
+        steps.append(Step(
+            "download",
             os.path.join(root_path, "download"),
-            "main",
             parameters={
                 "file_url": config["data"]["file_url"],
                 "artifact_name": "raw_data.parquet",
                 "artifact_type": "raw_data",
-                "artifact_description": "Data as downloaded"
+                "artifact_description": "Data as downloaded",
+                "parts": config["data"]["download_parts"],
+                "checksum": config["data"]["file_checksum"] or "null"
             },
-        )
+            outputs=["raw_data.parquet"],
+        ))
 
     if "preprocess" in steps_to_execute:
 
-        ## YOUR CODE HERE: call the preprocess step
-        pass
+        steps.append(Step(
+            "preprocess",
+            os.path.join(root_path, "preprocess"),
+            parameters={
+                "input_artifact": "raw_data.parquet:latest",
+                "artifact_name": "preprocessed_data.parquet",
+                "artifact_type": "preprocessed_data",
+                "artifact_description": "Data with preprocessing applied",
+                "batch_size": config["data"]["preprocess_batch_size"]
+            },
+            inputs=["raw_data.parquet:latest"],
+            outputs=["preprocessed_data.parquet"],
+        ))
 
     if "check_data" in steps_to_execute:
 
-        ## YOUR CODE HERE: call the check_data step
-        pass
+        # The data tests only need the profile of the reference dataset
+        steps.append(Step(
+            "reference_profile",
+            os.path.join(root_path, "check_data"),
+            parameters={
+                "reference_artifact": config["data"]["reference_dataset"],
+                "artifact_name": "reference_profile.npz",
+                "max_points": config["data"]["profile_points"]
+            },
+            inputs=[config["data"]["reference_dataset"]],
+            outputs=["reference_profile.npz"],
+            entry_point="profile",
+        ))
 
-    if "segregate" in steps_to_execute:
+        # Serialize the validation rules of the data tests
+        validation_rules = os.path.abspath("validation_rules.yml")
 
-        ## YOUR CODE HERE: call the segregate step
-        pass
+        with open(validation_rules, "w+") as fp:
+            fp.write(OmegaConf.to_yaml(config["data"]["validation"]))
 
-    if "random_forest" in steps_to_execute:
+        steps.append(Step(
+            "check_data",
+            os.path.join(root_path, "check_data"),
+            parameters={
+                "reference_profile": "reference_profile.npz:latest",
+                "sample_artifact": "preprocessed_data.parquet:latest",
+                "ks_alpha": config["data"]["ks_alpha"],
+                "validation_rules": validation_rules
+            },
+            inputs=["reference_profile.npz:latest",
+                    "preprocessed_data.parquet:latest"],
+        ))
 
-        # Serialize decision tree configuration
-        model_config = os.path.abspath("random_forest_config.yml")
+    # The splits are manifests of row indices into the preprocessed data,
+    # or copies of their rows in table mode
+    split_extension = "parquet" if config["data"]["split_mode"] == "table" else "npz"
 
-        with open(model_config, "w+") as fp:
-            fp.write(OmegaConf.to_yaml(config["random_forest_pipeline"]))
+    if "segregate" in steps_to_execute:
 
-        ## YOUR CODE HERE: call the random_forest step
-        pass
+        steps.append(Step(
+            "segregate",
+            os.path.join(root_path, "segregate"),
+            parameters={
+                "input_artifact": "preprocessed_data.parquet:latest",
+                "artifact_root": "data",
+                "artifact_type": "segregated_data",
+                "test_size": config["data"]["test_size"],
+                "random_state": config["main"]["random_seed"],
+                "stratify": config["data"]["stratify"],
+                "split_mode": config["data"]["split_mode"]
+            },
+            inputs=["preprocessed_data.parquet:latest"],
+            outputs=[f"data_train.{split_extension}", f"data_test.{split_extension}"],
+        ))
+
+    if "random_forest" in steps_to_execute:
+
+        # The default configuration, plus the variants of
+        # random_forest_sweep which are trained at the same time
+        variants = {"": {}}
+        variants.update(config["random_forest_sweep"] or {})
+
+        for variant, overrides in variants.items():
+
+            suffix = f"_{variant}" if variant else ""
+
+            # Serialize decision tree configuration
+            model_config = os.path.abspath(f"random_forest_config{suffix}.yml")
+
+            pipeline_config = OmegaConf.merge(
+                config["random_forest_pipeline"], {"random_forest": overrides}
+            )
+            with open(model_config, "w+") as fp:
+                fp.write(OmegaConf.to_yaml(pipeline_config))
+
+            export_artifact = config["random_forest_pipeline"]["export_artifact"]
+            if export_artifact != "null":
+                export_artifact += suffix
+
+            steps.append(Step(
+                f"random_forest{suffix}",
+                os.path.join(root_path, "random_forest"),
+                parameters={
+                    "train_data": f"data_train.{split_extension}:latest",
+                    "model_config": model_config,
+                    "export_artifact": export_artifact,
+                    "random_seed": config["main"]["random_seed"],
+                    "val_size": config["data"]["val_size"],
+                    "stratify": config["data"]["stratify"]
+                },
+                inputs=[f"data_train.{split_extension}:latest"],
+                outputs=[export_artifact] if export_artifact != "null" else [],
+            ))
 
     if "evaluate" in steps_to_execute:
 
-        ## YOUR CODE HERE: call the evaluate step
-        pass
+        steps.append(Step(
+            "evaluate",
+            os.path.join(root_path, "evaluate"),
+            parameters={
+                "model_export": f"{config['random_forest_pipeline']['export_artifact']}:latest",
+                "test_data": f"data_test.{split_extension}:latest"
+            },
+            inputs=[f"{config['random_forest_pipeline']['export_artifact']}:latest",
+                    f"data_test.{split_extension}:latest"],
+        ))
+
+    executor = StepExecutor(steps, max_workers=config["main"]["max_workers"])
+    try:
+        executor.run()
+    finally:
+        # Per-step timeline, in the Hydra output directory of this run
+        executor.save_timeline("step_timeline.json")
 
 
 if __name__ == "__main__":
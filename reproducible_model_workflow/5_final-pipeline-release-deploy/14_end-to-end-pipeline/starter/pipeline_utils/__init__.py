@@ -0,0 +1,3 @@
+"""
+Utilities shared by main.py and the steps of the pipeline.
+"""
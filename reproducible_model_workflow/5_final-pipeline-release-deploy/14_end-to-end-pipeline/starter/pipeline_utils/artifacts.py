@@ -0,0 +1,522 @@
+"""
+Local, content-addressed layer in front of the artifacts of the steps.
+
+An artifact name and version (e.g. "data_train.parquet:latest") is
+first resolved to the digest of its content, which needs no download.
+The files of each digest are kept once in a shared on-disk store and
+are hardlinked (or copied, across file systems) where the step wants
+them, so an artifact is fetched only the first time any step of any
+run uses it. The store is bounded in size: once it grows past its
+limit, the least recently used artifacts are evicted.
+
+The artifacts are resolved and logged either in W&B, through the run
+of the step, or in a local directory standing in for W&B, so that the
+whole pipeline runs offline.
+
+The steps configure this layer through environment variables, set by
+main.py from the "artifacts" section of config.yaml:
+
+- PIPELINE_ARTIFACT_STORE: folder of the shared store (no store if empty)
+- PIPELINE_ARTIFACT_STORE_MB: size limit of the store in megabytes
+- PIPELINE_ARTIFACT_SERVER: local folder standing in for W&B
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Read-only, so that a step writing to a linked file fails instead of
+# changing the stored copy
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def artifact_key(artifact):
+    """
+    Name of an artifact without its project and version, so that
+    "project/data.csv:latest" matches the output "data.csv".
+    """
+    return artifact.split("/")[-1].split(":")[0]
+
+
+def file_digest(path):
+    """
+    SHA-256 of the content of a file, read in blocks of 1 MB.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def list_files(path, name=None):
+    """
+    Relative name -> path of the files of an artifact, from a single
+    file (named name, or its base name) or from a folder.
+    """
+    if os.path.isfile(path):
+        return {name or os.path.basename(path): path}
+
+    files = {}
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(folder, filename)
+            files[os.path.relpath(full_path, path)] = full_path
+    return files
+
+
+def link_or_copy(source, destination):
+    """
+    Hardlinks source to destination, or copies it when both are not on
+    the same file system.
+
+    The link or copy is made under a temporary name and then renamed
+    over destination. Steps linking the same file at the same time, e.g.
+    the random forest variants of a sweep, then never see it missing or
+    partially copied.
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    tmp_path = f"{destination}.tmp{os.getpid()}-{threading.get_ident()}"
+    if os.path.lexists(tmp_path):
+        # Left over by an interrupted call
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+    if os.path.lexists(tmp_path):
+        # The rename does nothing when destination already was a link
+        # to the same file
+        os.remove(tmp_path)
+
+
+class ArtifactStore:
+    """
+    Files of the artifacts, stored once per content and indexed by the
+    digest of the artifact.
+
+    Layout of the store folder:
+
+    - objects/<sha[:2]>/<sha>: one file per distinct content, read-only
+      unless it was linked from the file of a step
+    - manifests/<key>.json: relative name -> sha of the files of one
+      artifact digest, touched at every use for the LRU eviction
+    - sources/<key>: sha of the file last fetched from a source, e.g. a
+      URL and its ETag
+    - locks/<key>: lock files of the artifacts being computed
+    """
+
+    def __init__(self, root, max_bytes=5 * 1024 ** 3):
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "manifests"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "sources"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "locks"), exist_ok=True)
+
+    def _manifest_path(self, digest):
+        # Digests of W&B and of the local server do not have the same
+        # format, so they are hashed into a safe file name
+        key = hashlib.sha256(digest.encode()).hexdigest()
+        return os.path.join(self.root, "manifests", f"{key}.json")
+
+    def _object_path(self, sha):
+        return os.path.join(self.root, "objects", sha[:2], sha)
+
+    def _write_manifest(self, digest, manifest):
+        path = self._manifest_path(digest)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as fp:
+            json.dump(manifest, fp)
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def lock(self, digest):
+        """
+        Holds an exclusive lock on the digest, waiting for the step
+        holding it to release it. The steps which would compute the
+        same artifact take it, so that one computes and adds it while
+        the others wait and then get it. The lock is released when its
+        process exits, even if it crashes.
+        """
+        key = hashlib.sha256(digest.encode()).hexdigest()
+        with open(os.path.join(self.root, "locks", key), "w") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def get(self, digest, destination):
+        """
+        Links the files of an artifact into the destination folder.
+
+        Returns False, without touching the destination, when the
+        artifact is not in the store.
+        """
+        path = self._manifest_path(digest)
+        try:
+            with open(path) as fp:
+                manifest = json.load(fp)
+        except FileNotFoundError:
+            return False
+
+        try:
+            for name, sha in manifest.items():
+                link_or_copy(self._object_path(sha),
+                             os.path.join(destination, name))
+        except FileNotFoundError:
+            # Evicted by another step in the meantime
+            return False
+
+        # Most recently used
+        os.utime(path)
+        return True
+
+    def put(self, digest, files, link=False):
+        """
+        Adds the files of an artifact, given as relative name -> path,
+        then evicts the least recently used artifacts beyond the size
+        limit. With link, the files are moved in by hardlinks instead of
+        copies: only for files that nothing writes to afterwards. Files
+        outside the store keep their mode, the others become read-only.
+        """
+        manifest = {name: self.add_file(path, link=link)
+                    for name, path in files.items()}
+        self._write_manifest(digest, manifest)
+        self.evict(keep=digest)
+
+    def add_file(self, path, link=False, sha=None):
+        """
+        Adds one file to the objects of the store and returns its sha.
+        Files only stay in the store while an artifact uses them.
+        """
+        sha = sha or file_digest(path)
+        object_path = self._object_path(sha)
+        if not os.path.exists(object_path):
+            # Through a temporary name, so that steps adding the same
+            # file at the same time never see a partial object
+            tmp_path = f"{object_path}.tmp{os.getpid()}"
+            os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+            if link:
+                link_or_copy(path, tmp_path)
+            else:
+                shutil.copyfile(path, tmp_path)
+            if not os.path.samefile(path, tmp_path) or self._owns(path):
+                # Copies, and the files of the temporary folders of the
+                # store. A link to the file of a step keeps its mode
+                os.chmod(tmp_path, READ_ONLY)
+            os.replace(tmp_path, object_path)
+        return sha
+
+    def _owns(self, path):
+        root = os.path.realpath(self.root)
+        return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+    def get_file(self, sha, destination):
+        """
+        Links the file of the given sha to destination. Returns False
+        when it is not in the store.
+        """
+        try:
+            link_or_copy(self._object_path(sha), destination)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _source_path(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+        return os.path.join(self.root, "sources", key)
+
+    def remember_source(self, source, sha):
+        """
+        Records that the file fetched from source has the given sha.
+        """
+        with open(self._source_path(source), "w") as fp:
+            fp.write(sha)
+
+    def source_sha(self, source):
+        """
+        Sha of the file last fetched from source, if any.
+        """
+        try:
+            with open(self._source_path(source)) as fp:
+                return fp.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used artifacts, and then their files
+        which no other artifact uses, until the store fits in max_bytes.
+        """
+        keep_path = self._manifest_path(keep) if keep is not None else None
+        manifests = []
+        for entry in os.scandir(os.path.join(self.root, "manifests")):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path) as fp:
+                    shas = set(json.load(fp).values())
+                manifests.append((entry.stat().st_mtime, entry.path, shas))
+            except (FileNotFoundError, ValueError):
+                continue
+        manifests.sort()
+
+        users = {}
+        for _, _, shas in manifests:
+            for sha in shas:
+                users[sha] = users.get(sha, 0) + 1
+        sizes = {}
+        for sha in users:
+            try:
+                sizes[sha] = os.path.getsize(self._object_path(sha))
+            except FileNotFoundError:
+                sizes[sha] = 0
+        total = sum(sizes.values())
+
+        for _, path, shas in manifests:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            os.remove(path)
+            for sha in shas:
+                users[sha] -= 1
+                if users[sha] == 0:
+                    total -= sizes[sha]
+                    try:
+                        os.remove(self._object_path(sha))
+                    except FileNotFoundError:
+                        pass
+            logger.info(f"Evicted {os.path.basename(path)} from the "
+                        "artifact store")
+
+
+class LocalArtifactServer:
+    """
+    Folder standing in for W&B, with the versions and aliases of every
+    artifact:
+
+    - <name>/v<N>/: files of version N
+    - <name>/v<N>.json: digest, type, description, metadata and aliases
+    """
+
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _versions(self, name):
+        folder = os.path.join(self.root, name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(entry[1:-5]) for entry in os.listdir(folder)
+                      if entry.startswith("v") and entry.endswith(".json"))
+
+    def resolve(self, artifact):
+        """
+        Returns the digest and the folder of an artifact given as
+        [project/]name[:version or alias], "latest" by default.
+        """
+        name = artifact_key(artifact)
+        alias = artifact.split(":")[1] if ":" in artifact else "latest"
+        versions = self._versions(name)
+
+        for version in reversed(versions):
+            with open(os.path.join(self.root, name, f"v{version}.json")) as fp:
+                info = json.load(fp)
+            if alias in (f"v{version}", *info["aliases"]):
+                return info["digest"], os.path.join(self.root, name,
+                                                    f"v{version}")
+        raise ValueError(f"Artifact {artifact} not found in {self.root}")
+
+    def log(self, name, files, artifact_type, description, metadata=None,
+            aliases=()):
+        """
+        Adds the files (relative name -> path) as a new version of name,
+        which becomes "latest". Returns the digest of the version.
+        """
+        shas = {rel: file_digest(path) for rel, path in files.items()}
+        digest = hashlib.sha256(
+            json.dumps(shas, sort_keys=True).encode()).hexdigest()
+
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        versions = self._versions(name)
+        version = versions[-1] + 1 if versions else 0
+        while True:
+            # Creating the folder reserves the version number, even with
+            # several steps logging the same artifact
+            folder = os.path.join(self.root, name, f"v{version}")
+            try:
+                os.mkdir(folder)
+                break
+            except FileExistsError:
+                # Reserved by another step, or left without its .json by
+                # a step which failed
+                version += 1
+
+        # Copied, as an upload would, so that the producer can still
+        # change or remove its files
+        for rel, path in files.items():
+            destination = os.path.join(folder, rel)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(path, destination)
+
+        # "latest" moves to this version
+        for previous in self._versions(name):
+            info_path = os.path.join(self.root, name, f"v{previous}.json")
+            with open(info_path) as fp:
+                info = json.load(fp)
+            if "latest" in info["aliases"]:
+                info["aliases"].remove("latest")
+                with open(info_path, "w") as fp:
+                    json.dump(info, fp, indent=2)
+
+        info = {"digest": digest, "type": artifact_type,
+                "description": description, "metadata": metadata or {},
+                "aliases": ["latest", *aliases], "created": time.time()}
+        with open(os.path.join(self.root, name, f"v{version}.json"),
+                  "w") as fp:
+            json.dump(info, fp, indent=2)
+
+        logger.info(f"Logged {name}:v{version} to {self.root}")
+        return digest
+
+
+class Artifacts:
+    """
+    Artifacts of a step, with the same file() and download() calls as
+    W&B, served from the store.
+    """
+
+    def __init__(self, run, store=None, server=None):
+        self.run = run
+        self.store = store
+        self.server = server
+
+    @classmethod
+    def from_env(cls, run):
+        """
+        Artifacts of the run, configured by the PIPELINE_ARTIFACT_*
+        environment variables.
+        """
+        store_root = os.environ.get("PIPELINE_ARTIFACT_STORE",
+                                    "~/.cache/pipeline_artifacts")
+        max_mb = float(os.environ.get("PIPELINE_ARTIFACT_STORE_MB", 5120))
+        server_root = os.environ.get("PIPELINE_ARTIFACT_SERVER", "")
+
+        store = ArtifactStore(store_root, int(max_mb * 1024 ** 2)) \
+            if store_root else None
+        server = LocalArtifactServer(server_root) if server_root else None
+        return cls(run, store, server)
+
+    def resolve(self, artifact):
+        """
+        Returns the version the alias of the artifact ("latest" by
+        default) points to now, as [project/]name:v<N>, which later
+        runs resolve to the same files.
+        """
+        name = artifact.split(":")[0]
+        if self.server is not None:
+            _, folder = self.server.resolve(artifact)
+            version = os.path.basename(folder)
+        else:
+            version = self.run.use_artifact(artifact).version
+        return f"{name}:{version}"
+
+    def download(self, artifact, root=None):
+        """
+        Returns a folder holding the files of the artifact.
+        """
+        tic = time.time()
+        if self.server is not None:
+            digest, folder = self.server.resolve(artifact)
+
+            def fetch(destination):
+                for rel, path in list_files(folder).items():
+                    link_or_copy(path, os.path.join(destination, rel))
+                return destination
+        else:
+            # Also records the artifact as an input of the run
+            wandb_artifact = self.run.use_artifact(artifact)
+            digest = wandb_artifact.digest
+
+            def fetch(destination):
+                return wandb_artifact.download(root=destination)
+
+        if root is None:
+            root = os.path.join("artifacts",
+                                f"{artifact_key(artifact)}-{digest[:12]}")
+
+        if self.store is None:
+            return fetch(root)
+
+        if self.store.get(digest, root):
+            logger.info(f"Artifact {artifact} served from the store in "
+                        f"{time.time() - tic:.2f}s")
+            return root
+
+        with tempfile.TemporaryDirectory(dir=self.store.root) as tmp_dir:
+            self.store.put(digest, list_files(fetch(tmp_dir)), link=True)
+        self.store.get(digest, root)
+        logger.info(f"Artifact {artifact} fetched and stored in "
+                    f"{time.time() - tic:.2f}s")
+        return root
+
+    def file(self, artifact, root=None):
+        """
+        Returns the path of the only file of the artifact.
+        """
+        root = self.download(artifact, root)
+        files = list_files(root)
+        if len(files) != 1:
+            raise ValueError(f"Artifact {artifact} holds {len(files)} files, "
+                             "use download() instead of file()")
+        return next(iter(files.values()))
+
+    def log(self, name, path, artifact_type, description, metadata=None,
+            file_name=None):
+        """
+        Logs a file or a folder as a new version of the artifact name,
+        and adds it to the store so that the next steps do not fetch it.
+        file_name renames a single file, like add_file(path, name=...).
+        """
+        files = list_files(path, file_name)
+
+        if self.server is not None:
+            digest = self.server.log(name, files, artifact_type, description,
+                                     metadata)
+        else:
+            import wandb
+
+            artifact = wandb.Artifact(
+                name=name,
+                type=artifact_type,
+                description=description,
+                metadata=metadata,
+            )
+            if os.path.isfile(path):
+                artifact.add_file(path, name=file_name)
+            else:
+                artifact.add_dir(path)
+            self.run.log_artifact(artifact)
+
+            # The digest is known once the artifact is committed. This
+            # also makes sure it is uploaded before path is removed
+            artifact.wait()
+            digest = artifact.digest
+
+        if self.store is not None:
+            self.store.put(digest, files)
+        return digest
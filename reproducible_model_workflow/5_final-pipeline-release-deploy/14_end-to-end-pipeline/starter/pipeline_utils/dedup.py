@@ -0,0 +1,117 @@
+"""
+Deduplication of rows read in batches.
+
+Every row is reduced to a 128-bit hash of all its values (two 64-bit
+pandas hashes with different keys), and the hashes of the rows already
+seen are kept in a RowHashSet: 16 bytes per distinct row, whatever the
+width of the rows. Two different rows only collide with a probability
+around n^2 / 2^129, negligible for any catalogue.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Keys of the two 64-bit hashes, 16 characters each
+HASH_KEYS = ("0123456789123456", "pipeline-dedup-2")
+
+
+def row_hashes(df):
+    """
+    128-bit hash of every row of df, from all its columns but not the
+    index, as an array of shape (n_rows, 2) of 64-bit halves.
+    """
+    hashes = np.empty((len(df), 2), dtype=np.uint64)
+    for j, key in enumerate(HASH_KEYS):
+        hashes[:, j] = pd.util.hash_pandas_object(df, index=False,
+                                                  hash_key=key).to_numpy()
+    return hashes
+
+
+class RowHashSet:
+    """
+    Set of 128-bit row hashes, kept as a few pairs of arrays ("runs") of
+    the two halves of the hashes, sorted by the first half, which alone
+    is almost always unique.
+
+    New hashes are added as a run of their own, and the last runs are
+    merged while a run is not at least twice as long as the next one, so
+    there are at most log2(n) runs and each hash is merged log2(n) times.
+    Lookups are binary searches in every run.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(first) for first, _ in self.runs)
+
+    @property
+    def nbytes(self):
+        return sum(first.nbytes + second.nbytes
+                   for first, second in self.runs)
+
+    def contains(self, hashes):
+        """
+        Mask of the hashes already in the set.
+        """
+        first = np.ascontiguousarray(hashes[:, 0])
+        second = np.ascontiguousarray(hashes[:, 1])
+        found = np.zeros(len(hashes), dtype=bool)
+        for run_first, run_second in self.runs:
+            positions = np.searchsorted(run_first, first)
+            positions[positions == len(run_first)] = 0
+            same_first = run_first[positions] == first
+            found |= same_first & (run_second[positions] == second)
+
+            # Hashes sharing their first half with another one, which
+            # may be further right in the run
+            for i in np.flatnonzero(same_first & ~found):
+                position = positions[i] + 1
+                while position < len(run_first) and \
+                        run_first[position] == first[i]:
+                    if run_second[position] == second[i]:
+                        found[i] = True
+                        break
+                    position += 1
+        return found
+
+    def add_new(self, hashes):
+        """
+        Adds hashes to the set, and returns the mask of the ones seen for
+        the first time: not in the set and not earlier in hashes.
+        """
+        # Stable sorts, so that the first of equal hashes comes first
+        order = np.argsort(hashes[:, 0], kind="stable")
+        ordered = hashes[order]
+        same = ordered[1:] == ordered[:-1]
+        if (same[:, 0] & ~same[:, 1]).any():
+            # Equal first halves with different second halves: the
+            # duplicates may not be next to each other
+            order = np.lexsort((hashes[:, 1], hashes[:, 0]))
+            ordered = hashes[order]
+            same = ordered[1:] == ordered[:-1]
+        # Looked up in sorted order, which is several times faster
+        new_ordered = np.ones(len(hashes), dtype=bool)
+        new_ordered[1:] = ~same.all(axis=1)
+        new_ordered &= ~self.contains(ordered)
+        new = np.empty(len(hashes), dtype=bool)
+        new[order] = new_ordered
+
+        if new.any():
+            self.runs.append(sorted_run(ordered[new_ordered]))
+            while len(self.runs) > 1 and \
+                    len(self.runs[-2][0]) < 2 * len(self.runs[-1][0]):
+                first, second = self.runs.pop()
+                previous_first, previous_second = self.runs.pop()
+                self.runs.append(sorted_run(np.column_stack([
+                    np.concatenate([previous_first, first]),
+                    np.concatenate([previous_second, second])])))
+        return new
+
+
+def sorted_run(hashes):
+    """
+    Contiguous halves of the hashes, sorted by the first half.
+    """
+    order = np.argsort(hashes[:, 0], kind="stable")
+    return hashes[order, 0], hashes[order, 1]
@@ -0,0 +1,280 @@
+"""
+Download engine of the download step.
+
+The file is split in parts fetched at the same time with HTTP range
+requests, each part written in large blocks at its place in a
+preallocated ".part" file. The bytes received by every part are saved
+next to it, in a ".part.json" file, so that an interrupted download
+resumes where it stopped, as long as the file on the server did not
+change (same size and ETag). Once complete, the file is checked against
+its size and, when given, its checksum.
+
+With an artifact store, the download is skipped when the store already
+holds the expected checksum, or the file last fetched from the same URL
+with the same ETag.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_checksum(checksum):
+    """
+    Algorithm and hex digest of "<algorithm>:<hex>" (SHA-256 if there is
+    no algorithm), or None.
+    """
+    if checksum in (None, "", "null"):
+        return None
+    algorithm, _, value = checksum.rpartition(":")
+    return (algorithm or "sha256").lower(), value.lower()
+
+
+def file_hashes(path, algorithms, block_size=1 << 20):
+    """
+    Hex digests of a file for each algorithm, in one read of the file.
+    """
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(block_size), b""):
+            for sha in hashes.values():
+                sha.update(block)
+    return {algorithm: sha.hexdigest() for algorithm, sha in hashes.items()}
+
+
+class RangedDownload:
+    """
+    Download of url to path, with up to parts parallel range requests.
+    """
+
+    def __init__(self, url, path, parts=8, chunk_size=1 << 20, timeout=60,
+                 store=None):
+        self.url = url
+        self.path = path
+        self.parts = parts
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.store = store
+
+        self.partial_path = f"{path}.part"
+        self.state_path = f"{path}.part.json"
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _head(self):
+        """
+        Size, ETag and range support of the file, after redirects.
+        """
+        response = requests.head(self.url, allow_redirects=True,
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        return {
+            "url": response.url,
+            "size": int(size) if size is not None else None,
+            "etag": response.headers.get("ETag"),
+            "ranges": response.headers.get("Accept-Ranges") == "bytes",
+        }
+
+    def _from_store(self, info, checksum):
+        """
+        Links the file from the store, if it holds the same content.
+        Returns its sha, or None.
+        """
+        if self.store is None:
+            return None
+
+        if checksum is not None and checksum[0] == "sha256":
+            sha = checksum[1]
+        elif info["etag"] is not None:
+            sha = self.store.source_sha(f"{self.url} {info['etag']}")
+        else:
+            sha = None
+
+        if sha is not None and self.store.get_file(sha, self.path):
+            return sha
+        return None
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(self._state, fp)
+        os.replace(tmp_path, self.state_path)
+
+    def _load_state(self, info):
+        """
+        Progress of an interrupted download of the same file, or a new,
+        preallocated partial file.
+        """
+        try:
+            with open(self.state_path) as fp:
+                state = json.load(fp)
+            if state["etag"] == info["etag"] and \
+                    state["size"] == info["size"] and \
+                    os.path.exists(self.partial_path):
+                return state
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        size = info["size"]
+        if info["ranges"] and size:
+            # One part per connection, never smaller than a chunk
+            n_parts = max(1, min(self.parts, size // self.chunk_size))
+            bounds = [size * i // n_parts for i in range(n_parts + 1)]
+            parts = [[start, end - 1, 0] for start, end
+                     in zip(bounds[:-1], bounds[1:]) if end > start]
+        else:
+            parts = None
+
+        with open(self.partial_path, "wb") as fp:
+            if size:
+                fp.truncate(size)
+        return {"etag": info["etag"], "size": size, "parts": parts}
+
+    def _fetch_part(self, index, url, etag):
+        """
+        Fetches the missing bytes of one part. [start, end, received]
+        of the part is updated as blocks are written.
+        """
+        part = self._state["parts"][index]
+        start, end, received = part
+        if start + received > end:
+            return
+
+        headers = {"Range": f"bytes={start + received}-{end}"}
+        if etag is not None:
+            # The server sends the whole file instead if it changed
+            headers["If-Range"] = etag
+
+        with requests.get(url, headers=headers, stream=True,
+                          timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RuntimeError(f"{url} changed or ignored the range "
+                                   "request, restart the download")
+
+            with open(self.partial_path, "r+b",
+                      buffering=4 * self.chunk_size) as fp:
+                fp.seek(start + received)
+                pending = 0
+                try:
+                    for chunk in response.iter_content(self.chunk_size):
+                        fp.write(chunk)
+                        pending += len(chunk)
+                        if pending >= 4 * self.chunk_size:
+                            fp.flush()
+                            self._received(part, pending)
+                            pending = 0
+                finally:
+                    # Bytes are only counted once written to the file, so
+                    # the resume never skips bytes lost in the buffer
+                    fp.flush()
+                    self._received(part, pending)
+
+    def _received(self, part, size):
+        with self._lock:
+            part[2] += size
+            self._save_state()
+
+    def _fetch_whole(self, url):
+        """
+        Fetches the file in one request, when the server does not
+        support ranges.
+        """
+        with requests.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(self.partial_path, "wb",
+                      buffering=4 * self.chunk_size) as fp:
+                for chunk in response.iter_content(self.chunk_size):
+                    fp.write(chunk)
+
+    def run(self, checksum=None):
+        """
+        Downloads the file, unless the store holds it already, and
+        checks it.
+
+        Input:
+            - checksum: Optional "<algorithm>:<hex digest>" of the file
+        Output:
+            - report: Dictionary with the sha256, size, etag and seconds
+              of the download, the bytes received before this run, and
+              whether it came from the store
+        """
+        tic = time.time()
+        checksum = parse_checksum(checksum)
+        info = self._head()
+
+        sha = self._from_store(info, checksum)
+        if sha is not None:
+            logger.info(f"{self.url} is already in the artifact store")
+            return {"sha256": sha, "size": os.path.getsize(self.path),
+                    "etag": info["etag"], "seconds": time.time() - tic,
+                    "resumed_bytes": 0, "from_store": True}
+
+        self._state = self._load_state(info)
+        parts = self._state["parts"]
+        resumed = sum(part[2] for part in parts) if parts else 0
+        if resumed:
+            logger.info(f"Resuming the download of {self.url} after "
+                        f"{resumed} bytes")
+        self._save_state()
+
+        if parts:
+            logger.info(f"Downloading {info['size']} bytes in {len(parts)} "
+                        "parts")
+            with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+                futures = [pool.submit(self._fetch_part, index, info["url"],
+                                       info["etag"])
+                           for index in range(len(parts))]
+                # Raises the first error once all the parts stopped, so
+                # that the progress of the others is saved
+                for future in futures:
+                    future.exception()
+                for future in futures:
+                    future.result()
+        else:
+            logger.info("The server does not support ranges, downloading "
+                        "in one request")
+            self._fetch_whole(info["url"])
+
+        if parts and any(start + received <= end
+                         for start, end, received in parts):
+            raise RuntimeError(f"The download of {self.url} was interrupted, "
+                               "run it again to resume it")
+
+        size = os.path.getsize(self.partial_path)
+        if info["size"] is not None and size != info["size"]:
+            raise RuntimeError(f"Downloaded {size} bytes instead of "
+                               f"{info['size']}")
+
+        algorithms = {"sha256"}
+        if checksum is not None:
+            algorithms.add(checksum[0])
+        hashes = file_hashes(self.partial_path, algorithms)
+        if checksum is not None and hashes[checksum[0]] != checksum[1]:
+            os.remove(self.partial_path)
+            os.remove(self.state_path)
+            raise ValueError(f"Checksum mismatch for {self.url}: expected "
+                             f"{checksum[1]}, got {hashes[checksum[0]]}")
+
+        os.replace(self.partial_path, self.path)
+        os.remove(self.state_path)
+
+        if self.store is not None and info["etag"] is not None:
+            self.store.add_file(self.path, link=True, sha=hashes["sha256"])
+            self.store.remember_source(f"{self.url} {info['etag']}",
+                                       hashes["sha256"])
+
+        seconds = time.time() - tic
+        logger.info(f"Downloaded {size} bytes in {seconds:.1f}s")
+        return {"sha256": hashes["sha256"], "size": size,
+                "etag": info["etag"], "seconds": seconds,
+                "resumed_bytes": resumed, "from_store": False}
@@ -0,0 +1,211 @@
+"""
+Parallel executor for the steps of the pipeline.
+
+Every step declares the artifacts it reads and the artifacts it
+produces. A step starts as soon as all the selected steps producing its
+inputs are done, so independent steps (e.g. check_data and segregate,
+or several random forest configurations) run at the same time in a
+pool of worker threads, each one waiting on its own MLflow run. The
+conda environments of the steps are created once, before any step
+starts, and then reused by every run.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import mlflow
+
+from pipeline_utils.artifacts import artifact_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class Step:
+    """
+    A step of the pipeline: an MLflow project with its parameters and
+    the artifacts it reads and produces.
+    """
+
+    def __init__(self, name, uri, parameters, inputs=(), outputs=(),
+                 entry_point="main"):
+        self.name = name
+        self.uri = uri
+        self.parameters = parameters
+        self.inputs = [artifact_key(artifact) for artifact in inputs]
+        self.outputs = [artifact_key(artifact) for artifact in outputs]
+        self.entry_point = entry_point
+
+
+class StepExecutor:
+    """
+    Runs steps in dependency order, with up to max_workers steps at
+    the same time, and records when each one started and ended.
+    """
+
+    def __init__(self, steps, max_workers=4, use_conda=True):
+        self.steps = {step.name: step for step in steps}
+        self.max_workers = max_workers
+        self.use_conda = use_conda
+        self.timeline = {}
+        self._start = None
+        self._lock = threading.Lock()
+
+        # Step name -> names of the steps producing its inputs. Inputs
+        # that no selected step produces are artifacts of earlier runs
+        producers = {}
+        for step in steps:
+            for output in step.outputs:
+                producers[output] = step.name
+        self.dependencies = {
+            step.name: {producers[artifact] for artifact in step.inputs
+                        if artifact in producers} - {step.name}
+            for step in steps
+        }
+
+    def warm_environments(self):
+        """
+        Creates the conda environment of every step once, one
+        environment at a time, so that the concurrent runs only look
+        them up instead of racing to create the same one.
+        """
+        if not self.use_conda:
+            return
+
+        try:
+            from mlflow.utils.conda import get_or_create_conda_env
+        except ImportError:
+            logger.warning("This MLflow version cannot prepare conda "
+                           "environments ahead of the runs")
+            return
+
+        seen = set()
+        for step in self.steps.values():
+            conda_file = os.path.join(step.uri, "conda.yml")
+            if not os.path.exists(conda_file):
+                continue
+            with open(conda_file, "rb") as fp:
+                digest = hashlib.sha1(fp.read()).hexdigest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+
+            tic = time.time()
+            get_or_create_conda_env(conda_file)
+            logger.info(f"Environment of {step.name} ready in "
+                        f"{time.time() - tic:.1f}s")
+
+    def _run_step(self, name):
+        step = self.steps[name]
+        with self._lock:
+            self.timeline[name] = {"start": time.time() - self._start,
+                                   "status": "running"}
+        logger.info(f"Starting step {name}")
+
+        status = "failed"
+        try:
+            submitted = mlflow.run(
+                step.uri,
+                step.entry_point,
+                parameters=step.parameters,
+                use_conda=self.use_conda,
+            )
+            status = "done"
+        finally:
+            with self._lock:
+                record = self.timeline[name]
+                record["end"] = time.time() - self._start
+                record["seconds"] = record["end"] - record["start"]
+                record["status"] = status
+
+        record["run_id"] = submitted.run_id
+        logger.info(f"Step {name} done in {record['seconds']:.1f}s")
+
+    def run(self):
+        """
+        Runs all the steps. Once a step fails, its dependent steps are
+        skipped while the others still run. Raises a RuntimeError
+        listing the failed steps at the end.
+        """
+        self.warm_environments()
+
+        self._start = time.time()
+        pending = dict(self.dependencies)
+        finished, failed = set(), set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                # Skip the steps depending on a failed step
+                for name, deps in list(pending.items()):
+                    if deps & failed:
+                        logger.error(f"Skipping step {name}: "
+                                     f"{', '.join(sorted(deps & failed))} "
+                                     "failed")
+                        self.timeline[name] = {"status": "skipped"}
+                        failed.add(name)
+                        del pending[name]
+
+                # Start every step whose inputs are ready
+                for name, deps in list(pending.items()):
+                    if deps <= finished:
+                        running[pool.submit(self._run_step, name)] = name
+                        del pending[name]
+
+                if not running:
+                    if pending:
+                        raise RuntimeError(
+                            "Circular dependencies between "
+                            f"{', '.join(sorted(pending))}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is None:
+                        finished.add(name)
+                    else:
+                        logger.error(f"Step {name} failed: "
+                                     f"{future.exception()}")
+                        failed.add(name)
+
+        wall = time.time() - self._start
+        logger.info("Step timeline:\n" + self.report(wall))
+        if failed:
+            raise RuntimeError(f"Failed steps: {', '.join(sorted(failed))}")
+        return self.timeline
+
+    def report(self, wall):
+        """
+        Text timeline of the steps, with the total wall time and the
+        time saved against running the steps one after the other.
+        """
+        # No step at all when execute_steps selects none
+        width = max((len(name) for name in self.steps), default=0)
+        lines = []
+        busy = 0.0
+        records = sorted(self.timeline.items(),
+                         key=lambda item: item[1].get("start", float("inf")))
+        for name, record in records:
+            if "seconds" not in record:
+                lines.append(f"{name:<{width}} {record['status']}")
+                continue
+            busy += record["seconds"]
+
+            # One character per 2% of the wall time
+            offset = int(50 * record["start"] / max(wall, 1e-9))
+            length = max(1, int(50 * record["seconds"] / max(wall, 1e-9)))
+            lines.append(f"{name:<{width}} |{' ' * offset}"
+                         f"{'#' * length:<{50 - offset}}| "
+                         f"{record['start']:7.1f}s +{record['seconds']:.1f}s "
+                         f"{record['status']}")
+        lines.append(f"Wall time {wall:.1f}s for {busy:.1f}s of steps")
+        return "\n".join(lines)
+
+    def save_timeline(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.timeline, fp, indent=2)
@@ -0,0 +1,134 @@
+"""
+Local HTTP server standing in for the data source of the download step.
+
+It serves the files of a folder with the headers the download engine
+relies on (Content-Length, ETag, Accept-Ranges) and answers range
+requests, If-Range included. It can cut every response after a number
+of bytes, to reproduce interrupted downloads.
+
+Usage:
+    python -m pipeline_utils.local_http --folder ./data --port 8000
+"""
+import argparse
+import contextlib
+import hashlib
+import os
+import re
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files with ETags and byte ranges.
+    """
+
+    # Bytes sent at most per response, None for no limit
+    max_bytes = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        key = f"{path} {stat.st_size} {stat.st_mtime_ns}"
+        return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+
+        size = os.path.getsize(path)
+        etag = self._etag(path)
+        start, end = 0, size - 1
+
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)",
+                             self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range == etag):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else size - 1
+            if start >= size or end < start:
+                self.send_error(416, "Range not satisfiable")
+                return None
+            end = min(end, size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+        fp = open(path, "rb")
+        fp.seek(start)
+        self._remaining = end - start + 1
+        return fp
+
+    def copyfile(self, source, outputfile):
+        remaining = self._remaining
+        if self.max_bytes is not None:
+            remaining = min(remaining, self.max_bytes)
+        while remaining > 0:
+            block = source.read(min(remaining, 1 << 16))
+            if not block:
+                break
+            outputfile.write(block)
+            remaining -= len(block)
+        if remaining < self._remaining and self.max_bytes is not None:
+            # Drop the connection like a failing network would
+            self.close_connection = True
+
+
+@contextlib.contextmanager
+def serve(folder, port=0, max_bytes=None):
+    """
+    Serves folder in a background thread, and yields its base URL.
+    """
+    handler = type("Handler", (RangeRequestHandler,),
+                   {"max_bytes": max_bytes})
+    server = ThreadingHTTPServer(("127.0.0.1", port),
+                                 partial(handler, directory=folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a folder with ETags and range requests",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "--folder", type=str, help="Folder to serve", required=True
+    )
+
+    parser.add_argument(
+        "--port", type=int, help="Port to listen on", required=False,
+        default=8000
+    )
+
+    parser.add_argument(
+        "--max_bytes",
+        type=int,
+        help="Cut every response after this number of bytes",
+        required=False,
+        default=None,
+    )
+
+    args = parser.parse_args()
+
+    with serve(args.folder, args.port, args.max_bytes) as url:
+        print(f"Serving {args.folder} at {url}")
+        threading.Event().wait()
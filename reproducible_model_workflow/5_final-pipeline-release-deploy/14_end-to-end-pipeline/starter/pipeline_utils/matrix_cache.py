@@ -0,0 +1,133 @@
+"""
+Cache of the fitted preprocessor of the model and of the matrices it
+produces.
+
+The preprocessing of the training data only depends on the data, on
+the "features" and "tfidf" sections of the model configuration, on
+the train/val split and on the code building and fitting the
+preprocessor (its source and the scikit-learn version), not on the
+hyperparameters of the classifier. The runs of a sweep sharing these
+inputs fit it once: the fitted preprocessor (pickled) and the
+transformed train and val matrices (.npy files, sparse matrices as
+their CSR arrays) are kept in the artifact store under a key made of
+all of them, and the next runs memory-map the matrices instead of
+transforming the data again. The runs started at the same time, like the variants of a sweep, take a
+lock on the key: the first one fits the preprocessor and adds the
+matrices while the others wait for it, then read them from the store.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import scipy.sparse
+import sklearn
+
+
+logger = logging.getLogger(__name__)
+
+# Parts of a CSR matrix saved to disk
+SPARSE_PARTS = ("data", "indices", "indptr")
+
+
+def matrix_key(data_digest, model_config, split, code=()):
+    """
+    Key of the preprocessing of the data of digest data_digest, with the
+    features and tfidf sections of model_config, the train/val split
+    described by the dictionary split and the functions of code, which
+    build and fit the preprocessor. Changing their source or upgrading
+    scikit-learn changes the key, so that a persistent store never
+    serves a preprocessor pickled by other code.
+    """
+    inputs = {
+        "data": data_digest,
+        "features": model_config["features"],
+        "tfidf": model_config["tfidf"],
+        "split": split,
+        "code": [hashlib.sha256(inspect.getsource(function).encode()).hexdigest()
+                 for function in code],
+        "sklearn": sklearn.__version__,
+    }
+    return "matrices-" + hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def save_matrices(folder, preprocessor, matrices):
+    """
+    Saves the preprocessor and the matrices (name -> dense array or
+    sparse matrix) in folder.
+    """
+    with open(os.path.join(folder, "preprocessor.pkl"), "wb") as fp:
+        pickle.dump(preprocessor, fp)
+
+    for name, matrix in matrices.items():
+        if scipy.sparse.issparse(matrix):
+            matrix = scipy.sparse.csr_matrix(matrix)
+            for part in SPARSE_PARTS:
+                np.save(os.path.join(folder, f"{name}.{part}.npy"),
+                        getattr(matrix, part))
+            np.save(os.path.join(folder, f"{name}.shape.npy"),
+                    np.array(matrix.shape))
+        else:
+            np.save(os.path.join(folder, f"{name}.npy"),
+                    np.ascontiguousarray(matrix))
+
+
+def load_matrices(folder, names):
+    """
+    Preprocessor and matrices saved by save_matrices, the arrays being
+    memory-mapped.
+    """
+    with open(os.path.join(folder, "preprocessor.pkl"), "rb") as fp:
+        preprocessor = pickle.load(fp)
+
+    matrices = {}
+    for name in names:
+        path = os.path.join(folder, f"{name}.npy")
+        if os.path.exists(path):
+            matrices[name] = np.load(path, mmap_mode="r")
+            continue
+
+        parts = [np.load(os.path.join(folder, f"{name}.{part}.npy"),
+                         mmap_mode="r") for part in SPARSE_PARTS]
+        shape = tuple(np.load(os.path.join(folder, f"{name}.shape.npy")))
+        matrices[name] = scipy.sparse.csr_matrix(tuple(parts), shape=shape,
+                                                 copy=False)
+    return preprocessor, matrices
+
+
+def cached_preprocessing(store, key, compute, folder):
+    """
+    Fitted preprocessor and matrices of key, from the store or else from
+    compute(), which returns the preprocessor and a dictionary of name ->
+    matrix. The cached files are linked into folder, which must stay
+    while the matrices are used. Without a store, compute() is called.
+    Only one process computes the matrices of a key at a time, the
+    others wait for them.
+    """
+    if store is None:
+        return compute()
+
+    names_path = os.path.join(folder, "names.json")
+    with store.lock(key):
+        if store.get(key, folder):
+            with open(names_path) as fp:
+                names = json.load(fp)
+            logger.info(f"Preprocessed matrices served from the store ({key})")
+            return load_matrices(folder, names)
+
+        preprocessor, matrices = compute()
+
+        with tempfile.TemporaryDirectory(dir=store.root) as tmp_dir:
+            save_matrices(tmp_dir, preprocessor, matrices)
+            with open(os.path.join(tmp_dir, "names.json"), "w") as fp:
+                json.dump(list(matrices), fp)
+            files = {name: os.path.join(tmp_dir, name)
+                     for name in os.listdir(tmp_dir)}
+            store.put(key, files, link=True)
+    logger.info(f"Preprocessed matrices added to the store ({key})")
+    return preprocessor, matrices
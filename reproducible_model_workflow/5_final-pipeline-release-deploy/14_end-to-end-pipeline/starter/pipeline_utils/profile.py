@@ -0,0 +1,98 @@
+"""
+Reference profile of the data tests.
+
+The profile keeps, for every numeric column of the reference dataset,
+its sorted values, or when there are more than max_points of them, as
+many evenly spaced quantiles, and the number of values. It is enough to
+evaluate the empirical distribution function of the reference, so the
+Kolmogorov-Smirnov tests of check_data compare a sample to the profile
+without loading the reference dataset. The distribution function of a
+profile of quantiles is off by at most 1 / max_points.
+"""
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from pipeline_utils.tables import SCHEMA, read_table
+
+
+# Numeric columns of the schema
+NUMERIC_COLUMNS = [column for column, kind in SCHEMA.items()
+                   if kind in ("float64", "int64")]
+
+
+def build_profile(path, columns=NUMERIC_COLUMNS, max_points=100000):
+    """
+    Profile of the columns of a table, read one column at a time so
+    that only one column is ever in memory. Missing values are left out.
+
+    Output:
+        - profile: Dictionary of column -> (sorted values or quantiles,
+          number of values)
+    """
+    profile = {}
+    for column in columns:
+        values = read_table(path, columns=[column])[column]
+        values = np.sort(values.dropna().to_numpy(dtype=np.float64))
+        count = len(values)
+        if count > max_points:
+            values = np.quantile(values, np.linspace(0, 1, max_points))
+        profile[column] = (values, count)
+    return profile
+
+
+def save_profile(profile, path):
+    arrays = {}
+    for column, (values, count) in profile.items():
+        arrays[f"{column}.values"] = values
+        arrays[f"{column}.count"] = np.array(count)
+    with open(path, "wb") as fp:
+        np.savez(fp, **arrays)
+
+
+def load_profile(path):
+    with np.load(path) as arrays:
+        columns = [name[:-len(".values")] for name in arrays.files
+                   if name.endswith(".values")]
+        return {column: (arrays[f"{column}.values"],
+                         int(arrays[f"{column}.count"]))
+                for column in columns}
+
+
+def ks_test(profile, sample, columns):
+    """
+    Two-sample Kolmogorov-Smirnov tests of the columns of the sample
+    against the profile, with the asymptotic p-values of
+    scipy.stats.ks_2samp(method="asymp"). Missing values are left out.
+
+    Output:
+        - results: DataFrame of the statistic, p-value and numbers of
+          values of each column
+    """
+    results = []
+    for column in columns:
+        reference, reference_count = profile[column]
+        values = np.sort(sample[column].dropna().to_numpy(dtype=np.float64))
+
+        # Both distribution functions, at every point where one of them
+        # jumps
+        points = np.concatenate([reference, values])
+        cdf_reference = np.searchsorted(reference, points, side="right") \
+            / len(reference)
+        cdf_sample = np.searchsorted(values, points, side="right") \
+            / len(values)
+
+        results.append({
+            "column": column,
+            "statistic": np.abs(cdf_reference - cdf_sample).max(),
+            "reference_count": reference_count,
+            "sample_count": len(values),
+        })
+
+    results = pd.DataFrame(results).set_index("column")
+    effective = np.round(results["reference_count"] * results["sample_count"]
+                         / (results["reference_count"] +
+                            results["sample_count"]))
+    results["p_value"] = scipy.stats.kstwo.sf(results["statistic"],
+                                              effective)
+    return results
@@ -0,0 +1,94 @@
+"""
+Splits of a dataset as row indices.
+
+Instead of one copy of the dataset per split, a split is a manifest: the
+int32 indices of its rows in the dataset, in the order of the split, and
+how they were drawn (seed, size, stratification column) along with the
+version and SHA-256 of the dataset. The dataset is written once, and
+each consumer reads the columns it needs from the memory-mapped Parquet
+file and gathers the rows of its split, so the rows of the other splits
+are never materialized. A manifest is a few bytes per row, and the same
+seed gives the same indices as train_test_split on the DataFrame.
+"""
+import json
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sklearn.model_selection import train_test_split
+
+from pipeline_utils.artifacts import file_digest
+from pipeline_utils.tables import read_table
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_indices(n_rows, test_size, random_state, stratify=None):
+    """
+    Indices of the rows of the two splits of n_rows rows, the same as
+    the rows of train_test_split(df, ...) with the same arguments.
+    """
+    return train_test_split(
+        np.arange(n_rows, dtype=np.int32),
+        test_size=test_size,
+        random_state=random_state,
+        stratify=stratify,
+    )
+
+
+def save_manifest(path, indices, **metadata):
+    """
+    Writes the indices of a split and its metadata (JSON serializable)
+    to path, as an .npz file.
+    """
+    with open(path, "wb") as fp:
+        np.savez(fp, indices=np.asarray(indices, dtype=np.int32),
+                 metadata=np.array(json.dumps(metadata)))
+
+
+def load_manifest(path):
+    """
+    Indices and metadata of a split manifest.
+    """
+    with np.load(path) as arrays:
+        return arrays["indices"], json.loads(str(arrays["metadata"]))
+
+
+def read_rows(path, indices, columns=None):
+    """
+    Rows of a Parquet table at the given indices, in their order, with
+    only the given columns (all of them by default; like read_table,
+    the ones not in the file are left out and duplicates are read
+    once). The file is memory-mapped and only the selected rows are
+    converted to a DataFrame.
+    """
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in dict.fromkeys(columns)
+                   if column in available]
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    return table.take(pa.array(indices)).to_pandas()
+
+
+def read_split(artifacts, artifact, columns=None):
+    """
+    Rows of a split artifact: a manifest, read through the dataset it
+    points to, or a table holding the rows themselves.
+    """
+    path = artifacts.file(artifact)
+    if not str(path).endswith(".npz"):
+        return read_table(path, columns=columns)
+
+    indices, metadata = load_manifest(path)
+    dataset_path = artifacts.file(metadata["dataset"])
+
+    # The manifest is only valid for the exact dataset it was drawn from
+    if file_digest(dataset_path) != metadata["dataset_sha256"]:
+        raise ValueError(f"{artifact} was drawn from another version of "
+                         f"{metadata['dataset']}, run the split again")
+
+    logger.info(f"Reading {len(indices)} rows of {metadata['dataset']} "
+                f"through {artifact}")
+    return read_rows(dataset_path, indices, columns=columns)
@@ -0,0 +1,143 @@
+"""
+Typed Parquet tables exchanged by the steps of the pipeline.
+
+The steps write their datasets with write_table, which checks them
+against SCHEMA and stores every column with its declared type, and read
+them with read_table, which only loads the columns the step uses. The
+types survive every step and no text is parsed or formatted on the way.
+"""
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger(__name__)
+
+# Columns of the preprocessed dataset and their types. "str" columns are
+# Arrow strings, read back as Python strings
+SCHEMA = {
+    "danceability": "float64",
+    "energy": "float64",
+    "key": "int64",
+    "loudness": "float64",
+    "mode": "int64",
+    "speechiness": "float64",
+    "acousticness": "float64",
+    "instrumentalness": "float64",
+    "liveness": "float64",
+    "valence": "float64",
+    "tempo": "float64",
+    "type": "str",
+    "duration_ms": "int64",
+    "time_signature": "int64",
+    "genre": "str",
+    "song_name": "str",
+    "title": "str",
+    "text_feature": "str",
+}
+
+ARROW_TYPES = {
+    "float64": pa.float64(),
+    "int64": pa.int64(),
+    "str": pa.string(),
+}
+
+
+def arrow_schema(columns, schema=SCHEMA):
+    """
+    Arrow schema of the given columns, all of which must be declared.
+    """
+    missing = [column for column in columns if column not in schema]
+    if missing:
+        raise ValueError(f"Columns {', '.join(missing)} are not in the schema")
+    return pa.schema([(column, ARROW_TYPES[schema[column]])
+                      for column in columns])
+
+
+def to_arrow(df, schema=SCHEMA):
+    """
+    Arrow table of the columns of the schema of df, without the index,
+    with their declared types. Raises a ValueError when a column of the
+    schema is missing or cannot take its declared type.
+    """
+    missing = [column for column in schema if column not in df.columns]
+    if missing:
+        raise ValueError(f"Columns {', '.join(missing)} are missing")
+
+    try:
+        return pa.Table.from_pandas(df[list(schema)],
+                                    schema=arrow_schema(schema, schema),
+                                    preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as err:
+        raise ValueError(f"Data does not match the schema: {err}")
+
+
+def write_table(df, path, schema=SCHEMA):
+    """
+    Writes the columns of the schema of df to a Parquet file, with
+    their declared types (see to_arrow).
+    """
+    pq.write_table(to_arrow(df, schema), path)
+    return path
+
+
+class TableWriter:
+    """
+    Writes a Parquet table batch after batch, each batch becoming one
+    row group, so that the table never has to fit in memory.
+    """
+
+    def __init__(self, path, schema=SCHEMA):
+        self.path = path
+        self.schema = schema
+        self.rows = 0
+        self._writer = pq.ParquetWriter(path, arrow_schema(schema, schema))
+
+    def write(self, df):
+        if len(df) > 0:
+            self._writer.write_table(to_arrow(df, self.schema))
+            self.rows += len(df)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_batches(path, batch_size, columns=None):
+    """
+    Yields the rows of a Parquet file as DataFrames of at most
+    batch_size rows, reading one row group at a time.
+    """
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size,
+                                           columns=columns):
+        yield batch.to_pandas()
+
+
+def read_table(path, columns=None):
+    """
+    Reads the given columns of a Parquet table (all of them by default).
+    Columns not in the file are left out, so that the checks of the
+    consumer report them, and columns given twice are read once.
+
+    CSV files, as logged by earlier versions of the pipeline, are read
+    with the types of the schema.
+    """
+    if str(path).endswith(".csv"):
+        df = pd.read_csv(path, usecols=lambda column: columns is None or
+                         column in columns, low_memory=False)
+        return df.astype({column: SCHEMA[column] for column in df.columns
+                          if column in SCHEMA and SCHEMA[column] != "str"})
+
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in dict.fromkeys(columns)
+                   if column in available]
+    return pd.read_parquet(path, columns=columns)
@@ -0,0 +1,205 @@
+"""
+Declarative validation of the datasets of the pipeline.
+
+The rules come from the configuration: the kind of each required column
+(integer, float or string), the known classes of categorical columns and
+the range of numeric columns. A Validator reads only the columns of the
+rules, one batch of rows at a time, and evaluates every rule on a batch
+with vectorized numpy and pandas operations, so that the whole dataset
+is checked in a single pass and in bounded memory. Every rule reports
+its number of violations and the first offending rows, instead of
+stopping at the first failure.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from pipeline_utils.tables import iter_batches, read_table
+
+
+logger = logging.getLogger(__name__)
+
+# Checks of the kinds of columns
+KINDS = {
+    "integer": pd.api.types.is_integer_dtype,
+    "float": pd.api.types.is_float_dtype,
+    "string": pd.api.types.is_string_dtype,
+}
+
+
+class Validator:
+    """
+    Rules checked on a dataset, batch after batch.
+
+    Input:
+        - dtypes: Dictionary of column -> "integer", "float" or "string"
+        - classes: Dictionary of column -> list of the allowed values
+        - ranges: Dictionary of column -> [minimum, maximum]. Missing
+          values are not violations
+        - max_examples: Number of offending rows kept per rule
+    """
+
+    def __init__(self, dtypes=None, classes=None, ranges=None, max_examples=5):
+        self.dtypes = dict(dtypes or {})
+        self.classes = {column: list(values)
+                        for column, values in (classes or {}).items()}
+        self.ranges = {column: tuple(bounds)
+                       for column, bounds in (ranges or {}).items()}
+        self.max_examples = max_examples
+
+        unknown = [kind for kind in self.dtypes.values() if kind not in KINDS]
+        if unknown:
+            raise ValueError(f"Unknown column kinds {', '.join(unknown)}, "
+                             f"expected one of {', '.join(KINDS)}")
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Validator of the "dtypes", "classes", "ranges" and "max_examples"
+        entries of config.
+        """
+        return cls(config.get("dtypes"), config.get("classes"),
+                   config.get("ranges"), config.get("max_examples", 5))
+
+    @property
+    def columns(self):
+        """
+        Columns read by the rules.
+        """
+        columns = list(self.dtypes)
+        for column in list(self.classes) + list(self.ranges):
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def _rules(self):
+        """
+        Name, kind and column of every rule.
+        """
+        for column in self.dtypes:
+            yield f"dtype:{column}", "dtype", column
+        for column in self.classes:
+            yield f"classes:{column}", "classes", column
+        for column in self.ranges:
+            yield f"range:{column}", "range", column
+
+    def _violations(self, kind, column, batch):
+        """
+        Mask of the rows of batch violating the rule.
+        """
+        if kind == "dtype":
+            # The type is the same for all the rows of a batch
+            valid = KINDS[self.dtypes[column]](batch[column])
+            return np.full(len(batch), not valid)
+
+        if kind == "classes":
+            return ~batch[column].isin(self.classes[column]).to_numpy()
+
+        minimum, maximum = self.ranges[column]
+        # Values which are not numbers are violations too
+        numbers = pd.to_numeric(batch[column], errors="coerce")
+        values = numbers.to_numpy(dtype=np.float64, na_value=np.nan)
+        not_numbers = (numbers.isna() & batch[column].notna()).to_numpy()
+        # NaN compares False on both sides, so missing values pass
+        return (values < minimum) | (values > maximum) | not_numbers
+
+    def describe(self, name):
+        kind, column = name.split(":", 1)
+        if kind == "dtype":
+            return f"{column} is {self.dtypes[column]}"
+        if kind == "classes":
+            return f"{column} is one of the {len(self.classes[column])} known classes"
+        minimum, maximum = self.ranges[column]
+        return f"{column} is between {minimum} and {maximum}"
+
+    def validate_batches(self, batches):
+        """
+        Evaluates every rule on each batch of rows.
+
+        Output:
+            - report: DataFrame indexed by rule, with its column, its
+              description, the number of rows checked and violating it,
+              and the offending rows ("examples", as row number ->
+              value)
+        """
+        report = {name: {"column": column,
+                         "rule": self.describe(name),
+                         "rows": 0,
+                         "violations": 0,
+                         "missing": False,
+                         "examples": {}}
+                  for name, _, column in self._rules()}
+        offset = 0
+
+        for batch in batches:
+            for name, kind, column in self._rules():
+                entry = report[name]
+                if column not in batch.columns:
+                    # Only reported once, as a missing column
+                    entry["missing"] = True
+                    continue
+
+                violations = self._violations(kind, column, batch)
+                entry["rows"] += len(batch)
+                count = int(violations.sum())
+                if count == 0:
+                    continue
+
+                entry["violations"] += count
+                room = self.max_examples - len(entry["examples"])
+                if room > 0:
+                    positions = np.flatnonzero(violations)[:room]
+                    if kind == "dtype":
+                        value = str(batch[column].dtype)
+                        entry["examples"].update(
+                            {offset + int(i): value for i in positions})
+                    else:
+                        values = batch[column].to_numpy()[positions].tolist()
+                        entry["examples"].update(
+                            {offset + int(i): value for i, value
+                             in zip(positions, values)})
+
+            offset += len(batch)
+
+        return pd.DataFrame.from_dict(report, orient="index")
+
+    def validate(self, path, batch_size=100000):
+        """
+        Validates a Parquet (or CSV) table in a single pass over its
+        rows, reading only the columns of the rules.
+        """
+        if str(path).endswith(".csv"):
+            batches = [read_table(path, columns=self.columns)]
+        else:
+            available = set(pq.read_schema(path).names)
+            columns = [column for column in self.columns if column in available]
+            batches = iter_batches(path, batch_size, columns=columns)
+
+        report = self.validate_batches(batches)
+        failed = report[(report["violations"] > 0) | report["missing"]]
+        logger.info(f"Checked {len(report)} rules on {report['rows'].max()} "
+                    f"rows, {len(failed)} failed")
+        for name, entry in failed.iterrows():
+            logger.info(f"{name}: {entry['violations']} violations, "
+                        f"examples {entry['examples']}")
+        return report
+
+
+def failures(report, kind):
+    """
+    Messages of the failed rules of a kind ("dtype", "classes" or
+    "range") of a report, empty if they all passed.
+    """
+    messages = []
+    for name, entry in report.iterrows():
+        if not name.startswith(f"{kind}:"):
+            continue
+        if entry["missing"]:
+            messages.append(f"Column {entry['column']} is missing")
+        elif entry["violations"] > 0:
+            messages.append(
+                f"Rule '{entry['rule']}' failed on {entry['violations']} of "
+                f"{entry['rows']} rows, e.g. rows {entry['examples']}")
+    return messages
@@ -2,10 +2,17 @@
 import argparse
 import logging
 import os
+import sys
 
 import pandas as pd
 import wandb
 
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts
+from pipeline_utils.dedup import RowHashSet, row_hashes
+from pipeline_utils.tables import TableWriter, iter_batches, write_table
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -14,39 +21,65 @@ logger = logging.getLogger()
 def go(args):
 
     run = wandb.init(job_type="process_data")
+    artifacts = Artifacts.from_env(run)
 
     logger.info("Downloading artifact")
-    artifact = run.use_artifact(args.input_artifact)
-    artifact_path = artifact.file()
+    artifact_path = artifacts.file(args.input_artifact)
 
-    df = pd.read_parquet(artifact_path)
+    filename = "processed_data.parquet"
 
-    # Drop the duplicates
-    logger.info("Dropping duplicates")
-    df = df.drop_duplicates().reset_index(drop=True)
+    if args.batch_size > 0:
+        preprocess_batches(artifact_path, filename, args.batch_size)
+    else:
+        df = pd.read_parquet(artifact_path)
 
-    # A minimal feature engineering step: a new feature
-    logger.info("Feature engineering")
-    df['title'].fillna(value='', inplace=True)
-    df['song_name'].fillna(value='', inplace=True)
-    df['text_feature'] = df['title'] + ' ' + df['song_name']
+        # Drop the duplicates
+        logger.info("Dropping duplicates")
+        df = df.drop_duplicates().reset_index(drop=True)
 
-    filename = "processed_data.csv"
-    df.to_csv(filename)
+        logger.info("Feature engineering")
+        df = add_text_feature(df)
 
-    artifact = wandb.Artifact(
-        name=args.artifact_name,
-        type=args.artifact_type,
-        description=args.artifact_description,
-    )
-    artifact.add_file(filename)
+        write_table(df, filename)
 
     logger.info("Logging artifact")
-    run.log_artifact(artifact)
+    artifacts.log(
+        args.artifact_name,
+        filename,
+        artifact_type=args.artifact_type,
+        description=args.artifact_description,
+    )
 
     os.remove(filename)
 
 
+def add_text_feature(df):
+
+    # A minimal feature engineering step: a new feature
+    title = df['title'].fillna(value='')
+    song_name = df['song_name'].fillna(value='')
+    return df.assign(title=title, song_name=song_name,
+                     text_feature=title + ' ' + song_name)
+
+
+def preprocess_batches(input_path, output_path, batch_size):
+
+    # Only the hashes of the rows already written are kept in memory, so
+    # the memory is bounded by the number of unique rows, not the data
+    seen = RowHashSet()
+    rows = 0
+
+    logger.info(f"Dropping duplicates and engineering features by batches of {batch_size} rows")
+    with TableWriter(output_path) as writer:
+        for batch in iter_batches(input_path, batch_size):
+            rows += len(batch)
+            batch = batch[seen.add_new(row_hashes(batch))]
+            writer.write(add_text_feature(batch))
+
+    logger.info(f"Kept {writer.rows} unique rows out of {rows}, "
+                f"with a hash set of {seen.nbytes / 1e6:.1f} MB")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Preprocess a dataset",
@@ -75,6 +108,14 @@ if __name__ == "__main__":
         required=True,
     )
 
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of rows preprocessed at a time, streaming the data. Use 0 to load it all at once",
+        required=False,
+        default=100000,
+    )
+
     args = parser.parse_args()
 
     go(args)
@@ -3,24 +3,30 @@ import argparse
 import itertools
 import logging
 import os
+import sys
 
 import yaml
 import tempfile
 import mlflow
-import pandas as pd
 import numpy as np
+import scipy.sparse
 from mlflow.models import infer_signature
 from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics import roc_auc_score, confusion_matrix, ConfusionMatrixDisplay
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import OrdinalEncoder, StandardScaler, FunctionTransformer
 import matplotlib.pyplot as plt
 import wandb
 from sklearn.pipeline import Pipeline, make_pipeline
 from sklearn.impute import SimpleImputer
 
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts, file_digest
+from pipeline_utils.matrix_cache import cached_preprocessing, matrix_key
+from pipeline_utils.splits import read_split, split_indices
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
@@ -28,35 +34,60 @@ logger = logging.getLogger()
 def go(args):
 
     run = wandb.init(job_type="train")
+    artifacts = Artifacts.from_env(run)
+
+    logger.info("Setting up pipeline")
+
+    pipe, used_columns, model_config = get_training_inference_pipeline(args)
 
+    # Only load the columns used by the pipeline, the target and the
+    # stratification column
     logger.info("Downloading and reading train artifact")
-    train_data_path = run.use_artifact(args.train_data).file()
-    df = pd.read_csv(train_data_path, low_memory=False)
+    df = read_split(artifacts, args.train_data, columns=used_columns + ["genre", args.stratify])
 
     # Extract the target from the features
     logger.info("Extracting target from dataframe")
     X = df.copy()
     y = X.pop("genre")
 
+    # Same indices as the train/test split of the segregate step
     logger.info("Splitting train/val")
-    X_train, X_val, y_train, y_val = train_test_split(
-        X,
-        y,
+    train_index, val_index = split_indices(
+        len(df),
         test_size=args.val_size,
         stratify=df[args.stratify] if args.stratify != "null" else None,
         random_state=args.random_seed,
     )
+    X_train, X_val = X.iloc[train_index], X.iloc[val_index]
+    y_train, y_val = y.iloc[train_index], y.iloc[val_index]
+
+    # The preprocessing does not depend on the hyperparameters of the
+    # classifier, so the runs of a sweep on the same data share it
+    key = matrix_key(
+        file_digest(artifacts.file(args.train_data)),
+        model_config,
+        {"val_size": args.val_size, "random_seed": args.random_seed, "stratify": args.stratify},
+        code=[get_training_inference_pipeline, preprocess],
+    )
 
-    logger.info("Setting up pipeline")
+    with tempfile.TemporaryDirectory() as cache_dir:
 
-    pipe, used_columns = get_training_inference_pipeline(args)
+        logger.info("Preprocessing")
+        preprocessor, matrices = cached_preprocessing(
+            artifacts.store,
+            key,
+            lambda: preprocess(pipe["preprocessor"], X_train[used_columns], y_train,
+                               X_val[used_columns]),
+            cache_dir,
+        )
+        pipe.set_params(preprocessor=preprocessor)
 
-    logger.info("Fitting")
-    pipe.fit(X_train[used_columns], y_train)
+        logger.info("Fitting")
+        pipe["classifier"].fit(matrices["train"], y_train)
 
-    # Evaluate
-    pred = pipe.predict(X_val[used_columns])
-    pred_proba = pipe.predict_proba(X_val[used_columns])
+        # Evaluate
+        pred = pipe["classifier"].predict(matrices["val"])
+        pred_proba = pipe["classifier"].predict_proba(matrices["val"])
 
     logger.info("Scoring")
     score = roc_auc_score(y_val, pred_proba, average="macro", multi_class="ovo")
@@ -66,17 +97,16 @@ def go(args):
     # Export if required
     if args.export_artifact != "null":
 
-        export_model(run, pipe, used_columns, X_val, pred, args.export_artifact)
+        export_model(artifacts, pipe, used_columns, X_val, pred, args.export_artifact)
 
     # Some useful plots
     fig_feat_imp = plot_feature_importance(pipe)
 
     fig_cm, sub_cm = plt.subplots(figsize=(10, 10))
-    y_pred = pipe.predict(X_val)
 
     cm = confusion_matrix(
                 y_true=y_val,
-                y_pred=y_pred,
+                y_pred=pred,
                 labels=pipe["classifier"].classes_,
                 normalize="true"
             )
@@ -102,7 +132,22 @@ def go(args):
     )
 
 
-def export_model(run, pipe, used_columns, X_val, val_pred, export_artifact):
+def preprocess(preprocessor, X_train, y_train, X_val):
+
+    # Fit the preprocessor on the train split only, then transform both splits
+    X_train = preprocessor.fit_transform(X_train, y_train)
+    X_val = preprocessor.transform(X_val)
+
+    # The trees work on float32, converting the dense matrices once here
+    # lets them use the cached matrices without a copy
+    matrices = {}
+    for name, matrix in (("train", X_train), ("val", X_val)):
+        matrices[name] = matrix if scipy.sparse.issparse(matrix) else matrix.astype(np.float32)
+
+    return preprocessor, matrices
+
+
+def export_model(artifacts, pipe, used_columns, X_val, val_pred, export_artifact):
 
     # Infer the signature of the model
 
@@ -121,18 +166,14 @@ def export_model(run, pipe, used_columns, X_val, val_pred, export_artifact):
             input_example=X_val.iloc[:2],
         )
 
-        artifact = wandb.Artifact(
+        # This also makes sure the artifact is uploaded before the
+        # temp dir gets deleted
+        artifacts.log(
             export_artifact,
-            type="model_export",
+            export_path,
+            artifact_type="model_export",
             description="Random Forest pipeline export",
         )
-        artifact.add_dir(export_path)
-
-        run.log_artifact(artifact)
-
-        # Make sure the artifact is uploaded before the temp dir
-        # gets deleted
-        artifact.wait()
 
 
 def plot_feature_importance(pipe):
@@ -214,7 +255,7 @@ def get_training_inference_pipeline(args):
             ("classifier", RandomForestClassifier(**model_config["random_forest"])),
         ]
     )
-    return pipe, used_columns
+    return pipe, used_columns, model_config
 
 
 if __name__ == "__main__":
@@ -2,11 +2,17 @@
 import argparse
 import logging
 import os
+import sys
 import tempfile
 
-import pandas as pd
+import pyarrow.parquet as pq
 import wandb
-from sklearn.model_selection import train_test_split
+
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pipeline_utils.artifacts import Artifacts, file_digest
+from pipeline_utils.splits import save_manifest, split_indices
+from pipeline_utils.tables import read_table, write_table
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -16,32 +22,58 @@ logger = logging.getLogger()
 def go(args):
 
     run = wandb.init(job_type="split_data")
+    artifacts = Artifacts.from_env(run)
+
+    # The manifests point to this exact version of the dataset, not to
+    # an alias which moves when a new version is logged
+    dataset = artifacts.resolve(args.input_artifact)
 
     logger.info("Downloading and reading artifact")
-    artifact = run.use_artifact(args.input_artifact)
-    artifact_path = artifact.file()
+    artifact_path = artifacts.file(dataset)
 
-    df = pd.read_csv(artifact_path, low_memory=False)
+    # Only the stratification column is needed to draw the split
+    n_rows = pq.read_metadata(artifact_path).num_rows
+    stratify = None
+    if args.stratify != 'null':
+        stratify = read_table(artifact_path, columns=[args.stratify])[args.stratify]
 
     # Split first in model_dev/test, then we further divide model_dev in train and validation
     logger.info("Splitting data into train, val and test")
     splits = {}
 
-    splits["train"], splits["test"] = train_test_split(
-        df,
+    splits["train"], splits["test"] = split_indices(
+        n_rows,
         test_size=args.test_size,
         random_state=args.random_state,
-        stratify=df[args.stratify] if args.stratify != 'null' else None,
+        stratify=stratify,
     )
 
+    # Where the split comes from, so that it can be checked and reproduced
+    metadata = {
+        "dataset": dataset,
+        "dataset_sha256": file_digest(artifact_path),
+        "rows": n_rows,
+        "test_size": args.test_size,
+        "random_state": args.random_state,
+        "stratify": args.stratify,
+    }
+
+    # In table mode each split is a copy of its rows, otherwise a manifest
+    # of their indices in the input dataset
+    if args.split_mode == "table":
+        df = read_table(artifact_path)
+        extension = "parquet"
+    else:
+        extension = "npz"
+
     # Save the artifacts. We use a temporary directory so we do not leave
     # any trace behind
     with tempfile.TemporaryDirectory() as tmp_dir:
 
-        for split, df in splits.items():
+        for split, indices in splits.items():
 
             # Make the artifact name from the provided root plus the name of the split
-            artifact_name = f"{args.artifact_root}_{split}.csv"
+            artifact_name = f"{args.artifact_root}_{split}.{extension}"
 
             # Get the path on disk within the temp directory
             temp_path = os.path.join(tmp_dir, artifact_name)
@@ -49,23 +81,22 @@ def go(args):
             logger.info(f"Uploading the {split} dataset to {artifact_name}")
 
             # Save then upload to W&B
-            df.to_csv(temp_path)
-
-            artifact = wandb.Artifact(
-                name=artifact_name,
-                type=args.artifact_type,
-                description=f"{split} split of dataset {args.input_artifact}",
-            )
-            artifact.add_file(temp_path)
-
+            if args.split_mode == "table":
+                write_table(df.iloc[indices], temp_path)
+            else:
+                save_manifest(temp_path, indices, split=split, **metadata)
+
+            # This waits for the artifact to be uploaded to W&B, so the
+            # temp directory is not removed before W&B had a chance to
+            # upload the datasets
             logger.info("Logging artifact")
-            run.log_artifact(artifact)
-
-            # This waits for the artifact to be uploaded to W&B. If you
-            # do not add this, the temp directory might be removed before
-            # W&B had a chance to upload the datasets, and the upload
-            # might fail
-            artifact.wait()
+            artifacts.log(
+                artifact_name,
+                temp_path,
+                artifact_type=args.artifact_type,
+                description=f"{split} split of dataset {dataset}",
+                metadata=dict(metadata, split=split, split_rows=len(indices)),
+            )
 
 
 if __name__ == "__main__":
@@ -85,7 +116,8 @@ if __name__ == "__main__":
         "--artifact_root",
         type=str,
         help="Root for the names of the produced artifacts. The script will produce 2 artifacts: "
-             "{root}_train.csv and {root}_test.csv",
+             "{root}_train.npz and {root}_test.npz ({root}_train.parquet and "
+             "{root}_test.parquet in table mode)",
         required=True,
     )
 
@@ -117,6 +149,16 @@ if __name__ == "__main__":
         default='null'  # unfortunately mlflow does not support well optional parameters
     )
 
+    parser.add_argument(
+        "--split_mode",
+        help="'index' to log the indices of the rows of each split in the input artifact, "
+             "'table' to log a copy of the rows of each split",
+        type=str,
+        choices=["index", "table"],
+        required=False,
+        default="index"
+    )
+
     args = parser.parse_args()
 
     go(args)
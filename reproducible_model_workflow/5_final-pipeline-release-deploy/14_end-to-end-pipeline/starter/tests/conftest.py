@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The utilities shared by the steps are in the parent folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+import pytest
+
+from pipeline_utils.artifacts import (Artifacts, ArtifactStore,
+                                      LocalArtifactServer, file_digest)
+
+
+def write(path, content):
+    with open(path, "wb") as fp:
+        fp.write(content)
+    return str(path)
+
+
+def read(path):
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "store"))
+
+
+def test_put_and_get(store, tmp_path):
+
+    files = {"a.bin": write(tmp_path / "a.bin", b"a" * 100),
+             "sub/b.bin": write(tmp_path / "b.bin", b"b" * 100)}
+    store.put("digest-1", files)
+
+    destination = tmp_path / "out"
+    assert store.get("digest-1", str(destination))
+    assert read(destination / "a.bin") == b"a" * 100
+    assert read(destination / "sub" / "b.bin") == b"b" * 100
+
+    # The copies of the store are read-only, the files put are not
+    sha = file_digest(files["a.bin"])
+    assert os.stat(store._object_path(sha)).st_mode & 0o222 == 0
+    assert os.stat(files["a.bin"]).st_mode & 0o200
+
+    assert not store.get("digest-2", str(tmp_path / "missing"))
+    assert not os.path.exists(tmp_path / "missing")
+
+
+def test_same_content_stored_once(store, tmp_path):
+
+    store.put("digest-1", {"a.bin": write(tmp_path / "a.bin", b"same")})
+    store.put("digest-2", {"b.bin": write(tmp_path / "b.bin", b"same")})
+
+    objects = [name for _, _, names
+               in os.walk(os.path.join(store.root, "objects"))
+               for name in names]
+    assert len(objects) == 1
+
+
+def test_put_link_keeps_the_mode_of_the_step_file(store, tmp_path):
+
+    path = write(tmp_path / "output.bin", b"output")
+    store.put("digest-1", {"output.bin": path}, link=True)
+
+    # Linked, not copied, and the step can still write its file
+    sha = file_digest(path)
+    assert os.path.samefile(path, store._object_path(sha))
+    assert os.stat(path).st_mode & 0o200
+
+
+def test_evict_least_recently_used(tmp_path):
+
+    store = ArtifactStore(str(tmp_path / "store"), max_bytes=250)
+    shared = write(tmp_path / "shared.bin", b"s" * 50)
+
+    store.put("old", {"old.bin": write(tmp_path / "old.bin", b"o" * 100),
+                      "shared.bin": shared})
+    store.put("used", {"used.bin": write(tmp_path / "used.bin", b"u" * 100)})
+
+    # "used" becomes the most recently used, then "new" fills the store
+    # past its limit
+    past = time.time() - 10
+    os.utime(store._manifest_path("old"), (past, past))
+    os.utime(store._manifest_path("used"), (past + 1, past + 1))
+    assert store.get("used", str(tmp_path / "out"))
+    store.put("new", {"new.bin": write(tmp_path / "new.bin", b"n" * 100),
+                      "shared.bin": shared})
+
+    assert not store.get("old", str(tmp_path / "old"))
+    assert store.get("used", str(tmp_path / "used"))
+    assert store.get("new", str(tmp_path / "new"))
+
+    # Only the files no other artifact uses were removed
+    assert not os.path.exists(store._object_path(file_digest(
+        str(tmp_path / "old.bin"))))
+    assert os.path.exists(store._object_path(file_digest(shared)))
+
+
+def test_lock_waits_for_the_holder(store):
+
+    events = []
+    holding = threading.Event()
+
+    def hold():
+        with store.lock("key"):
+            holding.set()
+            time.sleep(0.2)
+            events.append("released")
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    with store.lock("key"):
+        events.append("acquired")
+    thread.join()
+
+    assert events == ["released", "acquired"]
+
+    # Other keys are not locked
+    with store.lock("key"):
+        with store.lock("other"):
+            pass
+
+
+def test_server_versions_and_aliases(tmp_path):
+
+    server = LocalArtifactServer(str(tmp_path / "server"))
+    first = server.log("data.csv", {"data.csv": write(tmp_path / "1", b"1")},
+                       "raw_data", "first", aliases=["prod"])
+    second = server.log("data.csv", {"data.csv": write(tmp_path / "2", b"2")},
+                        "raw_data", "second")
+
+    assert server.resolve("data.csv")[0] == second
+    assert server.resolve("project/data.csv:latest")[0] == second
+    assert server.resolve("data.csv:v0")[0] == first
+    assert server.resolve("data.csv:prod")[0] == first
+    assert os.path.basename(server.resolve("data.csv")[1]) == "v1"
+
+    with pytest.raises(ValueError):
+        server.resolve("data.csv:v2")
+    with pytest.raises(ValueError):
+        server.resolve("other.csv")
+
+
+def test_server_skips_unfinished_versions(tmp_path):
+
+    server = LocalArtifactServer(str(tmp_path / "server"))
+    server.log("data.csv", {"data.csv": write(tmp_path / "1", b"1")},
+               "raw_data", "first")
+
+    # A step stopped after reserving v1, before writing its .json
+    os.mkdir(tmp_path / "server" / "data.csv" / "v1")
+
+    server.log("data.csv", {"data.csv": write(tmp_path / "2", b"2")},
+               "raw_data", "second")
+    _, folder = server.resolve("data.csv:latest")
+    assert os.path.basename(folder) == "v2"
+    assert read(os.path.join(folder, "data.csv")) == b"2"
+
+
+def test_artifacts_offline(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("PIPELINE_ARTIFACT_STORE", str(tmp_path / "store"))
+    monkeypatch.setenv("PIPELINE_ARTIFACT_SERVER", str(tmp_path / "server"))
+    artifacts = Artifacts.from_env(run=None)
+
+    artifacts.log("data.csv", write(tmp_path / "data.csv", b"a,b\n1,2\n"),
+                  "raw_data", "Data")
+    assert artifacts.resolve("data.csv:latest") == "data.csv:v0"
+
+    # Linked from the store, where the log put it
+    path = artifacts.file("data.csv:latest", root=str(tmp_path / "step"))
+    assert read(path) == b"a,b\n1,2\n"
+    assert os.path.samefile(
+        path, artifacts.store._object_path(file_digest(path)))
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+import pytest
+import requests
+
+from pipeline_utils.artifacts import ArtifactStore
+from pipeline_utils.download import RangedDownload
+from pipeline_utils.local_http import serve
+
+# Errors of a download cut by the server
+INTERRUPTED = (requests.RequestException, RuntimeError)
+
+
+@pytest.fixture
+def source(tmp_path):
+
+    # A file of 1 MB on the server, and where the download writes it
+    folder = tmp_path / "server"
+    folder.mkdir()
+    content = os.urandom(1 << 20)
+    (folder / "data.bin").write_bytes(content)
+    return str(folder), content, str(tmp_path / "data.bin")
+
+
+def test_resume_interrupted_download(source):
+
+    folder, content, path = source
+
+    # Every response is cut after 100 kB, so that a part needs several
+    # runs to complete
+    with serve(folder, max_bytes=100000) as url:
+        download = RangedDownload(f"{url}/data.bin", path, parts=4,
+                                  chunk_size=1 << 16)
+        with pytest.raises(INTERRUPTED):
+            download.run()
+
+        assert not os.path.exists(path)
+        with open(f"{path}.part.json") as fp:
+            state = json.load(fp)
+        received = sum(part[2] for part in state["parts"])
+        assert 0 < received < len(content)
+
+        # Every run fetches only the missing bytes of the parts
+        runs = 1
+        while True:
+            runs += 1
+            try:
+                report = download.run()
+                break
+            except INTERRUPTED:
+                assert runs < 10
+
+    assert report["resumed_bytes"] > received
+    assert report["sha256"] == hashlib.sha256(content).hexdigest()
+    with open(path, "rb") as fp:
+        assert fp.read() == content
+    assert not os.path.exists(f"{path}.part")
+    assert not os.path.exists(f"{path}.part.json")
+
+
+def test_checksum_mismatch(source):
+
+    folder, content, path = source
+
+    with serve(folder) as url:
+        download = RangedDownload(f"{url}/data.bin", path, parts=4,
+                                  chunk_size=1 << 16)
+        with pytest.raises(ValueError, match="Checksum mismatch"):
+            download.run(f"sha256:{hashlib.sha256(b'other').hexdigest()}")
+
+    # Nothing is left to resume from
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.part")
+    assert not os.path.exists(f"{path}.part.json")
+
+
+def test_second_download_from_store(source, tmp_path):
+
+    folder, content, path = source
+    store = ArtifactStore(str(tmp_path / "store"))
+
+    with serve(folder) as url:
+        first = RangedDownload(f"{url}/data.bin", path, parts=4,
+                               chunk_size=1 << 16, store=store).run()
+        assert not first["from_store"]
+
+        # Same URL and ETag: the file is linked from the store, through
+        # the sha remembered for the source
+        etag = first["etag"]
+        assert store.source_sha(f"{url}/data.bin {etag}") == first["sha256"]
+
+        second_path = str(tmp_path / "again.bin")
+        second = RangedDownload(f"{url}/data.bin", second_path, parts=4,
+                                chunk_size=1 << 16, store=store).run()
+
+    assert second["from_store"]
+    assert second["sha256"] == first["sha256"]
+    with open(second_path, "rb") as fp:
+        assert fp.read() == content
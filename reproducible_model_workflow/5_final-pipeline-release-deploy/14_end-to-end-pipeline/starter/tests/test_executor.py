@@ -0,0 +1,139 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import mlflow
+import pytest
+
+from pipeline_utils.executor import Step, StepExecutor
+
+
+def step(name, uri, inputs=(), outputs=()):
+    # The name is passed to the run, to know which step it runs
+    return Step(name, uri, {"step": name}, inputs=inputs, outputs=outputs)
+
+
+def pipeline_steps():
+    return [
+        step("download", "download", outputs=["raw_data.parquet"]),
+        step("preprocess", "preprocess",
+             inputs=["raw_data.parquet:latest"],
+             outputs=["preprocessed_data.parquet"]),
+        step("check_data", "check_data",
+             inputs=["reference_profile.npz:latest",
+                     "preprocessed_data.parquet:latest"]),
+        step("segregate", "segregate",
+             inputs=["preprocessed_data.parquet:latest"],
+             outputs=["data_train.npz", "data_test.npz"]),
+        step("random_forest", "random_forest",
+             inputs=["data_train.npz:latest"], outputs=["model_export"]),
+        step("random_forest_deep", "random_forest",
+             inputs=["data_train.npz:latest"]),
+        step("evaluate", "evaluate",
+             inputs=["model_export:latest", "data_test.npz:latest"]),
+    ]
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """
+    Replaces the MLflow runs: records when each step starts and ends, and
+    fails the steps named in runs["fail"].
+    """
+    runs = {"events": [], "fail": set(), "barrier": None}
+    lock = threading.Lock()
+
+    def run(uri, entry_point, parameters, use_conda):
+        name = parameters["step"]
+        with lock:
+            runs["events"].append(("start", name))
+        if runs["barrier"] is not None and uri == "random_forest":
+            # Both variants must be running at the same time to pass
+            runs["barrier"].wait(timeout=5)
+        time.sleep(0.01)
+        with lock:
+            runs["events"].append(("end", name))
+        if name in runs["fail"]:
+            raise RuntimeError(f"{name} failed")
+        return SimpleNamespace(run_id=f"run-{name}")
+
+    monkeypatch.setattr(mlflow, "run", run)
+    return runs
+
+
+def test_dependencies():
+
+    executor = StepExecutor(pipeline_steps(), use_conda=False)
+
+    assert executor.dependencies == {
+        "download": set(),
+        "preprocess": {"download"},
+        # reference_profile.npz is not produced by a selected step
+        "check_data": {"preprocess"},
+        "segregate": {"preprocess"},
+        "random_forest": {"segregate"},
+        "random_forest_deep": {"segregate"},
+        "evaluate": {"random_forest", "segregate"},
+    }
+
+
+def test_run_in_dependency_order(runs):
+
+    runs["barrier"] = threading.Barrier(2)
+    executor = StepExecutor(pipeline_steps(), max_workers=4, use_conda=False)
+    timeline = executor.run()
+
+    events = runs["events"]
+    assert len(events) == 2 * len(executor.steps)
+    for name, deps in executor.dependencies.items():
+        start = events.index(("start", name))
+        for dep in deps:
+            assert events.index(("end", dep)) < start
+
+    assert all(record["status"] == "done" for record in timeline.values())
+    assert timeline["evaluate"]["run_id"] == "run-evaluate"
+
+
+def test_skip_dependents_of_failed_step(runs):
+
+    runs["fail"] = {"segregate"}
+    executor = StepExecutor(pipeline_steps(), use_conda=False)
+
+    with pytest.raises(RuntimeError, match="Failed steps: evaluate, "
+                       "random_forest, random_forest_deep, segregate"):
+        executor.run()
+
+    statuses = {name: record["status"]
+                for name, record in executor.timeline.items()}
+    assert statuses == {
+        "download": "done",
+        "preprocess": "done",
+        "check_data": "done",
+        "segregate": "failed",
+        "random_forest": "skipped",
+        "random_forest_deep": "skipped",
+        "evaluate": "skipped",
+    }
+    started = {name for kind, name in runs["events"] if kind == "start"}
+    assert started == {"download", "preprocess", "check_data", "segregate"}
+
+    # Skipped steps are listed in the report, without a bar
+    assert "evaluate" in executor.report(1.0)
+
+
+def test_circular_dependencies(runs):
+
+    steps = [step("a", "a", inputs=["b.csv"], outputs=["a.csv"]),
+             step("b", "b", inputs=["a.csv"], outputs=["b.csv"])]
+
+    with pytest.raises(RuntimeError, match="Circular dependencies between a, b"):
+        StepExecutor(steps, use_conda=False).run()
+    assert runs["events"] == []
+
+
+def test_no_steps(runs):
+
+    executor = StepExecutor([], use_conda=False)
+
+    assert executor.run() == {}
+    assert executor.report(0.0) == "Wall time 0.0s for 0.0s of steps"
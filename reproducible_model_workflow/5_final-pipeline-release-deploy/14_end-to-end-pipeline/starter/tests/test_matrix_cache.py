@@ -0,0 +1,107 @@
+import mmap
+
+import numpy as np
+import pytest
+import scipy.sparse
+import sklearn
+
+from pipeline_utils.artifacts import ArtifactStore
+from pipeline_utils.matrix_cache import cached_preprocessing, matrix_key
+
+
+MODEL_CONFIG = {"features": {"numerical": ["tempo"]},
+                "tfidf": {"max_features": 10}}
+SPLIT = {"val_size": 0.3, "random_seed": 42, "stratify": "genre"}
+
+
+def preprocess():
+    return {"scale": 2.0}, {
+        "train": np.arange(12, dtype=np.float32).reshape(4, 3),
+        "val": scipy.sparse.random(5, 8, density=0.3, format="csr",
+                                   random_state=0, dtype=np.float32),
+    }
+
+
+def other_preprocess():
+    return {"scale": 3.0}, {}
+
+
+def is_mapped(array):
+    """
+    Whether the array is a view of a memory-mapped file, and not a copy.
+    """
+    while array is not None:
+        if isinstance(array, mmap.mmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def test_matrix_key():
+
+    key = matrix_key("digest", MODEL_CONFIG, SPLIT, code=[preprocess])
+    assert key == matrix_key("digest", MODEL_CONFIG, SPLIT, code=[preprocess])
+
+    # Every input of the preprocessing is part of the key
+    assert key != matrix_key("other", MODEL_CONFIG, SPLIT, code=[preprocess])
+    assert key != matrix_key("digest", dict(MODEL_CONFIG, tfidf={"max_features": 5}),
+                             SPLIT, code=[preprocess])
+    assert key != matrix_key("digest", MODEL_CONFIG, dict(SPLIT, random_seed=0),
+                             code=[preprocess])
+    assert key != matrix_key("digest", MODEL_CONFIG, SPLIT, code=[other_preprocess])
+
+
+def test_matrix_key_sklearn_version(monkeypatch):
+
+    key = matrix_key("digest", MODEL_CONFIG, SPLIT, code=[preprocess])
+    monkeypatch.setattr(sklearn, "__version__", "0.0.1")
+    assert key != matrix_key("digest", MODEL_CONFIG, SPLIT, code=[preprocess])
+
+
+def test_cached_preprocessing(tmp_path):
+
+    store = ArtifactStore(str(tmp_path / "store"))
+    key = matrix_key("digest", MODEL_CONFIG, SPLIT, code=[preprocess])
+    calls = []
+
+    def compute():
+        calls.append(key)
+        return preprocess()
+
+    first_folder = tmp_path / "first"
+    first_folder.mkdir()
+    preprocessor, first = cached_preprocessing(store, key, compute,
+                                               str(first_folder))
+    assert len(calls) == 1
+
+    # The second run is served from the store, without computing
+    second_folder = tmp_path / "second"
+    second_folder.mkdir()
+    cached, second = cached_preprocessing(store, key, compute,
+                                          str(second_folder))
+    assert len(calls) == 1
+    assert cached == preprocessor
+
+    assert is_mapped(second["train"])
+    assert second["train"].dtype == np.float32
+    np.testing.assert_array_equal(second["train"], first["train"])
+
+    assert scipy.sparse.isspmatrix_csr(second["val"])
+    assert second["val"].dtype == np.float32
+    assert all(is_mapped(getattr(second["val"], part))
+               for part in ("data", "indices", "indptr"))
+    assert (second["val"] != first["val"]).nnz == 0
+    assert second["val"].shape == first["val"].shape
+
+
+def test_cached_preprocessing_without_store(tmp_path):
+
+    calls = []
+
+    def compute():
+        calls.append(True)
+        return preprocess()
+
+    for _ in range(2):
+        cached_preprocessing(None, "key", compute, str(tmp_path))
+    assert len(calls) == 2